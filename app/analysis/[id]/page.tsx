@@ -26,25 +26,43 @@ export default function AnalysisPage() {
   const [error, setError] = useState<string | null>(null)
 
   useEffect(() => {
+    let cancelled = false
+    let retryTimer: ReturnType<typeof setTimeout> | undefined
+
     const fetchAnalysis = async () => {
       try {
         const res = await fetch(`${process.env.NEXT_PUBLIC_API_URL}/api/sessions/${sessionId}/analysis`)
-        
+
         if (!res.ok) throw new Error("Failed to fetch analysis")
-        
+
+        // 202 means the analysis job is still queued or running
+        if (res.status === 202) {
+          if (!cancelled) retryTimer = setTimeout(fetchAnalysis, 1500)
+          return
+        }
+
         const data = await res.json()
-        setAnalysis(data)
+        if (!cancelled) {
+          setAnalysis(data)
+          setLoading(false)
+        }
       } catch (err) {
-        setError("Failed to load analysis. Please try again.")
+        if (!cancelled) {
+          setError("Failed to load analysis. Please try again.")
+          setLoading(false)
+        }
         console.error(err)
-      } finally {
-        setLoading(false)
       }
     }
 
     if (sessionId) {
       fetchAnalysis()
     }
+
+    return () => {
+      cancelled = true
+      clearTimeout(retryTimer)
+    }
   }, [sessionId])
 
   if (loading) {
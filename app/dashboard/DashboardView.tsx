@@ -37,33 +37,25 @@ export default function DashboardView({ userName, userImage, userEmail }: Dashbo
       try {
         // Use email as user_id, fallback to demo_user
         const userId = userEmail || 'demo_user'
-        const res = await fetch(`${process.env.NEXT_PUBLIC_API_URL}/api/users/${userId}/sessions`)
-        
-        if (res.ok) {
-          const data = await res.json()
-          const userSessions = data.sessions || []
-          setSessions(userSessions)
-          
-          // Calculate real stats from sessions
-          const completed = userSessions.filter((s: SessionData) => s.status === 'completed')
-          const avgTurns = completed.length > 0 
-            ? completed.reduce((acc: number, s: any) => acc + (s.turns_count || 5), 0) / completed.length 
-            : 0
-          
-          // Calculate actual time spent in minutes (UTC timestamps work correctly for duration)
-          const totalMinutes = userSessions.reduce((total: number, s: SessionData) => {
-            const start = new Date(s.created_at + 'Z').getTime() // Add Z to parse as UTC
-            const end = s.completed_at ? new Date(s.completed_at + 'Z').getTime() : Date.now()
-            const durationMs = end - start
-            const minutes = Math.round(durationMs / 1000 / 60)
-            return total + minutes
-          }, 0)
-          
+        const api = `${process.env.NEXT_PUBLIC_API_URL}/api/users/${userId}`
+        // Totals come from the materialized profile; the list only needs the latest page
+        const [profileRes, sessionsRes] = await Promise.all([
+          fetch(`${api}/profile`),
+          fetch(`${api}/sessions?limit=5`)
+        ])
+
+        if (sessionsRes.ok) {
+          const data = await sessionsRes.json()
+          setSessions(data.sessions || [])
+        }
+
+        if (profileRes.ok) {
+          const profile = await profileRes.json()
           setStats({
-            totalSessions: userSessions.length,
-            completedSessions: completed.length,
-            avgScore: completed.length > 0 ? Math.round(completed.length * 100 / userSessions.length) : 0,
-            totalTime: totalMinutes
+            totalSessions: profile.sessions_started,
+            completedSessions: profile.sessions_completed,
+            avgScore: profile.sessions_started > 0 ? Math.round(profile.sessions_completed * 100 / profile.sessions_started) : 0,
+            totalTime: profile.practice_minutes
           })
         }
       } catch (err) {
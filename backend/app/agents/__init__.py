@@ -1,13 +1,27 @@
 from .core import (
     scenario_designer_agent,
     opponent_agent,
+    opponent_prompt_prefix,
+    opponent_agent_stream,
     shadow_coach_agent,
-    analyst_agent
+    analyst_agent,
+    summarizer_agent,
+    turn_review_agent,
+    score_turn,
+    stall_line
 )
+from .gateway import LLMUnavailable
 
 __all__ = [
     'scenario_designer_agent',
     'opponent_agent',
+    'opponent_prompt_prefix',
+    'opponent_agent_stream',
     'shadow_coach_agent',
-    'analyst_agent'
+    'analyst_agent',
+    'summarizer_agent',
+    'turn_review_agent',
+    'score_turn',
+    'stall_line',
+    'LLMUnavailable'
 ]
@@ -1,16 +1,27 @@
 """All agent functions in one file"""
-from langchain_groq import ChatGroq
+from . import gateway
+from .lexicon import get_lexicon
+from .prompts import Prompt, record_usage
+from .routing import FAST, MAIN, check_draft, choose_tier, record_route
+from .schemas import ScenarioDesign, TurnReview, AnalystReport
+from .structured import structured_call
 from ..config import get_settings
+from ..tracing import span
 import json
-from typing import List, Dict, Any
+import random
+import time
+from contextlib import aclosing
+from typing import List, Dict, Any, Optional, AsyncIterator, Tuple
 
 settings = get_settings()
+
 MAIN_MODEL = "llama-3.3-70b-versatile"
 COACH_MODEL = "llama-3.1-8b-instant"
 
-def scenario_designer_agent(scenario_type: str, difficulty: str) -> Dict[str, Any]:
-    llm = ChatGroq(model=MAIN_MODEL, temperature=0.7, api_key=settings.groq_api_key)
-    prompt = f"""You are a negotiation scenario designer. Create a realistic {scenario_type} scenario at {difficulty} difficulty level.
+# Static instructions go in the system message, ahead of anything that changes
+# per call, so every call with the same agent shares a cacheable prefix.
+
+SCENARIO_DESIGNER_PREFIX = """You are a negotiation scenario designer.
 
 Design the opponent:
 1. Personality archetype (choose from: collaborative, assertive, resistant, bureaucratic)
@@ -20,18 +31,86 @@ Design the opponent:
 5. Opening statement (natural, in-character)
 
 Return ONLY valid JSON in this exact format:
-{{
+{
   "personality": "assertive",
   "patience": 75,
-  "constraints": {{
+  "constraints": {
     "budget_max": 120000,
     "policy": "raises capped at 10%"
-  }},
+  },
   "batna": "hire external candidate at market rate",
   "opening": "Hi! I understand you wanted to discuss your compensation?"
-}}"""
-    response = llm.invoke(prompt)
-    config = json.loads(response.content)
+}"""
+
+MOOD_INSTRUCTIONS = {
+    "curious": "You're interested and open to discussion. Ask clarifying questions.",
+    "neutral": "You're professional but reserved. Give measured responses.",
+    "defensive": "You're starting to push back. Reference constraints and policies.",
+    "hostile": "You're losing patience. Consider ending the conversation or giving ultimatums."
+}
+
+SHADOW_COACH_PREFIX = """You are a negotiation coach. Analyze the user's message and give ONE short tactical tip (max 20 words).
+
+Provide a specific, actionable tip. Examples:
+- "Anchor high - state a specific number first."
+- "Ask about their constraints before revealing yours."
+- "Mirror their language to build rapport."
+
+Reply with the tip only."""
+
+SUMMARIZER_PREFIX = """You maintain a running summary of a negotiation practice session.
+
+Rewrite the current summary so it also covers the new exchanges. Keep offers, numbers, concessions, tactics the user tried and how the opponent reacted. Max 150 words. Reply with the updated summary only."""
+
+TURN_REVIEW_PREFIX = """You are a negotiation coach reviewing a few turns of an ongoing practice session.
+
+List what the user did well and badly in THESE turns only. Return ONLY valid JSON, no markdown:
+{
+  "strengths": [{"point": "Short title", "explanation": "Quote the user and say why it helped (turn number)"}],
+  "mistakes": [{"point": "Short title", "explanation": "Quote the user and say why it hurt (turn number)"}]
+}
+Use empty lists if nothing stands out."""
+
+ANALYST_PREFIX = """You are an expert negotiation coach analyzing a completed negotiation session.
+
+Provide structured coaching feedback in this EXACT JSON format:
+{
+  "summary": "2-3 sentence overall assessment of their negotiation approach and outcome. Focus on strategy quality, communication style, and whether they achieved a good result. Avoid just listing metrics.",
+  "outcome": "The OUTCOME given with the final metrics, copied exactly",
+  "strengths": [
+    {"point": "Specific strength title", "explanation": "Why this was effective - include numbers/percentages when relevant"},
+    {"point": "Another strength", "explanation": "Details with specific examples from transcript"}
+  ],
+  "mistakes": [
+    {"point": "Critical error", "explanation": "Why this hurt their position - quantify impact if possible (e.g., 'dropped leverage by 15%')"},
+    {"point": "Another mistake", "explanation": "Specific consequence with numbers"}
+  ],
+  "skill_gaps": ["Anchoring", "Active Listening", "BATNA Development"]
+}
+
+BE SPECIFIC. Use actual quotes from transcript. In the summary, focus on overall approach quality and negotiation outcome, NOT just listing final leverage/patience numbers. Include strategic insights. Output ONLY valid JSON, no markdown."""
+
+# Said by the opponent when the provider is unavailable, so the turn still goes through
+STALL_LINES = [
+    "Let me think about that for a moment. Can you walk me through your reasoning again?",
+    "I need a second to consider that. What matters most to you here?",
+    "Hold on, I want to make sure I understand. Could you say more about what you're proposing?"
+]
+
+def stall_line() -> str:
+    return random.choice(STALL_LINES)
+
+async def _invoke(model: str, temperature: float, prompt: Prompt) -> str:
+    with span("agent", prompt.agent, model=model):
+        started = time.perf_counter()
+        tokens = prompt.section_tokens()
+        response = await gateway.invoke(model, temperature, prompt.messages(), sum(tokens.values()))
+        record_usage(prompt.agent, started, tokens, response.usage_metadata, response.content, prompt.trimmed_lines)
+        return response.content
+
+async def scenario_designer_agent(scenario_type: str, difficulty: str) -> Dict[str, Any]:
+    prompt = Prompt("scenario_designer", SCENARIO_DESIGNER_PREFIX).add("request", f"Create a realistic {scenario_type} scenario at {difficulty} difficulty level.")
+    config = (await structured_call(MAIN_MODEL, 0.7, prompt, ScenarioDesign)).model_dump()
     initial_patience_map = {"beginner": 80, "intermediate": 60, "advanced": 40}
     return {
         "personality": config["personality"],
@@ -41,110 +120,163 @@ Return ONLY valid JSON in this exact format:
         "opening_message": config["opening"]
     }
 
-def opponent_agent(user_message: str, history: List[Dict[str, str]], scenario_type: str, personality: str, mood: str, patience: int, constraints: Dict, batna: str, current_leverage: int) -> Dict[str, Any]:
-    llm = ChatGroq(model=MAIN_MODEL, temperature=0.8, api_key=settings.groq_api_key)
-    patience_delta = _calculate_patience_change(user_message)
-    new_patience = max(0, min(100, patience + patience_delta))
-    new_mood = _determine_mood(new_patience)
-    recent_history = "\n".join([f"{msg['role'].capitalize()}: {msg['content']}" for msg in history[-6:]])
-    mood_instructions = {
-        "curious": "You're interested and open to discussion. Ask clarifying questions.",
-        "neutral": "You're professional but reserved. Give measured responses.",
-        "defensive": "You're starting to push back. Reference constraints and policies.",
-        "hostile": "You're losing patience. Consider ending the conversation or giving ultimatums."
-    }
-    prompt = f"""You are a {personality} manager in a {scenario_type} negotiation.
+def score_turn(user_message: str, history: List[Dict[str, str]], patience: int, current_leverage: int) -> Dict[str, Any]:
+    """Heuristic patience/mood/leverage update for a user turn. Needs no LLM output,
+    so callers can start the coach tip before the opponent reply exists."""
+    with span("heuristics", "score_turn"):
+        features = get_lexicon().extract(user_message)
+        new_patience = max(0, min(100, patience + _calculate_patience_change(features)))
+        return {
+            "new_mood": _determine_mood(new_patience),
+            "new_patience": new_patience,
+            "new_leverage": _calculate_leverage(features, current_leverage),
+            "features": features
+        }
 
-Your current state:
-- Mood: {new_mood} ({mood_instructions.get(new_mood, 'professional')})
-- Patience: {new_patience}/100
-- Hidden constraints: {json.dumps(constraints)}
-- BATNA: {batna}
+def opponent_prompt_prefix(scenario_type: str, personality: str, constraints: Dict, batna: str) -> str:
+    """The part of the opponent prompt that is fixed for a whole session.
+    Sessions store it at creation so it stays byte-identical on every turn."""
+    moods = "\n".join(f"- {mood}: {instruction}" for mood, instruction in MOOD_INSTRUCTIONS.items())
+    return f"""You are a {personality} manager in a {scenario_type} negotiation.
 
-Recent conversation:
-{recent_history}
+Hidden constraints: {json.dumps(constraints, sort_keys=True)}
+BATNA: {batna}
 
-User just said: "{user_message}"
+How to behave in each mood:
+{moods}
 
 Respond naturally in character. Keep it under 100 words. DO NOT reveal exact constraint numbers unless user has earned it through strong negotiation."""
-    response = llm.invoke(prompt)
-    new_leverage = _calculate_leverage(user_message, response.content, history, current_leverage)
+
+def _opponent_prompt(user_message: str, history: List[Dict[str, str]], prefix: str, scores: Dict[str, Any], agent: str = "opponent") -> Prompt:
+    new_mood = scores["new_mood"]
+    with span("prompt", agent):
+        prompt = Prompt(agent, prefix).add("state", f"""Your current state:
+- Mood: {new_mood} ({MOOD_INSTRUCTIONS.get(new_mood, 'professional')})
+- Patience: {scores["new_patience"]}/100""").add_lines(
+            "history", "Recent conversation:\n", [f"{msg['role'].capitalize()}: {msg['content']}" for msg in history[-6:]]
+        ).add("message", f'User just said: "{user_message}"')
+        prompt.fit(settings.opponent_prompt_budget)
+    return prompt
+
+async def _opponent_draft(user_message: str, history: List[Dict[str, str]], prefix: str, constraints: Dict, scores: Dict[str, Any]) -> Tuple[str, List[str]]:
+    """Fast-tier reply and the problems that rule it out (empty if it can be served)."""
+    try:
+        draft = (await _invoke(COACH_MODEL, 0.8, _opponent_prompt(user_message, history, prefix, scores, "opponent_draft"))).strip()
+    except gateway.LLMUnavailable as e:
+        return "", [f"draft unavailable ({e})"]
+    return draft, check_draft(draft, user_message, constraints)
+
+async def opponent_agent(user_message: str, history: List[Dict[str, str]], scenario_type: str, personality: str, mood: str, patience: int, constraints: Dict, batna: str, current_leverage: int, scores: Optional[Dict[str, Any]] = None, prompt_prefix: Optional[str] = None) -> Dict[str, Any]:
+    if scores is None:
+        scores = score_turn(user_message, history, patience, current_leverage)
+    prefix = prompt_prefix or opponent_prompt_prefix(scenario_type, personality, constraints, batna)
+    tier, reason = choose_tier(user_message, scores, current_leverage)
+    started = time.perf_counter()
+    draft_seconds = 0.0
+    problems: List[str] = []
+    if tier == FAST:
+        reply, problems = await _opponent_draft(user_message, history, prefix, constraints, scores)
+        draft_seconds = time.perf_counter() - started
+    if tier == MAIN or problems:
+        reply = await _invoke(MAIN_MODEL, 0.8, _opponent_prompt(user_message, history, prefix, scores))
+    record_route(tier, reason, MAIN if tier == MAIN or problems else FAST, time.perf_counter() - started, draft_seconds, problems)
     return {
-        "opponent_reply": response.content,
-        "new_mood": new_mood,
-        "new_patience": new_patience,
-        "new_leverage": new_leverage
+        "opponent_reply": reply,
+        "new_mood": scores["new_mood"],
+        "new_patience": scores["new_patience"],
+        "new_leverage": scores["new_leverage"]
     }
 
-def shadow_coach_agent(user_message: str, context: Dict[str, Any]) -> str:
-    llm = ChatGroq(model=COACH_MODEL, temperature=0.5, api_key=settings.groq_api_key)
-    leverage = context.get("leverage", 50)
-    mood = context.get("mood", "neutral")
-    patience = context.get("patience", 50)
-    prompt = f"""You are a negotiation coach. Analyze the user's message and give ONE short tactical tip (max 20 words).
+async def opponent_agent_stream(user_message: str, history: List[Dict[str, str]], scenario_type: str, personality: str, constraints: Dict, batna: str, scores: Dict[str, Any], prompt_prefix: Optional[str] = None, current_leverage: Optional[int] = None) -> AsyncIterator[str]:
+    """Yield opponent reply tokens as they arrive from the Groq stream. A
+    fast-tier draft has to pass its check before anything is sent, so it
+    arrives as one piece."""
+    prefix = prompt_prefix or opponent_prompt_prefix(scenario_type, personality, constraints, batna)
+    tier, reason = choose_tier(user_message, scores, current_leverage)
+    route_started = time.perf_counter()
+    draft_seconds = 0.0
+    problems: List[str] = []
+    if tier == FAST:
+        draft, problems = await _opponent_draft(user_message, history, prefix, constraints, scores)
+        draft_seconds = time.perf_counter() - route_started
+        if not problems:
+            record_route(tier, reason, FAST, draft_seconds)
+            yield draft
+            return
+    prompt = _opponent_prompt(user_message, history, prefix, scores)
+    parts: List[str] = []
+    usage = None
+    started = time.perf_counter()
+    tokens = prompt.section_tokens()
+    try:
+        with span("agent", prompt.agent, model=MAIN_MODEL, stream=True):
+            async with aclosing(gateway.stream(MAIN_MODEL, 0.8, prompt.messages(), sum(tokens.values()))) as chunks:
+                async for chunk in chunks:
+                    usage = chunk.usage_metadata or usage
+                    if chunk.content:
+                        parts.append(chunk.content)
+                        yield chunk.content
+        record_route(tier, reason, MAIN, time.perf_counter() - route_started, draft_seconds, problems)
+    finally:
+        record_usage(prompt.agent, started, tokens, usage, "".join(parts), prompt.trimmed_lines)
 
-User's message: "{user_message}"
+async def shadow_coach_agent(user_message: str, context: Dict[str, Any]) -> str:
+    prompt = Prompt("shadow_coach", SHADOW_COACH_PREFIX).add("message", f"User's message: \"{user_message}\"").add("context", f"""Context:
+- Current leverage: {context.get("leverage", 50)}/100
+- Opponent mood: {context.get("mood", "neutral")}
+- Opponent patience: {context.get("patience", 50)}/100
 
-Context:
-- Current leverage: {leverage}/100
-- Opponent mood: {mood}
-- Opponent patience: {patience}/100
+Your tip (max 20 words):""")
+    return (await _invoke(COACH_MODEL, 0.5, prompt)).strip()
 
-Provide a specific, actionable tip. Examples:
-- "Anchor high - state a specific number first."
-- "Ask about their constraints before revealing yours."
-- "Mirror their language to build rapport."
+async def summarizer_agent(summary: str, messages: List[Dict[str, Any]]) -> str:
+    prompt = Prompt("summarizer", SUMMARIZER_PREFIX).add("summary", f"Current summary:\n{summary or '(none yet)'}").add_lines(
+        "exchanges", "New exchanges to fold in:\n", [f"{msg['role'].capitalize()}: {msg['content']}" for msg in messages]
+    ).add("request", "Updated summary:")
+    return (await _invoke(COACH_MODEL, 0.2, prompt)).strip()
 
-Your tip (max 20 words):"""
-    response = llm.invoke(prompt)
-    return response.content.strip()
+async def turn_review_agent(scenario_type: str, exchanges: List[Dict[str, Any]]) -> Dict[str, Any]:
+    prompt = Prompt("turn_review", TURN_REVIEW_PREFIX).add("scenario", f"Scenario: {scenario_type}").add_lines(
+        "exchanges", "", [f"Turn {msg.get('turn', '?')} - {msg['role'].capitalize()}: {msg['content']}" for msg in exchanges]
+    )
+    return (await structured_call(COACH_MODEL, 0.3, prompt, TurnReview)).model_dump()
 
-def analyst_agent(history: List[Dict[str, str]], scenario_type: str, final_leverage: int, final_patience: int, leverage_trajectory: List[int], mood_trajectory: List[str]) -> Dict[str, Any]:
-    llm = ChatGroq(model=MAIN_MODEL, temperature=0.3, api_key=settings.groq_api_key)
-    transcript = "\n".join([f"Turn {i//2 + 1} - {msg['role'].capitalize()}: {msg['content']}" for i, msg in enumerate(history)])
+async def analyst_agent(history: List[Dict[str, str]], scenario_type: str, final_leverage: int, final_patience: int, leverage_trajectory: List[int], mood_trajectory: List[str], summary: str = "", key_turns: Optional[List[Dict[str, Any]]] = None, total_turns: Optional[int] = None, findings: str = "") -> Dict[str, Any]:
+    """``history`` may be just the recent window; earlier turns then arrive
+    folded into ``summary`` plus the verbatim ``key_turns``. ``findings`` are
+    notes accumulated during the session for the analyst to merge and polish.
+    Over ``analyst_prompt_budget``, the oldest transcript lines go first."""
+    if total_turns is None:
+        total_turns = len(history)//2
     if final_leverage >= 70 and final_patience >= 40:
         outcome = "Success"
     elif final_leverage >= 50 or final_patience >= 30:
         outcome = "Partial Success"
     else:
         outcome = "Failure"
-    prompt = f"""You are an expert negotiation coach analyzing a completed {scenario_type} session.
-
-CONVERSATION TRANSCRIPT:
-{transcript}
-
-FINAL METRICS:
+    prompt = Prompt("analyst", ANALYST_PREFIX).add("scenario", f"Scenario: {scenario_type}")
+    if summary:
+        prompt.add("summary", f"SUMMARY OF EARLIER TURNS:\n{summary}")
+    if key_turns:
+        prompt.add_lines("key_turns", "KEY TURNS (largest leverage swings):\n", [
+            f"Turn {t['turn']} (leverage {t['leverage_delta']:+d}) - User: {t['user']} | Assistant: {t['assistant']}" for t in key_turns
+        ])
+    if findings:
+        prompt.add_lines("findings", "FINDINGS COLLECTED DURING THE SESSION (merge, de-duplicate and polish these):\n", findings.split("\n"))
+    prompt.add_lines("transcript", "CONVERSATION TRANSCRIPT:\n", [
+        f"Turn {msg.get('turn', i//2 + 1)} - {msg['role'].capitalize()}: {msg['content']}" for i, msg in enumerate(history)
+    ]).add("metrics", f"""FINAL METRICS:
 - User Leverage: {final_leverage}/100
 - Opponent Patience: {final_patience}/100
-- Total Turns: {len(history)//2}
+- Total Turns: {total_turns}
 - Leverage Trajectory: {leverage_trajectory}
 - Mood Progression: {mood_trajectory}
-
-Provide structured coaching feedback in this EXACT JSON format:
-{{
-  "summary": "2-3 sentence overall assessment of their negotiation approach and outcome. Focus on strategy quality, communication style, and whether they achieved a good result. Avoid just listing metrics.",
-  "outcome": "{outcome}",
-  "strengths": [
-    {{"point": "Specific strength title", "explanation": "Why this was effective - include numbers/percentages when relevant"}},
-    {{"point": "Another strength", "explanation": "Details with specific examples from transcript"}}
-  ],
-  "mistakes": [
-    {{"point": "Critical error", "explanation": "Why this hurt their position - quantify impact if possible (e.g., 'dropped leverage by 15%')"}},
-    {{"point": "Another mistake", "explanation": "Specific consequence with numbers"}}
-  ],
-  "skill_gaps": ["Anchoring", "Active Listening", "BATNA Development"]
-}}
-
-BE SPECIFIC. Use actual quotes from transcript. In the summary, focus on overall approach quality and negotiation outcome, NOT just listing final leverage/patience numbers. Include strategic insights. Output ONLY valid JSON, no markdown."""
+- OUTCOME: {outcome}""")
+    with span("prompt", "analyst"):
+        prompt.fit(settings.analyst_prompt_budget, order=["transcript", "key_turns", "findings"])
     try:
-        response = llm.invoke(prompt)
-        content = response.content.strip()
-        # Remove markdown code blocks if present
-        if content.startswith("```"):
-            content = content.split("```")[1]
-            if content.startswith("json"):
-                content = content[4:]
-        result = json.loads(content)
+        result = (await structured_call(MAIN_MODEL, 0.3, prompt, AnalystReport, deadline=settings.llm_analysis_deadline_seconds)).model_dump()
+        result["outcome"] = result["outcome"] or outcome
         # Ensure all required fields exist
         if not result.get("strengths"):
             result["strengths"] = [{"point": "Session Completion", "explanation": "You completed the negotiation session."}]
@@ -153,10 +285,13 @@ BE SPECIFIC. Use actual quotes from transcript. In the summary, focus on overall
         if not result.get("skill_gaps"):
             result["skill_gaps"] = ["Anchoring", "Active Listening"]
         return result
+    except gateway.LLMUnavailable:
+        # Let the analysis job retry once the provider recovers
+        raise
     except Exception as e:
         print(f"ERROR in analyst_agent: {e}")
         return {
-            "summary": f"Completed {scenario_type} negotiation with {len(history)//2} turns. Final leverage: {final_leverage}%.", 
+            "summary": f"Completed {scenario_type} negotiation with {total_turns} turns. Final leverage: {final_leverage}%.", 
             "outcome": outcome, 
             "strengths": [
                 {"point": "Engagement", "explanation": "You actively participated in the negotiation."},
@@ -168,21 +303,8 @@ BE SPECIFIC. Use actual quotes from transcript. In the summary, focus on overall
             "skill_gaps": ["Anchoring", "Active Listening", "BATNA Development"]
         }
 
-def _calculate_patience_change(user_message: str) -> int:
-    msg_lower = user_message.lower()
-    if any(word in msg_lower for word in ["demand", "deserve", "must", "will not"]):
-        return -10
-    elif any(word in msg_lower for word in ["ultimatum", "competitor", "leaving"]):
-        return -15
-    elif msg_lower.count("i") > 5:
-        return -5
-    if any(phrase in msg_lower for phrase in ["understand", "appreciate", "help me understand"]):
-        return +5
-    elif "?" in user_message:
-        return +3
-    elif any(word in msg_lower for word in ["we", "together", "both"]):
-        return +5
-    return 0
+def _calculate_patience_change(features: Dict[str, int]) -> int:
+    return get_lexicon().patience_delta(features)
 
 def _determine_mood(patience: int) -> str:
     if patience >= 70:
@@ -194,72 +316,13 @@ def _determine_mood(patience: int) -> str:
     else:
         return "hostile"
 
-def _calculate_leverage(user_message: str, opponent_response: str, history: List[Dict], current_leverage: int) -> int:
-    leverage = current_leverage
-    msg_lower = user_message.lower()
-    
-    # Default small decrease each turn (negotiation is challenging)
-    leverage -= 2
-    
-    # HARSH/DEMANDING LANGUAGE - Severe penalties (checked first, blocks positive gains)
-    harsh_detected = False
-    
-    if any(word in msg_lower for word in ["demand", "must", "will not", "have to", "need to give me", "expect", "require", "insist"]):
-        leverage -= 18  # Very demanding = massive leverage loss
-        harsh_detected = True
-    
-    if any(word in msg_lower for word in ["unacceptable", "ridiculous", "joke", "insulting", "terrible", "pathetic", "stupid"]):
-        leverage -= 15  # Harsh criticism = massive loss
-        harsh_detected = True
-    
-    if any(word in msg_lower for word in ["ultimatum", "or else", "final offer", "take it or leave it", "last chance"]):
-        leverage -= 20  # Threats = extreme loss
-        harsh_detected = True
-    
-    if "deserve" in msg_lower and "because" not in msg_lower:
-        leverage -= 12  # Entitlement without justification
-        harsh_detected = True
-    
-    if any(word in msg_lower for word in ["better", "more"]) and "you better" in msg_lower:
-        leverage -= 10  # Threatening tone
-        harsh_detected = True
-    
-    # If harsh language detected, skip ALL positive gains
-    if harsh_detected:
-        import random
-        leverage += random.randint(-3, -1)  # Extra penalty variance
-        return max(10, min(90, leverage))
-    
-    # Positive leverage gains (ONLY if no harsh language)
-    if "?" in user_message and len([c for c in user_message if c == "?"]) >= 2:
-        leverage += 6  # Multiple questions = information gathering
-    elif "?" in user_message:
-        leverage += 4
-    
-    if any(word in msg_lower for word in ["achieved", "delivered", "increased", "saved", "results", "proven", "track record"]):
-        leverage += 8  # Concrete evidence
-    
-    if any(char.isdigit() for char in user_message) and any(word in msg_lower for word in ["percent", "%", "increase", "revenue", "saved"]):
-        leverage += 9  # Anchoring with numbers
-    
-    if any(word in msg_lower for word in ["market rate", "industry standard", "benchmark", "comparable"]):
-        leverage += 7  # Market comparison
-    
-    if any(word in msg_lower for word in ["alternative", "offer", "opportunity", "considering"]):
-        leverage += 6  # BATNA signal
-    
-    # Other negative behaviors
-    if msg_lower.count("sorry") > 0 or "apologize" in msg_lower:
-        leverage -= 8
-    
-    if any(word in msg_lower for word in ["please", "really hope", "would appreciate", "beg"]):
-        leverage -= 6  # Too submissive
-    
-    if any(word in msg_lower for word in ["fair", "reasonable", "just want"]):
-        leverage -= 4  # Weak framing
+def _calculate_leverage(features: Dict[str, int], current_leverage: int) -> int:
+    lexicon = get_lexicon()
+    delta, harsh_detected = lexicon.leverage_delta(features)
+    leverage = current_leverage + delta
     
-    # Natural variance
-    import random
-    leverage += random.randint(-2, 1)  # Slightly negative bias
+    # Natural variance; harsh language gets an extra penalty instead
+    leverage += random.randint(*lexicon.leverage["harsh_jitter" if harsh_detected else "jitter"])
     
-    return max(10, min(90, leverage))
+    low, high = lexicon.leverage["clamp"]
+    return max(low, min(high, leverage))
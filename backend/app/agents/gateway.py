@@ -0,0 +1,339 @@
+"""Shared gateway for every Groq call.
+
+Each model gets its own ``ModelGateway``, which admits a call in this order:
+
+1. Circuit breaker. After ``llm_breaker_failure_threshold`` consecutive
+   provider failures (throttling, 5xx, timeouts, connection errors), calls
+   fail fast for ``llm_breaker_reset_seconds``. One probe call is then let
+   through; the breaker closes again if it succeeds.
+2. Request-per-minute and token-per-minute buckets. The token bucket is
+   charged the prompt tokens plus ``llm_expected_output_tokens`` up front and
+   corrected with the reported usage afterwards. A call that gives up while
+   waiting for a later step is refunded what it already took.
+3. AIMD concurrency limit. Starts at ``llm_initial_concurrency``, grows by
+   about one slot per limit's worth of fast successes, and halves on a 429 or
+   a call slower than ``llm_latency_target_seconds``. It never exceeds
+   ``llm_max_concurrency_per_model``.
+
+Retryable failures are retried with full-jitter exponential backoff (or the
+provider's retry-after). Every call has a hard deadline that covers queueing,
+retries and the call itself. When the gateway gives up, it raises
+``LLMUnavailable`` so callers can degrade instead of erroring.
+"""
+import asyncio
+import random
+import time
+from contextlib import aclosing
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
+import groq
+import httpx
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage
+from .llm import get_llm
+from ..config import get_settings
+from ..tracing import span
+
+settings = get_settings()
+
+class LLMUnavailable(Exception):
+    """The provider could not serve the call in time. ``retry_after`` is a hint in seconds."""
+
+    def __init__(self, message: str, retry_after: float = 0.0):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+class TokenBucket:
+    def __init__(self, per_minute: int):
+        self.capacity = float(per_minute)
+        self.rate = per_minute / 60.0
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def take(self, amount: float):
+        amount = min(amount, self.capacity)
+        async with self._lock:
+            self._refill()
+            while self.tokens < amount:
+                await asyncio.sleep((amount - self.tokens) / self.rate)
+                self._refill()
+            self.tokens -= amount
+
+    def adjust(self, amount: float):
+        """Charge (positive) or refund (negative) tokens after the fact."""
+        self._refill()
+        self.tokens = min(self.capacity, self.tokens - amount)
+
+class AdaptiveLimiter:
+    def __init__(self, initial: int, maximum: int, latency_target: float):
+        self.limit = float(min(initial, maximum))
+        self.maximum = maximum
+        self.latency_target = latency_target
+        self.in_flight = 0
+        self._last_decrease = 0.0
+        self._waiters: List[asyncio.Future] = []
+
+    async def acquire(self):
+        while self.in_flight >= int(self.limit):
+            waiter = asyncio.get_running_loop().create_future()
+            self._waiters.append(waiter)
+            try:
+                await waiter
+            finally:
+                if waiter in self._waiters:
+                    self._waiters.remove(waiter)
+        self.in_flight += 1
+
+    def release(self):
+        """Synchronous, so it is safe in ``finally`` blocks of cancelled calls."""
+        self.in_flight -= 1
+        waiters, self._waiters = self._waiters, []
+        for waiter in waiters:
+            if not waiter.done():
+                waiter.set_result(None)
+
+    def on_success(self, latency: float):
+        if latency > self.latency_target:
+            self.on_overload()
+        else:
+            self.limit = min(self.maximum, self.limit + 1.0 / self.limit)
+
+    def on_overload(self):
+        # One decrease per latency window, so a burst of 429s doesn't collapse the limit to 1
+        now = time.monotonic()
+        if now - self._last_decrease >= self.latency_target:
+            self.limit = max(1.0, self.limit / 2)
+            self._last_decrease = now
+
+CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+class CircuitBreaker:
+    def __init__(self, failure_threshold: int, reset_seconds: float):
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self._probing = False
+
+    def retry_after(self) -> float:
+        return max(0.0, self.opened_at + self.reset_seconds - time.monotonic())
+
+    def allow(self) -> bool:
+        if self.state == OPEN and not self.retry_after():
+            self.state = HALF_OPEN
+        if self.state == HALF_OPEN:
+            if self._probing:
+                return False
+            self._probing = True
+        return self.state != OPEN
+
+    def on_success(self):
+        self.state = CLOSED
+        self.failures = 0
+        self._probing = False
+
+    def on_failure(self):
+        self.failures += 1
+        if self.state == HALF_OPEN or self.failures >= self.failure_threshold:
+            self.state = OPEN
+            self.opened_at = time.monotonic()
+        self._probing = False
+
+    def on_abandoned(self):
+        """A half-open probe ended without a provider verdict (e.g. a client error)."""
+        self._probing = False
+
+def _classify(e: BaseException) -> Tuple[bool, bool, float]:
+    """(retryable, throttled, retry-after seconds) for an exception from a call."""
+    if isinstance(e, groq.RateLimitError):
+        try:
+            retry_after = float(e.response.headers.get("retry-after", 0))
+        except ValueError:
+            retry_after = 0.0
+        return True, True, retry_after
+    if isinstance(e, groq.APIStatusError):
+        return e.status_code >= 500, False, 0.0
+    if isinstance(e, (asyncio.TimeoutError, groq.APIConnectionError, httpx.TransportError)):
+        return True, False, 0.0
+    return False, False, 0.0
+
+class ModelGateway:
+    def __init__(self, model: str):
+        limits = settings.llm_model_limits.get(model, {})
+        self.model = model
+        self.requests = TokenBucket(limits.get("requests_per_minute", settings.llm_requests_per_minute))
+        self.tokens = TokenBucket(limits.get("tokens_per_minute", settings.llm_tokens_per_minute))
+        self.limiter = AdaptiveLimiter(settings.llm_initial_concurrency, settings.llm_max_concurrency_per_model, settings.llm_latency_target_seconds)
+        self.breaker = CircuitBreaker(settings.llm_breaker_failure_threshold, settings.llm_breaker_reset_seconds)
+        self.calls = 0
+        self.retries = 0
+        self.throttled = 0
+        self.failures = 0
+        self.rejected = 0
+
+    async def admit(self, estimate: int, deadline: float):
+        if not self.breaker.allow():
+            self.rejected += 1
+            raise LLMUnavailable(f"{self.model}: circuit open", self.breaker.retry_after())
+        try:
+            await asyncio.wait_for(self._reserve(estimate), max(0.0, deadline - time.monotonic()))
+        except asyncio.TimeoutError:
+            self.breaker.on_abandoned()
+            self.rejected += 1
+            raise LLMUnavailable(f"{self.model}: deadline passed waiting for capacity")
+
+    async def _reserve(self, estimate: int):
+        await self.requests.take(1)
+        taken = 0.0
+        try:
+            await self.tokens.take(estimate)
+            taken = min(estimate, self.tokens.capacity)
+            await self.limiter.acquire()
+        except asyncio.CancelledError:
+            # Timed out or cancelled while queued: return what was already taken
+            self.requests.adjust(-1)
+            self.tokens.adjust(-taken)
+            raise
+
+    def succeeded(self, latency: float, estimate: int, usage: Optional[Dict[str, Any]]):
+        self.calls += 1
+        self.limiter.on_success(latency)
+        self.breaker.on_success()
+        if usage:
+            self.tokens.adjust(usage.get("total_tokens", estimate) - estimate)
+
+    def failed(self, e: BaseException, attempt: int, deadline: float) -> float:
+        """Account a failed attempt. Returns the backoff before the next attempt,
+        or re-raises if the call should not be retried."""
+        retryable, throttled, retry_after = _classify(e)
+        if not retryable:
+            self.breaker.on_abandoned()
+            raise e
+        self.failures += 1
+        self.breaker.on_failure()
+        if throttled:
+            self.throttled += 1
+            self.limiter.on_overload()
+        delay = max(retry_after, random.uniform(0, min(settings.llm_retry_max_delay, settings.llm_retry_base_delay * 2 ** attempt)))
+        if attempt >= settings.llm_max_retries or self.breaker.state == OPEN or time.monotonic() + delay >= deadline:
+            raise LLMUnavailable(f"{self.model}: {type(e).__name__}: {e}", max(retry_after, self.breaker.retry_after())) from e
+        self.retries += 1
+        return delay
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "breaker": self.breaker.state,
+            "breaker_retry_after": self.breaker.retry_after() if self.breaker.state != CLOSED else 0.0,
+            "concurrency_limit": self.limiter.limit,
+            "in_flight": self.limiter.in_flight,
+            "requests_available": self.requests.tokens,
+            "tokens_available": self.tokens.tokens,
+            "calls": self.calls,
+            "retries": self.retries,
+            "throttled": self.throttled,
+            "failures": self.failures,
+            "rejected": self.rejected
+        }
+
+_gateways: Dict[str, ModelGateway] = {}
+
+def get_gateway(model: str) -> ModelGateway:
+    gateway = _gateways.get(model)
+    if gateway is None:
+        gateway = _gateways[model] = ModelGateway(model)
+    return gateway
+
+def gateway_stats() -> Dict[str, Dict[str, Any]]:
+    return {model: gateway.stats() for model, gateway in _gateways.items()}
+
+def _token_attrs(usage: Optional[Dict[str, Any]]) -> Dict[str, int]:
+    if not usage:
+        return {}
+    return {"input_tokens": usage.get("input_tokens", 0), "output_tokens": usage.get("output_tokens", 0)}
+
+def _deadline(seconds: Optional[float]) -> float:
+    return time.monotonic() + (seconds or settings.llm_deadline_seconds)
+
+async def invoke(model: str, temperature: float, messages: List[BaseMessage], prompt_tokens: int, deadline: Optional[float] = None) -> AIMessage:
+    """``ainvoke`` through the gateway. Raises LLMUnavailable if it cannot be served in time."""
+    gateway = get_gateway(model)
+    llm = get_llm(model, temperature)
+    estimate = prompt_tokens + settings.llm_expected_output_tokens
+    end = _deadline(deadline)
+    attempt = 0
+    while True:
+        with span("llm_queue", model):
+            await gateway.admit(estimate, end)
+        started = time.monotonic()
+        try:
+            with span("llm", model, attempt=attempt) as call:
+                response = await asyncio.wait_for(llm.ainvoke(messages), max(0.0, end - started))
+                # Not streamed: the first token arrives with the whole reply
+                call.set(ttft=time.monotonic() - started, **_token_attrs(response.usage_metadata))
+        except Exception as e:
+            delay = gateway.failed(e, attempt, end)
+        except BaseException:
+            gateway.breaker.on_abandoned()
+            raise
+        else:
+            gateway.succeeded(time.monotonic() - started, estimate, response.usage_metadata)
+            return response
+        finally:
+            gateway.limiter.release()
+        attempt += 1
+        await asyncio.sleep(delay)
+
+async def stream(model: str, temperature: float, messages: List[BaseMessage], prompt_tokens: int, deadline: Optional[float] = None) -> AsyncIterator[AIMessageChunk]:
+    """``astream`` through the gateway. Failures before the first chunk are
+    retried; after that there is nothing to retry and LLMUnavailable is raised.
+    Consumers that stop early should wrap this in ``contextlib.aclosing``."""
+    gateway = get_gateway(model)
+    llm = get_llm(model, temperature)
+    estimate = prompt_tokens + settings.llm_expected_output_tokens
+    end = _deadline(deadline)
+    attempt = 0
+    while True:
+        with span("llm_queue", model):
+            await gateway.admit(estimate, end)
+        started = time.monotonic()
+        first_chunk_latency = None
+        usage = None
+        try:
+            # Covers the whole stream, including time the consumer takes between chunks
+            with span("llm", model, attempt=attempt, stream=True) as call:
+                async with aclosing(llm.astream(messages)) as chunks:
+                    iterator = chunks.__aiter__()
+                    while True:
+                        try:
+                            chunk = await asyncio.wait_for(iterator.__anext__(), max(0.0, end - time.monotonic()))
+                        except StopAsyncIteration:
+                            break
+                        if first_chunk_latency is None:
+                            first_chunk_latency = time.monotonic() - started
+                            call.set(ttft=first_chunk_latency)
+                        if chunk.usage_metadata:
+                            usage = chunk.usage_metadata
+                            call.set(**_token_attrs(usage))
+                        yield chunk
+        except Exception as e:
+            # Once chunks have reached the caller the call can't be retried
+            delay = gateway.failed(e, settings.llm_max_retries if first_chunk_latency is not None else attempt, end)
+        except BaseException:
+            # Closed early by the consumer, or cancelled
+            if first_chunk_latency is not None:
+                gateway.succeeded(first_chunk_latency, estimate, usage)
+            else:
+                gateway.breaker.on_abandoned()
+            raise
+        else:
+            gateway.succeeded(first_chunk_latency or time.monotonic() - started, estimate, usage)
+            return
+        finally:
+            gateway.limiter.release()
+        attempt += 1
+        await asyncio.sleep(delay)
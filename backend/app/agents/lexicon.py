@@ -0,0 +1,122 @@
+"""Keyword features for the patience/leverage heuristics.
+
+A message is lowercased and tokenized once (punctuation splits words). Every
+lexicon term is then matched against that token stream: single words through
+a cached token -> groups lookup, phrases with a count over the re-joined
+tokens. ``extract`` returns a hit count per group plus a few structural counts.
+The scoring rules and weights come from a JSON config, which is
+``lexicon.json`` unless LEXICON_PATH is set.
+
+Terms ending in ``*`` match any word with that prefix (``demand*`` covers
+"demands" and "demanding"). Terms with no letters or digits (``%``) match
+anywhere in the text. A rule fires when every ``when`` feature reaches its
+minimum count and no ``unless`` feature is present.
+"""
+import json
+import string
+from collections import Counter
+from functools import lru_cache
+from pathlib import Path
+from typing import Dict, List, Tuple, Any
+from ..config import get_settings
+
+DEFAULT_LEXICON_PATH = Path(__file__).with_name("lexicon.json")
+
+# Features counted directly rather than from lexicon groups
+STRUCTURAL_FEATURES = ["question_marks", "digits", "i_words"]
+
+_PUNCTUATION_TO_SPACE = str.maketrans(string.punctuation, " " * len(string.punctuation))
+_DELETE_DIGITS = str.maketrans("", "", string.digits)
+
+class Lexicon:
+    def __init__(self, config: Dict[str, Any]):
+        self.config = config
+        self.version = config.get("version", 0)
+        self.patience = config["patience"]
+        self.leverage = config["leverage"]
+        self.group_names: List[str] = list(config["groups"])
+        self.feature_names: List[str] = self.group_names + STRUCTURAL_FEATURES
+        self._words: Dict[str, List[str]] = {}
+        self._prefixes: Dict[str, List[str]] = {}
+        self._phrases: Dict[str, List[str]] = {}
+        self._symbols: Dict[str, List[str]] = {}
+        for group, terms in config["groups"].items():
+            for term in terms:
+                words = term.rstrip("*").translate(_PUNCTUATION_TO_SPACE).split()
+                if not words:
+                    self._symbols.setdefault(term, []).append(group)
+                elif term.endswith("*"):
+                    if len(words) > 1:
+                        raise ValueError(f"Prefix terms must be a single word: {term!r}")
+                    self._prefixes.setdefault(words[0], []).append(group)
+                elif len(words) > 1:
+                    self._phrases.setdefault(" ".join(words), []).append(group)
+                else:
+                    self._words.setdefault(words[0], []).append(group)
+        self._prefix_tuple = tuple(self._prefixes)
+        self._phrase_list = [(phrase.split()[0], f" {phrase} ", groups) for phrase, groups in self._phrases.items()]
+        self._token_groups = lru_cache(maxsize=65536)(self._groups_for_token)
+
+    def _groups_for_token(self, token: str) -> Tuple[str, ...]:
+        groups = list(self._words.get(token, ()))
+        if token.startswith(self._prefix_tuple):
+            groups += [g for prefix, pg in self._prefixes.items() if token.startswith(prefix) for g in pg]
+        return tuple(groups)
+
+    def extract(self, message: str) -> Dict[str, int]:
+        """Return a count per feature name, from a single tokenization of the message."""
+        text = message.lower()
+        tokens = text.translate(_PUNCTUATION_TO_SPACE).split()
+        counts = Counter(tokens)
+        features = dict.fromkeys(self.feature_names, 0)
+        for token, n in counts.items():
+            for group in self._token_groups(token):
+                features[group] += n
+        joined = None
+        for first_word, padded, groups in self._phrase_list:
+            if first_word in counts:
+                if joined is None:
+                    joined = f" {' '.join(tokens)} "
+                n = joined.count(padded)
+                for group in groups:
+                    features[group] += n
+        for symbol, groups in self._symbols.items():
+            n = text.count(symbol)
+            for group in groups:
+                features[group] += n
+        features["question_marks"] = text.count("?")
+        features["digits"] = len(text) - len(text.translate(_DELETE_DIGITS))
+        features["i_words"] = counts.get("i", 0)
+        return features
+
+    def patience_delta(self, features: Dict[str, int]) -> int:
+        for rule in self.patience["rules"]:
+            if _matches(rule, features):
+                return rule["delta"]
+        return self.patience.get("default", 0)
+
+    def leverage_delta(self, features: Dict[str, int]) -> Tuple[int, bool]:
+        """Deterministic part of the leverage change, and whether harsh language
+        was detected (which blocks every positive gain)."""
+        delta = self.leverage["base"]
+        harsh = [rule["delta"] for rule in self.leverage["harsh"] if _matches(rule, features)]
+        if harsh:
+            return delta + sum(harsh), True
+        for rule in self.leverage["rules"]:
+            if "first_of" in rule:
+                delta += next((r["delta"] for r in rule["first_of"] if _matches(r, features)), 0)
+            elif _matches(rule, features):
+                delta += rule["delta"]
+        return delta, False
+
+def _matches(rule: Dict[str, Any], features: Dict[str, int]) -> bool:
+    return all(features[name] >= count for name, count in rule["when"].items()) and \
+        not any(features[name] for name in rule.get("unless", ()))
+
+def load_lexicon(path) -> Lexicon:
+    with open(path) as f:
+        return Lexicon(json.load(f))
+
+@lru_cache()
+def get_lexicon() -> Lexicon:
+    return load_lexicon(get_settings().lexicon_path or DEFAULT_LEXICON_PATH)
@@ -0,0 +1,59 @@
+"""Process-wide Groq client registry.
+
+ChatGroq instances are cached per (model, temperature) and all share one pooled
+httpx client pair, so keep-alive HTTP/2 connections survive across turns.
+The client's own retries are off: retries, rate limits and concurrency are
+handled by ``gateway``.
+"""
+from typing import Dict, Tuple, Optional
+import httpx
+from langchain_groq import ChatGroq
+from ..config import get_settings
+
+settings = get_settings()
+
+_llms: Dict[Tuple[str, float], ChatGroq] = {}
+_http_client: Optional[httpx.Client] = None
+_http_async_client: Optional[httpx.AsyncClient] = None
+
+def _limits() -> httpx.Limits:
+    return httpx.Limits(
+        max_connections=settings.llm_max_connections,
+        max_keepalive_connections=settings.llm_max_keepalive_connections,
+        keepalive_expiry=settings.llm_keepalive_expiry
+    )
+
+def _get_http_clients() -> Tuple[httpx.Client, httpx.AsyncClient]:
+    global _http_client, _http_async_client
+    if _http_async_client is None:
+        _http_client = httpx.Client(http2=settings.llm_http2, limits=_limits())
+        _http_async_client = httpx.AsyncClient(http2=settings.llm_http2, limits=_limits())
+    return _http_client, _http_async_client
+
+def get_llm(model: str, temperature: float) -> ChatGroq:
+    """Return the shared ChatGroq for (model, temperature), creating it on first use."""
+    key = (model, temperature)
+    llm = _llms.get(key)
+    if llm is None:
+        http_client, http_async_client = _get_http_clients()
+        llm = ChatGroq(
+            model=model,
+            temperature=temperature,
+            api_key=settings.groq_api_key,
+            base_url=settings.groq_base_url,
+            max_retries=0,
+            http_client=http_client,
+            http_async_client=http_async_client
+        )
+        _llms[key] = llm
+    return llm
+
+async def close_llm_clients():
+    """Close pooled connections. Called from the FastAPI lifespan on shutdown."""
+    global _http_client, _http_async_client
+    if _http_async_client is not None:
+        await _http_async_client.aclose()
+        _http_client.close()
+    _http_client = None
+    _http_async_client = None
+    _llms.clear()
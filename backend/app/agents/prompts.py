@@ -0,0 +1,142 @@
+"""Prompt assembly, token budgets and per-agent usage accounting.
+
+A ``Prompt`` is a static prefix plus ordered sections. The prefix is sent
+unchanged as the system message, byte for byte, so Groq's prefix cache can
+reuse it across calls. Sections added with ``add_lines`` are trimmable:
+``fit`` drops their oldest lines, section by section, until the prompt fits
+the agent's token budget.
+
+Token counts are approximate: they come from tiktoken's cl100k encoding,
+not the Llama tokenizer the Groq models use. The encoding may download its
+BPE file, so ``load_encoding`` runs once at startup, off the event loop. If
+it fails (or before it has run), a 4-characters-per-token estimate is used.
+"""
+import time
+from typing import Any, Dict, List, Optional, Tuple
+from langchain_core.messages import BaseMessage, HumanMessage, SystemMessage
+
+_encoding = None
+
+def load_encoding():
+    """Load the tiktoken encoding. Blocking; called from the FastAPI lifespan with ``asyncio.to_thread``."""
+    global _encoding
+    if _encoding is not None:
+        return
+    try:
+        import tiktoken
+        _encoding = tiktoken.get_encoding("cl100k_base")
+    except Exception as e:
+        print(f"ERROR loading tiktoken encoding, estimating 4 characters per token instead: {e}")
+        _encoding = False
+
+def count_tokens(text: str) -> int:
+    if not _encoding:
+        return (len(text) + 3) // 4
+    return len(_encoding.encode(text, disallowed_special=()))
+
+class Prompt:
+    def __init__(self, agent: str, prefix: str = ""):
+        self.agent = agent
+        self.prefix = prefix
+        # name -> (header, lines); plain sections have lines=None
+        self._sections: List[Tuple[str, str, Optional[List[str]]]] = []
+        self.trimmed_lines = 0
+
+    def add(self, name: str, text: str) -> "Prompt":
+        self._sections.append((name, text, None))
+        return self
+
+    def add_lines(self, name: str, header: str, lines: List[str]) -> "Prompt":
+        """A section whose oldest lines may be dropped to meet the budget."""
+        self._sections.append((name, header, list(lines)))
+        return self
+
+    def _render(self, header: str, lines: Optional[List[str]]) -> str:
+        if lines is None:
+            return header
+        return header + "\n".join(lines) if lines else ""
+
+    @property
+    def body(self) -> str:
+        return "\n\n".join(text for text in (self._render(h, l) for _, h, l in self._sections) if text)
+
+    def section_tokens(self) -> Dict[str, int]:
+        tokens = {"prefix": count_tokens(self.prefix)} if self.prefix else {}
+        for name, header, lines in self._sections:
+            tokens[name] = count_tokens(self._render(header, lines))
+        return tokens
+
+    def fit(self, budget: int, order: Optional[List[str]] = None) -> Dict[str, int]:
+        """Trim trimmable sections oldest-line-first until within ``budget`` tokens.
+        ``order`` names the sections to trim first; by default, the order they were added."""
+        tokens = self.section_tokens()
+        sections = [s for s in self._sections if s[2] is not None]
+        if order:
+            sections.sort(key=lambda s: order.index(s[0]) if s[0] in order else len(order))
+        for name, header, lines in sections:
+            if not lines or sum(tokens.values()) <= budget:
+                continue
+            # Lines are counted once (plus their newline) to pick how many to drop;
+            # the section is then recounted, and trimmed again if still over
+            line_tokens = [count_tokens(line) + 1 for line in lines]
+            while lines and sum(tokens.values()) > budget:
+                total, drop = sum(tokens.values()), 0
+                while drop < len(lines) and total > budget:
+                    total -= line_tokens[drop]
+                    drop += 1
+                del lines[:drop], line_tokens[:drop]
+                self.trimmed_lines += drop
+                tokens[name] = count_tokens(self._render(header, lines))
+        return tokens
+
+    def messages(self) -> List[BaseMessage]:
+        if not self.prefix:
+            return [HumanMessage(content=self.body)]
+        return [SystemMessage(content=self.prefix), HumanMessage(content=self.body)]
+
+class _AgentUsage:
+    def __init__(self):
+        self.calls = 0
+        self.seconds = 0.0
+        self.prompt_tokens_local = 0
+        self.input_tokens = 0
+        self.output_tokens = 0
+        self.cached_input_tokens = 0
+        self.trimmed_lines = 0
+        self.section_tokens: Dict[str, int] = {}
+
+_usage: Dict[str, _AgentUsage] = {}
+
+def record_usage(agent: str, started: float, prompt_tokens: Dict[str, int], usage_metadata: Optional[Dict[str, Any]] = None, output_text: str = "", trimmed_lines: int = 0):
+    """Account one LLM call. Provider-reported usage is preferred; local counts
+    stand in when the provider sent none (e.g. a stream stopped early)."""
+    stats = _usage.setdefault(agent, _AgentUsage())
+    stats.calls += 1
+    stats.seconds += time.perf_counter() - started
+    local_prompt = sum(prompt_tokens.values())
+    stats.prompt_tokens_local += local_prompt
+    stats.trimmed_lines += trimmed_lines
+    for name, n in prompt_tokens.items():
+        stats.section_tokens[name] = stats.section_tokens.get(name, 0) + n
+    if usage_metadata:
+        stats.input_tokens += usage_metadata.get("input_tokens", 0)
+        stats.output_tokens += usage_metadata.get("output_tokens", 0)
+        stats.cached_input_tokens += (usage_metadata.get("input_token_details") or {}).get("cache_read") or 0
+    else:
+        stats.input_tokens += local_prompt
+        stats.output_tokens += count_tokens(output_text)
+
+def usage_report() -> Dict[str, Dict[str, Any]]:
+    return {
+        agent: {
+            "calls": s.calls,
+            "avg_seconds": s.seconds / s.calls,
+            "input_tokens": s.input_tokens,
+            "output_tokens": s.output_tokens,
+            "cached_input_tokens": s.cached_input_tokens,
+            "prompt_tokens_local": s.prompt_tokens_local,
+            "avg_section_tokens": {name: n / s.calls for name, n in s.section_tokens.items()},
+            "trimmed_lines": s.trimmed_lines
+        }
+        for agent, s in _usage.items()
+    }
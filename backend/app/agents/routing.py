@@ -0,0 +1,124 @@
+"""Per-turn model tier for the opponent reply.
+
+``choose_tier`` sends a turn to the fast tier (8B) only when the cheap
+heuristics say nothing is at stake. That means a short message, none of the
+substantive lexicon groups firing, no digits, a calm mood and a small
+leverage swing. Fast-tier replies are drafts: ``check_draft`` screens them,
+and a failed draft is upgraded to the 70B. In ``speculative`` mode every
+turn starts with the 8B draft and only failed drafts reach the 70B.
+
+``record_route`` counts each decision and keeps the totals behind
+``routing_report``, including an estimate of the seconds saved against
+serving every turn from the 70B.
+"""
+import re
+from collections import Counter
+from typing import Any, Dict, List, Optional, Tuple
+from ..config import get_settings
+
+settings = get_settings()
+
+FAST = "fast"
+MAIN = "main"
+
+# Lexicon groups that mark a real negotiation move, which the 70B should answer
+SUBSTANTIVE_GROUPS = ("demanding", "insulting", "threat", "deserve", "you_better", "evidence", "numbers", "market", "batna", "patience_threat")
+
+_OUT_OF_CHARACTER = re.compile(
+    r"\bas an ai\b|\blanguage model\b|\bi'?m an ai\b|\bhidden constraints?\b|\bbatna\b|\bmy instructions\b|^\s*(user|assistant|opponent)\s*:",
+    re.IGNORECASE | re.MULTILINE
+)
+_NUMBER = re.compile(r"\d[\d,]*(?:\.\d+)?")
+_ENDINGS = (".", "!", "?", '"', "'", ")")
+
+def choose_tier(user_message: str, scores: Dict[str, Any], current_leverage: Optional[int] = None) -> Tuple[str, str]:
+    """(tier, reason) for the opponent's reply to this turn."""
+    mode = settings.opponent_routing
+    if mode == "off":
+        return MAIN, "routing off"
+    tier, reason = _heuristic_tier(user_message, scores, current_leverage)
+    if mode == "speculative":
+        return FAST, f"speculative/{reason}"
+    return tier, reason
+
+def _heuristic_tier(user_message: str, scores: Dict[str, Any], current_leverage: Optional[int]) -> Tuple[str, str]:
+    features = scores["features"]
+    if len(user_message.split()) > settings.opponent_fast_max_words:
+        return MAIN, "long message"
+    fired = [group for group in SUBSTANTIVE_GROUPS if features.get(group)]
+    if fired:
+        return MAIN, "signals: " + ", ".join(fired)
+    if features.get("digits"):
+        return MAIN, "numbers"
+    if scores["new_mood"] in ("defensive", "hostile"):
+        return MAIN, f"{scores['new_mood']} mood"
+    if current_leverage is not None and abs(scores["new_leverage"] - current_leverage) >= settings.opponent_fast_max_leverage_swing:
+        return MAIN, "leverage swing"
+    return FAST, "trivial turn"
+
+def _numbers(text: str) -> set:
+    return {n.replace(",", "") for n in _NUMBER.findall(text)}
+
+def check_draft(reply: str, user_message: str, constraints: Dict) -> List[str]:
+    """Problems that disqualify a fast-tier draft; empty if it can be served."""
+    problems = []
+    words = len(reply.split())
+    if words < 3:
+        problems.append("too short")
+    elif words > 130:
+        problems.append("too long")
+    if reply and not reply.rstrip().endswith(_ENDINGS):
+        problems.append("cut off")
+    if _OUT_OF_CHARACTER.search(reply):
+        problems.append("out of character")
+    # Constraint figures the user hasn't mentioned must stay hidden
+    hidden = {n for n in _numbers(str(constraints)) if len(n) >= 3} - _numbers(user_message)
+    if hidden & _numbers(reply):
+        problems.append("reveals constraints")
+    if reply.strip().lower() == user_message.strip().lower():
+        problems.append("echoes user")
+    return problems
+
+class _RoutingStats:
+    def __init__(self):
+        self.turns = Counter()  # tier chosen
+        self.served = Counter()  # tier that produced the reply
+        self.seconds = Counter()  # latency by serving tier, upgrades excluded
+        self.upgrades = 0
+        self.upgrade_seconds = 0.0  # total latency of upgraded turns, draft included
+        self.wasted_draft_seconds = 0.0
+        self.upgrade_reasons = Counter()
+        self.reasons = Counter()
+
+_stats = _RoutingStats()
+
+def record_route(tier: str, reason: str, served: str, seconds: float, draft_seconds: float = 0.0, problems: Optional[List[str]] = None):
+    _stats.turns[tier] += 1
+    _stats.served[served] += 1
+    _stats.reasons[reason.split(":")[0]] += 1
+    upgraded = tier == FAST and served == MAIN
+    if upgraded:
+        _stats.upgrades += 1
+        _stats.upgrade_seconds += seconds
+        _stats.wasted_draft_seconds += draft_seconds
+        _stats.upgrade_reasons.update(problems or [])
+    else:
+        _stats.seconds[served] += seconds
+
+def routing_report() -> Dict[str, Any]:
+    direct = {tier: _stats.served[tier] - (_stats.upgrades if tier == MAIN else 0) for tier in (FAST, MAIN)}
+    avg = {tier: _stats.seconds[tier] / direct[tier] if direct[tier] else None for tier in (FAST, MAIN)}
+    saved = None
+    if avg[FAST] is not None and avg[MAIN] is not None:
+        # Fast replies vs what the 70B would have taken, minus time lost on rejected drafts
+        saved = direct[FAST] * (avg[MAIN] - avg[FAST]) - _stats.wasted_draft_seconds
+    return {
+        "mode": settings.opponent_routing,
+        "turns_by_tier": dict(_stats.turns),
+        "served_by_tier": dict(_stats.served),
+        "upgrades": _stats.upgrades,
+        "upgrade_reasons": dict(_stats.upgrade_reasons),
+        "decision_reasons": dict(_stats.reasons),
+        "avg_seconds": {"fast": avg[FAST], "main": avg[MAIN], "upgraded": _stats.upgrade_seconds / _stats.upgrades if _stats.upgrades else None},
+        "estimated_seconds_saved": saved
+    }
@@ -3,7 +3,7 @@ from langchain_core.messages import HumanMessage, AIMessage
 from opik import track
 from state import NegotiationState
 from config import get_settings
-import json
+from .structured import parse_json_object
 
 settings = get_settings()
 
@@ -45,7 +45,9 @@ Return ONLY valid JSON in this exact format:
 }}"""
     
     response = llm.invoke(prompt)
-    config = json.loads(response.content)
+    config = parse_json_object(response.content)
+    if config is None:
+        raise ValueError("Scenario designer returned no JSON object")
     
     # Set initial patience based on difficulty
     initial_patience = {
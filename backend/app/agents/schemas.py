@@ -0,0 +1,25 @@
+"""Pydantic schemas for structured agent outputs."""
+from pydantic import BaseModel, Field
+from typing import Any, Dict, List, Optional
+
+class ScenarioDesign(BaseModel):
+    personality: str
+    patience: Optional[int] = None
+    constraints: Dict[str, Any]
+    batna: str
+    opening: str
+
+class FeedbackPoint(BaseModel):
+    point: str
+    explanation: str
+
+class TurnReview(BaseModel):
+    strengths: List[FeedbackPoint] = Field(default_factory=list)
+    mistakes: List[FeedbackPoint] = Field(default_factory=list)
+
+class AnalystReport(BaseModel):
+    summary: str
+    outcome: Optional[str] = None
+    strengths: List[FeedbackPoint] = Field(default_factory=list)
+    mistakes: List[FeedbackPoint] = Field(default_factory=list)
+    skill_gaps: List[str] = Field(default_factory=list)
@@ -3,7 +3,7 @@ from langchain_core.messages import HumanMessage, AIMessage
 from opik import track
 from state import NegotiationState
 from config import get_settings
-import json
+from .structured import parse_json_object
 
 settings = get_settings()
 
@@ -77,7 +77,9 @@ Provide structured, actionable coaching feedback in this EXACT JSON format:
 BE SPECIFIC. Reference exact turns. Provide actionable advice."""
     
     response = llm.invoke(prompt)
-    feedback = json.loads(response.content)
+    feedback = parse_json_object(response.content)
+    if feedback is None:
+        raise ValueError("Shadow coach returned no JSON object")
     
     return {
         "shadow_coach_feedback": feedback,
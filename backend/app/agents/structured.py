@@ -0,0 +1,184 @@
+"""JSON extraction, repair and validation for LLM replies.
+
+``JsonObjectScanner`` finds the first JSON object in a token stream as it
+arrives, so a call can stop reading once the object is complete.
+``repair_json`` fixes the faults these models commonly make: code fences or
+prose around the object, trailing commas and truncated output.
+``structured_call`` validates the result against a pydantic schema. If some
+fields fail, it re-asks the model for just those fields and merges them in.
+"""
+import json
+import time
+from contextlib import aclosing
+from typing import Any, Dict, List, Optional, Type, TypeVar
+from pydantic import BaseModel, ValidationError
+from . import gateway
+from .prompts import Prompt, record_usage
+from ..tracing import span
+
+T = TypeVar("T", bound=BaseModel)
+
+class StructuredOutputError(Exception):
+    """The model did not produce valid output for the schema, even after correction."""
+
+class JsonObjectScanner:
+    """Incrementally locates the first top-level JSON object in streamed text."""
+
+    def __init__(self):
+        self.parts: List[str] = []
+        self.depth = 0
+        self.in_string = False
+        self.escaped = False
+        self.complete = False
+
+    def feed(self, chunk: str) -> bool:
+        """Consume a chunk; returns True once the object has closed."""
+        for ch in chunk:
+            if self.complete:
+                break
+            if not self.parts:
+                if ch != "{":
+                    continue
+            self.parts.append(ch)
+            if self.in_string:
+                if self.escaped:
+                    self.escaped = False
+                elif ch == "\\":
+                    self.escaped = True
+                elif ch == '"':
+                    self.in_string = False
+            elif ch == '"':
+                self.in_string = True
+            elif ch in "{[":
+                self.depth += 1
+            elif ch in "}]":
+                self.depth -= 1
+                if self.depth == 0:
+                    self.complete = True
+        return self.complete
+
+    @property
+    def text(self) -> str:
+        return "".join(self.parts)
+
+def repair_json(text: str) -> Optional[str]:
+    """Return the first JSON object in ``text`` with trailing commas removed and,
+    if truncated, open strings and containers closed. A cut-off key is dropped
+    (``"b"`` or ``"b`` at the end), and a key cut off after its colon gets
+    ``null`` (``"b":``). None if there is no object."""
+    start = text.find("{")
+    if start == -1:
+        return None
+    out: List[str] = []
+    # Stack of [bracket, expecting_key, index in out where the pending key starts]
+    stack: List[List[Any]] = []
+    in_string = escaped = False
+    string_start = 0
+    for ch in text[start:]:
+        if in_string:
+            out.append(ch)
+            if escaped:
+                escaped = False
+            elif ch == "\\":
+                escaped = True
+            elif ch == '"':
+                in_string = False
+                if stack[-1][0] == "{" and stack[-1][1]:
+                    stack[-1][2] = string_start
+            continue
+        if ch == '"':
+            in_string = True
+            string_start = len(out)
+        elif ch in "{[":
+            stack.append([ch, ch == "{", None])
+        elif ch in "}]":
+            _strip_trailing_comma(out)
+            out.append("}" if stack.pop()[0] == "{" else "]")
+            if not stack:
+                break
+            continue
+        elif ch == ":" and stack[-1][0] == "{":
+            stack[-1][1] = False
+            stack[-1][2] = None
+        elif ch == "," and stack[-1][0] == "{":
+            stack[-1][1] = True
+        out.append(ch)
+    if stack:
+        # Truncated: close the open string, drop a key without a colon, null a value
+        # cut off after its colon, then close containers
+        if in_string and stack[-1][0] == "{" and stack[-1][1]:
+            stack[-1][2] = string_start  # cut off mid-key
+        elif in_string:
+            if escaped:
+                out.pop()
+            out.append('"')
+        if stack[-1][0] == "{" and stack[-1][2] is not None:
+            del out[stack[-1][2]:]
+        text_out = "".join(out).rstrip()
+        if text_out.endswith(":"):
+            text_out += " null"
+        out = list(text_out)
+        while stack:
+            _strip_trailing_comma(out)
+            out.append("}" if stack.pop()[0] == "{" else "]")
+    return "".join(out)
+
+def _strip_trailing_comma(out: List[str]):
+    i = len(out)
+    while i and out[i - 1].isspace():
+        i -= 1
+    if i and out[i - 1] == ",":
+        del out[i - 1:]
+
+def parse_json_object(text: str) -> Optional[Dict[str, Any]]:
+    """Best-effort dict from an LLM reply, or None if nothing usable was found."""
+    repaired = repair_json(text)
+    if repaired is None:
+        return None
+    try:
+        data = json.loads(repaired)
+    except json.JSONDecodeError:
+        return None
+    return data if isinstance(data, dict) else None
+
+async def _stream_object(model: str, temperature: float, prompt: Prompt, deadline: Optional[float] = None) -> str:
+    """Stream a reply, stopping as soon as the first JSON object has closed."""
+    scanner = JsonObjectScanner()
+    raw: List[str] = []
+    usage = None
+    started = time.perf_counter()
+    tokens = prompt.section_tokens()
+    async with aclosing(gateway.stream(model, temperature, prompt.messages(), sum(tokens.values()), deadline)) as chunks:
+        async for chunk in chunks:
+            raw.append(chunk.content)
+            usage = chunk.usage_metadata or usage
+            if scanner.feed(chunk.content):
+                break
+    text = scanner.text if scanner.complete else "".join(raw)
+    record_usage(prompt.agent, started, tokens, usage, text, prompt.trimmed_lines)
+    return text
+
+def _correction_prompt(prompt: Prompt, schema: Type[BaseModel], error: ValidationError, failed: List[str]) -> Prompt:
+    problems = "\n".join(f"- {'.'.join(map(str, e['loc']))}: {e['msg']}" for e in error.errors())
+    return Prompt(prompt.agent, prompt.prefix).add("request", prompt.body).add("correction", f"""Your previous answer had invalid or missing values:
+{problems}
+
+Return ONLY a JSON object with corrected values for exactly these keys: {", ".join(failed)}
+It must match the corresponding fields of this JSON schema:
+{json.dumps(schema.model_json_schema())}""")
+
+async def structured_call(model: str, temperature: float, prompt: Prompt, schema: Type[T], retries: int = 1, deadline: Optional[float] = None) -> T:
+    """Call the model and return its reply validated as ``schema``.
+    Raises StructuredOutputError if it still fails after ``retries`` corrections,
+    or gateway.LLMUnavailable if the provider can't serve it."""
+    with span("agent", prompt.agent, model=model):
+        data = parse_json_object(await _stream_object(model, temperature, prompt, deadline)) or {}
+        for attempt in range(retries + 1):
+            try:
+                return schema.model_validate(data)
+            except ValidationError as e:
+                if attempt == retries:
+                    raise StructuredOutputError(f"{schema.__name__}: {e}") from e
+                failed = sorted({str(err["loc"][0]) for err in e.errors() if err["loc"]})
+                patch = parse_json_object(await _stream_object(model, temperature, _correction_prompt(prompt, schema, e, failed), deadline)) or {}
+                data = {**data, **{key: value for key, value in patch.items() if key in failed}}
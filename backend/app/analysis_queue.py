@@ -0,0 +1,203 @@
+"""Background analysis jobs for ended sessions.
+
+``end_session`` snapshots what the analyst needs into an ``analysis_jobs``
+document and returns the job id right away. A fixed number of workers
+(``analysis_workers``) pull jobs from a local queue. This keeps 70B
+analysis calls throttled separately from interactive turn traffic. A
+failed job is retried with exponential backoff up to
+``analysis_max_attempts`` times.
+
+Jobs live in Mongo and are claimed atomically: a worker only takes a
+``pending`` job, or a ``running`` one whose lease has lapsed. While the
+analyst runs, the claiming worker renews the lease (``updated_at``) every
+third of ``analysis_lease_seconds``. A job whose worker died is therefore
+picked up again once its lease lapses, but never while another worker is
+still running it. Unfinished jobs are queued at startup, and every
+``analysis_lease_seconds`` stale ones are looked for again. Writes are
+upserts keyed on ``session_id``, which makes re-running a job harmless.
+"""
+import asyncio
+import uuid
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional
+from pymongo.errors import DuplicateKeyError
+from .agents import analyst_agent
+from .config import get_settings
+from .database import get_analysis_jobs_collection, get_analyses_collection, get_sessions_collection
+from .profiles import record_analysis
+from .turn_writer import get_turn_writer
+
+settings = get_settings()
+
+PENDING = "pending"
+RUNNING = "running"
+COMPLETE = "complete"
+FAILED = "failed"
+
+class AnalysisQueue:
+    def __init__(self, workers: int, max_attempts: int, retry_delay: float, lease_seconds: float):
+        self.workers = workers
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self.lease_seconds = lease_seconds
+        self._queue: "asyncio.Queue[str]" = asyncio.Queue()
+        self._tasks: List[asyncio.Task] = []
+        self._retries: set = set()
+        self.running = 0
+        self.completed = 0
+        self.failed = 0
+        self.retried = 0
+        self.wait_total = 0.0
+
+    async def submit(self, session_id: str, analyst_input: Dict[str, Any]) -> Dict:
+        """Store and queue a job; if the session already has one, return that instead."""
+        jobs_col = get_analysis_jobs_collection()
+        now = datetime.utcnow()
+        job = {
+            "job_id": f"job_{uuid.uuid4().hex[:12]}",
+            "session_id": session_id,
+            "status": PENDING,
+            "attempts": 0,
+            "error": None,
+            "input": analyst_input,
+            "created_at": now,
+            "updated_at": now
+        }
+        try:
+            await jobs_col.insert_one(job)
+        except DuplicateKeyError:
+            return await self.get(session_id)
+        self._queue.put_nowait(job["job_id"])
+        return {key: value for key, value in job.items() if key not in ("_id", "input")}
+
+    async def get(self, session_id: str) -> Optional[Dict]:
+        return await get_analysis_jobs_collection().find_one({"session_id": session_id}, {"_id": 0, "input": 0})
+
+    def _claimable(self) -> Dict:
+        # Pending, or running on a worker that stopped renewing its lease
+        stale = datetime.utcnow() - timedelta(seconds=self.lease_seconds)
+        return {"$or": [{"status": PENDING}, {"status": RUNNING, "updated_at": {"$lt": stale}}]}
+
+    async def _renew_lease(self, job_id: str):
+        while True:
+            await asyncio.sleep(self.lease_seconds / 3)
+            await get_analysis_jobs_collection().update_one({"job_id": job_id, "status": RUNNING}, {"$set": {"updated_at": datetime.utcnow()}})
+
+    async def _process(self, job_id: str):
+        jobs_col = get_analysis_jobs_collection()
+        job = await jobs_col.find_one_and_update(
+            {"job_id": job_id, **self._claimable()},
+            {"$set": {"status": RUNNING, "updated_at": datetime.utcnow()}, "$inc": {"attempts": 1}},
+            return_document=True
+        )
+        if job is None:
+            return
+        self.wait_total += (datetime.utcnow() - job["created_at"]).total_seconds()
+        session_id = job["session_id"]
+        analyst_input = job["input"]
+        lease = asyncio.create_task(self._renew_lease(job_id))
+        try:
+            # Make sure the transcript is fully persisted before the analysis; retry the job if not
+            unwritten = await get_turn_writer().flush(session_id)
+            if unwritten:
+                raise RuntimeError(f"{unwritten} turns of the session could not be written")
+            analysis = await analyst_agent(**analyst_input)
+            stored = {
+                "session_id": session_id,
+                "summary": analysis.get("summary", "Analysis completed."),
+                "outcome": analysis.get("outcome", "Unknown"),
+                "strengths": analysis.get("strengths", []),
+                "mistakes": analysis.get("mistakes", []),
+                "skill_gaps": analysis.get("skill_gaps", []),
+                "leverage_trajectory": analyst_input["leverage_trajectory"],
+                "mood_trajectory": analyst_input["mood_trajectory"],
+                "generated_at": datetime.utcnow()
+            }
+            await get_analyses_collection().update_one({"session_id": session_id}, {"$set": stored}, upsert=True)
+            session = await get_sessions_collection().find_one_and_update(
+                {"session_id": session_id},
+                {"$set": {"status": "completed", "completed_at": datetime.utcnow()}},
+                return_document=True
+            )
+            if session:
+                await record_analysis(session, stored)
+            await jobs_col.update_one({"job_id": job_id}, {"$set": {"status": COMPLETE, "error": None, "updated_at": datetime.utcnow()}})
+            self.completed += 1
+        except Exception as e:
+            print(f"ERROR in analysis job {job_id} (attempt {job['attempts']}): {e}")
+            if job["attempts"] >= self.max_attempts:
+                await jobs_col.update_one({"job_id": job_id}, {"$set": {"status": FAILED, "error": str(e), "updated_at": datetime.utcnow()}})
+                self.failed += 1
+                return
+            await jobs_col.update_one({"job_id": job_id}, {"$set": {"status": PENDING, "error": str(e), "updated_at": datetime.utcnow()}})
+            self.retried += 1
+            # An unavailable provider says when it's worth trying again
+            delay = max(self.retry_delay * 2 ** (job["attempts"] - 1), getattr(e, "retry_after", 0.0))
+            retry = asyncio.create_task(self._requeue(job_id, delay))
+            self._retries.add(retry)
+            retry.add_done_callback(self._retries.discard)
+        finally:
+            lease.cancel()
+
+    async def _requeue(self, job_id: str, delay: float):
+        await asyncio.sleep(delay)
+        self._queue.put_nowait(job_id)
+
+    async def _worker(self):
+        while True:
+            job_id = await self._queue.get()
+            self.running += 1
+            try:
+                await self._process(job_id)
+            except Exception as e:
+                print(f"ERROR processing analysis job {job_id}: {e}")
+            finally:
+                self.running -= 1
+                self._queue.task_done()
+
+    async def _queue_claimable(self):
+        for job in await get_analysis_jobs_collection().find(self._claimable(), {"job_id": 1}).sort("created_at", 1).to_list():
+            self._queue.put_nowait(job["job_id"])
+
+    async def _reclaim(self):
+        while True:
+            await asyncio.sleep(self.lease_seconds)
+            try:
+                await self._queue_claimable()
+            except Exception as e:
+                print(f"ERROR looking for stale analysis jobs: {e}")
+
+    async def start(self):
+        """Queue jobs left unfinished by a previous run, then start the workers."""
+        await self._queue_claimable()
+        if not self._tasks:
+            self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+            self._tasks.append(asyncio.create_task(self._reclaim()))
+
+    async def stop(self):
+        tasks = self._tasks + list(self._retries)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._tasks = []
+        self._retries.clear()
+
+    def stats(self) -> Dict:
+        processed = self.completed + self.failed
+        return {
+            "workers": self.workers,
+            "queued": self._queue.qsize(),
+            "running": self.running,
+            "completed": self.completed,
+            "failed": self.failed,
+            "retried": self.retried,
+            "avg_wait_seconds": self.wait_total / (processed + self.retried) if processed + self.retried else 0.0
+        }
+
+_queue: Optional[AnalysisQueue] = None
+
+def get_analysis_queue() -> AnalysisQueue:
+    global _queue
+    if _queue is None:
+        _queue = AnalysisQueue(settings.analysis_workers, settings.analysis_max_attempts, settings.analysis_retry_delay, settings.analysis_lease_seconds)
+    return _queue
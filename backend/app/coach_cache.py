@@ -0,0 +1,202 @@
+"""In-process cache of shadow coach tips.
+
+A tip depends only on the user message and the coarse context (leverage,
+mood, patience), so the key is a normalized message plus the quantized
+context. An exact normalized match is a dict lookup. Near-duplicates
+("hi, can we talk about my salary?" vs "Hi can we talk about my salary")
+are found through MinHash signatures of 3-byte shingles, indexed by LSH
+bands. A hit needs an estimated Jaccard similarity of at least
+``coach_cache_similarity``. Signatures are computed with numpy, one
+multiply-shift hash per permutation over all shingles at once, in tens of
+microseconds. A miss hands its signature back through the ``CacheKey``, so
+``put`` doesn't hash the message again.
+
+Entries expire after ``coach_cache_ttl_seconds``, and the least recently
+used entry is evicted once ``coach_cache_size`` is reached.
+"""
+import re
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, NamedTuple, Optional, Set, Tuple
+import numpy as np
+from .agents import shadow_coach_agent, LLMUnavailable
+from .config import get_settings
+
+settings = get_settings()
+
+NUM_PERM = 64
+BANDS = 16
+ROWS = NUM_PERM // BANDS
+SHINGLE = 3
+_MASK = (1 << 64) - 1
+
+def _splitmix64(seed: int, count: int) -> List[int]:
+    values = []
+    for _ in range(count):
+        seed = (seed + 0x9E3779B97F4A7C15) & _MASK
+        z = ((seed ^ (seed >> 30)) * 0xBF58476D1CE4E5B9) & _MASK
+        z = ((z ^ (z >> 27)) * 0x94D049BB133111EB) & _MASK
+        values.append(z ^ (z >> 31))
+    return values
+
+# Fixed coefficients so signatures are stable across processes; h(x) = (a * x + b) mod 2^64 >> 32
+_A = np.array([a | 1 for a in _splitmix64(1, NUM_PERM)], dtype=np.uint64)[:, None]
+_B = np.array(_splitmix64(2, NUM_PERM), dtype=np.uint64)[:, None]
+
+_NON_WORD = re.compile(r"[^\w\s]+")
+_SPACE = re.compile(r"\s+")
+
+def normalize(message: str) -> str:
+    return _SPACE.sub(" ", _NON_WORD.sub(" ", message.lower())).strip()
+
+def minhash(text: str) -> Tuple[int, ...]:
+    data = np.frombuffer(f" {text} ".ljust(SHINGLE).encode(), dtype=np.uint8).astype(np.uint64)
+    shingles = (data[:-2] << np.uint64(16)) | (data[1:-1] << np.uint64(8)) | data[2:]
+    return tuple(((_A * shingles + _B) >> np.uint64(32)).min(axis=1).tolist())
+
+def _similarity(a: Tuple[int, ...], b: Tuple[int, ...]) -> float:
+    return sum(x == y for x, y in zip(a, b)) / NUM_PERM
+
+def context_key(context: Dict[str, Any]) -> Tuple[str, int, int]:
+    return (context.get("mood", "neutral"), int(context.get("leverage", 50)) // 20, int(context.get("patience", 50)) // 20)
+
+class CacheKey(NamedTuple):
+    ctx: Tuple[str, int, int]
+    text: str
+    # Set by a lookup that missed the exact key
+    signature: Optional[Tuple[int, ...]] = None
+
+class _Entry:
+    __slots__ = ("tip", "signature", "expires_at")
+
+    def __init__(self, tip: str, signature: Tuple[int, ...], expires_at: float):
+        self.tip = tip
+        self.signature = signature
+        self.expires_at = expires_at
+
+class CoachTipCache:
+    def __init__(self, max_entries: int, ttl_seconds: float, similarity: float):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.similarity = similarity
+        # (context, normalized message) -> entry, least recently used first
+        self._entries: "OrderedDict[Tuple, _Entry]" = OrderedDict()
+        # (context, band index, band values) -> keys sharing that band
+        self._bands: Dict[Tuple, Set[Tuple]] = {}
+        self.exact_hits = 0
+        self.similar_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.lookup_seconds = 0.0
+
+    def _band_keys(self, ctx: Tuple, signature: Tuple[int, ...]) -> List[Tuple]:
+        return [(ctx, band, signature[band * ROWS:(band + 1) * ROWS]) for band in range(BANDS)]
+
+    def _remove(self, key: Tuple):
+        entry = self._entries.pop(key)
+        for band_key in self._band_keys(key[0], entry.signature):
+            keys = self._bands.get(band_key)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._bands[band_key]
+
+    def _live(self, key: Tuple, now: float, touch: bool = True) -> Optional[_Entry]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if entry.expires_at <= now:
+            self._remove(key)
+            self.expirations += 1
+            return None
+        if touch:
+            self._entries.move_to_end(key)
+        return entry
+
+    def get(self, message: str, context: Dict[str, Any]) -> Tuple[Optional[str], CacheKey]:
+        """The cached tip (or None), and the key to ``put`` a fresh tip under."""
+        key = CacheKey(context_key(context), normalize(message))
+        if self.max_entries <= 0:
+            return None, key
+        started = time.perf_counter()
+        now = time.monotonic()
+        entry = self._live((key.ctx, key.text), now)
+        if entry is not None:
+            self.exact_hits += 1
+        else:
+            key = key._replace(signature=minhash(key.text))
+            entry = self._nearest(key.ctx, key.signature, now)
+            if entry is not None:
+                self.similar_hits += 1
+            else:
+                self.misses += 1
+        self.lookup_seconds += time.perf_counter() - started
+        return (entry.tip if entry is not None else None), key
+
+    def _nearest(self, ctx: Tuple, signature: Tuple[int, ...], now: float) -> Optional[_Entry]:
+        candidates: Set[Tuple] = set()
+        for band_key in self._band_keys(ctx, signature):
+            candidates |= self._bands.get(band_key, set())
+        best, best_score = None, self.similarity
+        for key in candidates:
+            # Expired entries must not shadow a live, slightly less similar one
+            entry = self._live(key, now, touch=False)
+            if entry is None:
+                continue
+            score = _similarity(signature, entry.signature)
+            if score >= best_score:
+                best, best_score = key, score
+        return self._live(best, now) if best is not None else None
+
+    def put(self, cache_key: CacheKey, tip: str):
+        if self.max_entries <= 0 or not tip:
+            return
+        ctx = cache_key.ctx
+        key = (ctx, cache_key.text)
+        if key in self._entries:
+            self._remove(key)
+        signature = cache_key.signature or minhash(cache_key.text)
+        self._entries[key] = _Entry(tip, signature, time.monotonic() + self.ttl_seconds)
+        for band_key in self._band_keys(ctx, signature):
+            self._bands.setdefault(band_key, set()).add(key)
+        while len(self._entries) > self.max_entries:
+            self._remove(next(iter(self._entries)))
+            self.evictions += 1
+
+    def stats(self) -> Dict:
+        hits = self.exact_hits + self.similar_hits
+        lookups = hits + self.misses
+        return {
+            "size": len(self._entries),
+            "max_entries": self.max_entries,
+            "exact_hits": self.exact_hits,
+            "similar_hits": self.similar_hits,
+            "misses": self.misses,
+            "hit_rate": hits / lookups if lookups else 0.0,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "avg_lookup_microseconds": self.lookup_seconds / lookups * 1e6 if lookups else 0.0
+        }
+
+_cache: Optional[CoachTipCache] = None
+
+def get_coach_cache() -> CoachTipCache:
+    global _cache
+    if _cache is None:
+        _cache = CoachTipCache(settings.coach_cache_size, settings.coach_cache_ttl_seconds, settings.coach_cache_similarity)
+    return _cache
+
+async def cached_coach_tip(user_message: str, context: Dict[str, Any]) -> str:
+    """``shadow_coach_agent`` behind the tip cache. The tip is skipped (empty)
+    while the provider is unavailable."""
+    cache = get_coach_cache()
+    tip, key = cache.get(user_message, context)
+    if tip is None:
+        try:
+            tip = await shadow_coach_agent(user_message=user_message, context=context)
+        except LLMUnavailable as e:
+            print(f"ERROR coach unavailable, skipping tip: {e}")
+            return ""
+        cache.put(key, tip)
+    return tip
@@ -1,11 +1,148 @@
 from pydantic_settings import BaseSettings
 from functools import lru_cache
+from typing import Dict, List, Optional
 
 class Settings(BaseSettings):
     groq_api_key: str
     opik_api_key: str
     mongodb_uri: str
     
+    # MongoDB connection pool
+    mongodb_max_pool_size: int = 50
+    mongodb_min_pool_size: int = 0
+    mongodb_max_idle_time_ms: int = 60000
+    mongodb_server_selection_timeout_ms: int = 5000
+    
+    # Live session state ("memory" or "redis")
+    session_store_backend: str = "memory"
+    redis_url: str = "redis://localhost:6379/0"
+    session_ttl_seconds: int = 6 * 3600
+    
+    # Session engine: "store" (state dict in the session store) or "graph"
+    # (app/workflow.py, checkpointed in workflow_checkpointer: "memory",
+    # "sqlite" or "mongo")
+    session_engine: str = "store"
+    workflow_checkpointer: str = "memory"
+    workflow_sqlite_path: str = "workflow_checkpoints.sqlite"
+    
+    # Session lifecycle: every session_sweep_interval seconds, sessions without a
+    # turn for session_idle_seconds are marked "abandoned" (with a heuristic-only
+    # analysis if abandoned_session_analysis). The in-memory store also evicts
+    # least recently used sessions beyond session_max_live or
+    # session_max_memory_mb (0 disables either limit). With per-process state
+    # (memory store or checkpointer), sessions without state on this worker are
+    # only abandoned if session_sweep_orphans (safe with a single worker only)
+    # or once older than session_max_age_seconds (keep it above session_ttl_seconds)
+    session_idle_seconds: int = 1800
+    session_sweep_interval: float = 60.0
+    session_sweep_orphans: bool = False
+    session_max_age_seconds: int = 24 * 3600
+    session_max_live: int = 10000
+    session_max_memory_mb: float = 512
+    abandoned_session_analysis: bool = True
+    
+    # Pre-generated scenarios per (scenario_type, difficulty); 0 disables the pool.
+    # Only the listed types and difficulties are pooled; others are generated
+    # on demand. One worker at a time refills a key, under a lease
+    scenario_pool_size: int = 3
+    scenario_pool_refill_concurrency: int = 2
+    scenario_pool_types: List[str] = ["salary_raise", "promotion", "client_negotiation", "entry_salary", "counter_offer", "remote_work"]
+    scenario_pool_difficulties: List[str] = ["beginner", "intermediate", "advanced"]
+    scenario_pool_refill_lease_seconds: float = 120.0
+    
+    # Write-behind buffer for the turns collection (a turn is dropped after
+    # turn_write_max_attempts failed writes)
+    turn_write_batch_size: int = 100
+    turn_write_flush_interval: float = 1.0
+    turn_write_max_pending: int = 5000
+    turn_write_max_attempts: int = 5
+    
+    # Turn storage: "documents" (one turns document per turn) or "buckets"
+    # (turn_buckets documents of up to turn_bucket_size turns per session;
+    # move existing turns with migrate_turns.py, and don't change the size after)
+    turn_storage: str = "documents"
+    turn_bucket_size: int = 50
+    
+    # Verbatim history window; older turns are folded into a rolling summary
+    history_window_messages: int = 12
+    history_key_turns: int = 5
+    history_max_fold_failures: int = 3  # then the oldest unfolded turns are dropped
+    
+    # Incremental analysis: background review every N turns (0 disables)
+    insights_review_turns: int = 4
+    insights_max_candidates: int = 6
+
+    # History folds and reviews run on the worker that served the turn, and
+    # their results wait there for the session's next write. That write must
+    # land on the same worker, so with several workers (or redis state) some
+    # are lost. Results waiting longer than background_result_ttl_seconds are
+    # dropped, and so is the work of sessions this worker no longer holds
+    background_result_ttl_seconds: float = 600.0
+    
+    # Heuristic scoring weights (defaults to app/agents/lexicon.json)
+    lexicon_path: Optional[str] = None
+    
+    # Shared LLM HTTP pool
+    llm_http2: bool = True
+    llm_max_connections: int = 100
+    llm_max_keepalive_connections: int = 20
+    llm_keepalive_expiry: float = 30.0
+    groq_base_url: Optional[str] = None  # e.g. a local fake server for load tests
+    
+    # LLM gateway, per model (llm_model_limits overrides the per-minute limits by model name)
+    llm_requests_per_minute: int = 1000
+    llm_tokens_per_minute: int = 300000
+    llm_model_limits: Dict[str, Dict[str, int]] = {}
+    llm_expected_output_tokens: int = 300
+    llm_initial_concurrency: int = 8
+    llm_max_concurrency_per_model: int = 32
+    llm_latency_target_seconds: float = 10.0
+    llm_deadline_seconds: float = 30.0
+    llm_analysis_deadline_seconds: float = 120.0
+    llm_max_retries: int = 3
+    llm_retry_base_delay: float = 0.5
+    llm_retry_max_delay: float = 8.0
+    llm_breaker_failure_threshold: int = 5
+    llm_breaker_reset_seconds: float = 30.0
+    
+    # Background session analysis (a running job is taken over by another
+    # worker if its lease isn't renewed for analysis_lease_seconds)
+    analysis_workers: int = 2
+    analysis_max_attempts: int = 3
+    analysis_retry_delay: float = 2.0
+    analysis_lease_seconds: float = 60.0
+    
+    # Coach tip cache (size 0 disables it)
+    coach_cache_size: int = 5000
+    coach_cache_ttl_seconds: int = 6 * 3600
+    coach_cache_similarity: float = 0.8
+    
+    # Opponent model tiering: "off" (always 70B), "tiered" (8B for trivial turns)
+    # or "speculative" (8B draft every turn, 70B when the draft fails its check)
+    opponent_routing: str = "off"
+    opponent_fast_max_words: int = 25
+    opponent_fast_max_leverage_swing: int = 8
+    
+    # Prompt token budgets (oldest conversation lines are trimmed first)
+    opponent_prompt_budget: int = 1500
+    analyst_prompt_budget: int = 6000
+    
+    # User profiles (recent results kept, sessions per leverage trend window)
+    profile_recent_sessions: int = 20
+    profile_trend_window: int = 5
+    
+    # Tracing and /metrics. trace_exporter: "" (metrics only), "log" (print
+    # requests slower than trace_slow_seconds) or "module:function"
+    tracing_enabled: bool = True
+    trace_exporter: str = ""
+    trace_slow_seconds: float = 2.0
+    
+    # Bulk export (export_data.py, GET /api/admin/export/{table}). Admin
+    # endpoints are disabled while admin_token is empty
+    admin_token: str = ""
+    export_chunk_size: int = 5000
+    export_watermark_lag_seconds: int = 60
+    
     class Config:
         env_file = ".env"
         case_sensitive = False
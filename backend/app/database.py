@@ -1,11 +1,40 @@
-from pymongo import MongoClient
+from typing import Optional
+from pymongo import AsyncMongoClient
 from .config import get_settings
+from .tracing import mongo_listeners
 
 settings = get_settings()
 
-# MongoDB client singleton
-def get_mongodb_client():
-    return MongoClient(settings.mongodb_uri)
+_client: Optional[AsyncMongoClient] = None
+
+# MongoDB client singleton, opened lazily and closed from the FastAPI lifespan
+def get_mongodb_client() -> AsyncMongoClient:
+    global _client
+    if _client is None:
+        _client = AsyncMongoClient(
+            settings.mongodb_uri,
+            maxPoolSize=settings.mongodb_max_pool_size,
+            minPoolSize=settings.mongodb_min_pool_size,
+            maxIdleTimeMS=settings.mongodb_max_idle_time_ms,
+            serverSelectionTimeoutMS=settings.mongodb_server_selection_timeout_ms,
+            event_listeners=mongo_listeners()
+        )
+    return _client
+
+async def close_mongodb_client():
+    global _client
+    if _client is not None:
+        await _client.close()
+        _client = None
+
+async def ping_mongodb() -> bool:
+    """Round-trip a ping through the pool; used by /health."""
+    try:
+        await get_mongodb_client().admin.command("ping")
+        return True
+    except Exception as e:
+        print(f"ERROR pinging MongoDB: {e}")
+        return False
 
 def get_database():
     client = get_mongodb_client()
@@ -24,6 +53,10 @@ def get_turns_collection():
     db = get_database()
     return db.turns
 
+def get_turn_buckets_collection():
+    db = get_database()
+    return db.turn_buckets
+
 def get_analyses_collection():
     db = get_database()
     return db.analyses
@@ -31,3 +64,15 @@ def get_analyses_collection():
 def get_profiles_collection():
     db = get_database()
     return db.profiles
+
+def get_scenario_pool_collection():
+    db = get_database()
+    return db.scenario_pool
+
+def get_scenario_pool_refills_collection():
+    db = get_database()
+    return db.scenario_pool_refills
+
+def get_analysis_jobs_collection():
+    db = get_database()
+    return db.analysis_jobs
@@ -0,0 +1,78 @@
+"""Per-session background work whose results land on the session's next write.
+
+A background task never saves the session itself, since that would race user
+turns for the session version. It returns an ``apply(state)`` callback. The
+turn path calls ``apply_ready`` just before it saves, which merges every
+finished result into the state it is about to write.
+
+Tasks and results are held by the worker process that scheduled them. A
+result only reaches its session if the next write happens on the same
+worker, which is guaranteed with a single worker only. A result not applied
+within ``ttl_seconds`` is dropped, and the session sweep discards the
+work of sessions this worker no longer holds.
+"""
+import asyncio
+import time
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+from .tracing import background_task
+
+Applier = Callable[[dict], None]
+
+class DeferredUpdates:
+    def __init__(self, name: str, ttl_seconds: float):
+        self.name = name
+        self.ttl_seconds = ttl_seconds
+        self._tasks: Dict[str, asyncio.Task] = {}
+        self._ready: Dict[str, Tuple[float, Applier]] = {}
+        self.expired = 0
+
+    def _fresh(self, session_id: str) -> Optional[Applier]:
+        ready = self._ready.get(session_id)
+        if ready is None:
+            return None
+        if time.monotonic() - ready[0] > self.ttl_seconds:
+            del self._ready[session_id]
+            self.expired += 1
+            return None
+        return ready[1]
+
+    def busy(self, session_id: str) -> bool:
+        return session_id in self._tasks or self._fresh(session_id) is not None
+
+    def schedule(self, session_id: str, job: Awaitable[Applier]):
+        """Run ``job`` in the background; at most one pending job per session."""
+        if self.busy(session_id):
+            job.close()
+            return
+        self._tasks[session_id] = background_task(self._run(session_id, job))
+
+    async def _run(self, session_id: str, job: Awaitable[Applier]):
+        try:
+            self._ready[session_id] = (time.monotonic(), await job)
+        except Exception as e:
+            print(f"ERROR in background {self.name} for {session_id}: {e}")
+        finally:
+            self._tasks.pop(session_id, None)
+
+    def apply_ready(self, state: dict):
+        applier = self._fresh(state["session_id"])
+        if applier is not None:
+            del self._ready[state["session_id"]]
+            applier(state)
+
+    def discard(self, session_id: str):
+        task = self._tasks.pop(session_id, None)
+        if task is not None:
+            task.cancel()
+        self._ready.pop(session_id, None)
+
+    def sessions(self) -> List[str]:
+        """Sessions with a running job or a result waiting; expired results are dropped first."""
+        for session_id in list(self._ready):
+            self._fresh(session_id)
+        return list(self._tasks.keys() | self._ready.keys())
+
+    @property
+    def counts(self) -> Tuple[int, int]:
+        """(running jobs, results waiting for their session's next write)"""
+        return len(self._tasks), len(self._ready)
@@ -0,0 +1,227 @@
+"""Bulk export of sessions, turns and analyses for analytics.
+
+Each table is read in keyset pages ordered by its watermark field and
+``_id``, ``export_chunk_size`` documents at a time. No cursor is held open
+between pages, and memory stays bounded however large the range is. Turns
+are joined to their session (user, scenario, difficulty) one page at a time
+through a small LRU of session documents. With ``turn_storage=buckets``,
+turns are read from the bucket documents instead (see
+``turn_store.bucketed_turn_pages``).
+
+A window is ``since <= watermark < until``. ``until`` defaults to
+``export_watermark_lag_seconds`` ago, so turns still in the write-behind
+buffer aren't skipped. An incremental export passes the previous ``until``
+as the next ``since``. Watermarks are ``created_at`` for sessions,
+``timestamp`` for turns and ``generated_at`` for analyses. A session is
+therefore exported once, as it was at that time. Its later status lives in
+its analysis row.
+
+Rows are flat, with nested values as JSON strings. They are written as
+newline-delimited JSON, or as Arrow/Parquet when pyarrow is installed
+(``pip install -r requirements-bench.txt``).
+"""
+import importlib.util
+import json
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+from typing import Any, AsyncIterator, Callable, Dict, List, Optional, Tuple
+from .config import get_settings
+from .database import get_sessions_collection, get_turns_collection, get_analyses_collection
+from .turn_store import BUCKETED, bucketed_turn_pages
+
+settings = get_settings()
+
+# Session fields copied onto each exported turn
+SESSION_JOIN_FIELDS = ("user_id", "scenario_type", "difficulty")
+
+SESSION_CACHE_SIZE = 10000
+
+class ExportTable:
+    def __init__(self, collection: Callable, watermark: str, columns: Dict[str, str], join_sessions: bool = False):
+        self.collection = collection
+        self.watermark = watermark
+        # column -> type: string, int, bool, timestamp, json, int_list, string_list
+        self.columns = columns
+        self.join_sessions = join_sessions
+
+    def row(self, doc: Dict) -> Dict[str, Any]:
+        return {name: _convert(kind, doc.get(name)) for name, kind in self.columns.items()}
+
+EXPORT_TABLES: Dict[str, ExportTable] = {
+    "sessions": ExportTable(get_sessions_collection, "created_at", {
+        "session_id": "string",
+        "user_id": "string",
+        "scenario_type": "string",
+        "difficulty": "string",
+        "status": "string",
+        "created_at": "timestamp",
+        "ended_at": "timestamp",
+        "completed_at": "timestamp",
+        "abandon_reason": "string",
+        "opponent_personality": "json",
+        "opponent_constraints": "json"
+    }),
+    "turns": ExportTable(get_turns_collection, "timestamp", {
+        "session_id": "string",
+        "turn_number": "int",
+        "timestamp": "timestamp",
+        "user_message": "string",
+        "opponent_response": "string",
+        "coach_tip": "string",
+        "degraded": "bool",
+        "opponent_mood": "string",
+        "opponent_patience": "int",
+        "calculated_leverage": "int",
+        "lexicon_version": "int",
+        **{field: "string" for field in SESSION_JOIN_FIELDS}
+    }, join_sessions=True),
+    "analyses": ExportTable(get_analyses_collection, "generated_at", {
+        "session_id": "string",
+        "outcome": "string",
+        "summary": "string",
+        "strengths": "json",
+        "mistakes": "json",
+        "skill_gaps": "string_list",
+        "leverage_trajectory": "int_list",
+        "mood_trajectory": "string_list",
+        "heuristic": "bool",
+        "generated_at": "timestamp"
+    })
+}
+
+def _convert(kind: str, value: Any) -> Any:
+    if value is None:
+        return None
+    if kind == "json":
+        return json.dumps(value, default=str)
+    if kind == "string" and not isinstance(value, str):
+        return json.dumps(value, default=str)
+    if kind == "int":
+        return int(value)
+    if kind == "int_list":
+        return [int(v) for v in value]
+    if kind == "string_list":
+        return [str(v) for v in value]
+    return value
+
+def _naive_utc(value: datetime) -> datetime:
+    # Mongo stores naive UTC datetimes
+    return value.astimezone(timezone.utc).replace(tzinfo=None) if value.tzinfo else value
+
+def export_window(since: Optional[datetime], until: Optional[datetime]) -> Tuple[Optional[datetime], datetime]:
+    if until is None:
+        until = datetime.utcnow() - timedelta(seconds=settings.export_watermark_lag_seconds)
+    return (_naive_utc(since) if since else None), _naive_utc(until)
+
+async def export_rows(table: str, since: Optional[datetime], until: datetime, chunk_size: Optional[int] = None) -> AsyncIterator[List[Dict[str, Any]]]:
+    """Yield the rows of ``table`` in the window, one page at a time."""
+    spec = EXPORT_TABLES[table]
+    chunk_size = chunk_size or settings.export_chunk_size
+    sessions: "OrderedDict[str, Dict]" = OrderedDict()
+    pages = bucketed_turn_pages(since, until, chunk_size) if BUCKETED and table == "turns" else _pages(spec, since, until, chunk_size)
+    async for docs in pages:
+        if spec.join_sessions:
+            await _join_sessions(docs, sessions)
+        yield [spec.row(doc) for doc in docs]
+
+async def _pages(spec: ExportTable, since: Optional[datetime], until: datetime, chunk_size: int) -> AsyncIterator[List[Dict]]:
+    field = spec.watermark
+    window = {field: {"$lt": until, **({"$gte": since} if since else {})}}
+    projection = {name: 1 for name in spec.columns if name not in SESSION_JOIN_FIELDS or not spec.join_sessions}
+    collection = spec.collection()
+    last = None
+    while True:
+        query = window if last is None else {"$and": [window, {"$or": [
+            {field: {"$gt": last[0]}},
+            {field: last[0], "_id": {"$gt": last[1]}}
+        ]}]}
+        docs = await collection.find(query, projection).sort([(field, 1), ("_id", 1)]).limit(chunk_size).to_list()
+        if not docs:
+            return
+        last = (docs[-1][field], docs[-1]["_id"])
+        yield docs
+        if len(docs) < chunk_size:
+            return
+
+async def _join_sessions(docs: List[Dict], cache: "OrderedDict[str, Dict]"):
+    missing = list({doc["session_id"] for doc in docs if doc["session_id"] not in cache})
+    if missing:
+        found = await get_sessions_collection().find(
+            {"session_id": {"$in": missing}},
+            {"_id": 0, "session_id": 1, **{field: 1 for field in SESSION_JOIN_FIELDS}}
+        ).to_list()
+        for session in found:
+            cache[session["session_id"]] = session
+    for doc in docs:
+        session = cache.get(doc["session_id"])
+        if session is not None:
+            cache.move_to_end(doc["session_id"])
+            for field in SESSION_JOIN_FIELDS:
+                doc[field] = session.get(field)
+    while len(cache) > SESSION_CACHE_SIZE:
+        cache.popitem(last=False)
+
+# -- Formats -----------------------------------------------------------------
+
+def ndjson(rows: List[Dict[str, Any]]) -> bytes:
+    return "".join(json.dumps(row, default=_isoformat) + "\n" for row in rows).encode()
+
+def _isoformat(value: Any) -> str:
+    return value.isoformat() if isinstance(value, datetime) else str(value)
+
+def arrow_available() -> bool:
+    return importlib.util.find_spec("pyarrow") is not None
+
+def arrow_schema(table: str):
+    import pyarrow as pa
+    types = {
+        "string": pa.string(),
+        "json": pa.string(),
+        "int": pa.int64(),
+        "bool": pa.bool_(),
+        "timestamp": pa.timestamp("ms"),
+        "int_list": pa.list_(pa.int64()),
+        "string_list": pa.list_(pa.string())
+    }
+    return pa.schema([(name, types[kind]) for name, kind in EXPORT_TABLES[table].columns.items()])
+
+def record_batch(table: str, rows: List[Dict[str, Any]], schema=None):
+    import pyarrow as pa
+    schema = schema or arrow_schema(table)
+    return pa.RecordBatch.from_pylist(rows, schema=schema)
+
+class _Drain:
+    """File-like sink for the Arrow IPC writer; ``take`` returns what was written since the last call."""
+
+    closed = False
+
+    def __init__(self):
+        self._parts: List[bytes] = []
+
+    def write(self, data) -> int:
+        self._parts.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def take(self) -> bytes:
+        data, self._parts = b"".join(self._parts), []
+        return data
+
+async def stream_export(table: str, since: Optional[datetime], until: datetime, format: str) -> AsyncIterator[bytes]:
+    """Encoded export, one chunk per page: NDJSON lines or an Arrow IPC stream."""
+    if format == "ndjson":
+        async for rows in export_rows(table, since, until):
+            yield ndjson(rows)
+        return
+
+    import pyarrow as pa
+    schema = arrow_schema(table)
+    sink = _Drain()
+    writer = pa.ipc.new_stream(sink, schema)
+    async for rows in export_rows(table, since, until):
+        writer.write_batch(record_batch(table, rows, schema))
+        yield sink.take()
+    writer.close()
+    yield sink.take()
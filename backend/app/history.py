@@ -0,0 +1,69 @@
+"""Bounded conversation history for live sessions.
+
+``state["history"]`` keeps only the last ``history_window_messages`` messages
+verbatim. Older exchanges move to ``state["summary_backlog"]`` and are folded
+into ``state["summary"]`` by a background summarizer call, off the request
+path. After ``history_max_fold_failures`` failed folds in a row, the
+oldest backlog exchanges are dropped unsummarized, so a failing summarizer
+can't grow the backlog without bound. The turns with the biggest leverage
+swings are also kept verbatim in ``state["key_turns"]`` for the analyst.
+"""
+from typing import Dict, List
+from .agents import summarizer_agent
+from .config import get_settings
+from .deferred import DeferredUpdates, Applier
+
+settings = get_settings()
+
+folds = DeferredUpdates("history fold", settings.background_result_ttl_seconds)
+
+def trim_history(state: dict):
+    """Move whole exchanges beyond the window into the summary backlog."""
+    history = state["history"]
+    overflow = len(history) - settings.history_window_messages
+    if overflow > 0:
+        # Cut on a turn boundary so a user message never loses its reply
+        while overflow < len(history) and history[overflow]["role"] != "user":
+            overflow += 1
+        state["summary_backlog"].extend(history[:overflow])
+        del history[:overflow]
+
+def record_key_turn(state: dict, turn: Dict, leverage_delta: int):
+    """Keep the ``history_key_turns`` turns with the largest leverage swings."""
+    key_turns: List[Dict] = state["key_turns"]
+    key_turns.append({**turn, "leverage_delta": leverage_delta})
+    key_turns.sort(key=lambda t: abs(t["leverage_delta"]), reverse=True)
+    del key_turns[settings.history_key_turns:]
+    key_turns.sort(key=lambda t: t["turn"])
+
+def schedule_fold(state: dict):
+    """Start summarizing the current backlog unless a fold is already pending."""
+    if state["summary_backlog"]:
+        folds.schedule(state["session_id"], _fold(state["summary"], list(state["summary_backlog"])))
+
+async def _fold(previous_summary: str, backlog: List[Dict]) -> Applier:
+    try:
+        summary = await summarizer_agent(previous_summary, backlog)
+    except Exception as e:
+        print(f"ERROR in history fold: {e}")
+        return _fold_failed(previous_summary, backlog)
+
+    def apply(state: dict):
+        if state["summary"] != previous_summary:
+            return  # folded by another worker in the meantime
+        state["summary"] = summary
+        state["fold_failures"] = 0
+        del state["summary_backlog"][:len(backlog)]
+    return apply
+
+def _fold_failed(previous_summary: str, backlog: List[Dict]) -> Applier:
+    def apply(state: dict):
+        if state["summary"] != previous_summary:
+            return
+        failures = state.get("fold_failures", 0) + 1
+        if failures >= settings.history_max_fold_failures:
+            # Truncate instead: drop the exchanges that wouldn't fold
+            del state["summary_backlog"][:len(backlog)]
+            failures = 0
+        state["fold_failures"] = failures
+    return apply
@@ -0,0 +1,56 @@
+"""Index definitions for every collection, created at startup.
+
+``create_index`` is a no-op when an identical index exists, so running this
+on every boot is cheap. A failure (e.g. duplicates blocking a unique index)
+is logged and does not stop the app from starting.
+"""
+from typing import Dict, List, Tuple
+from pymongo import ASCENDING, DESCENDING
+from .database import get_database
+
+# collection -> [(keys, options)]
+INDEXES: Dict[str, List[Tuple[List[Tuple[str, int]], Dict]]] = {
+    "sessions": [
+        ([("session_id", ASCENDING)], {"unique": True}),
+        # Keyset pagination of a user's history, newest first
+        ([("user_id", ASCENDING), ("created_at", DESCENDING), ("session_id", DESCENDING)], {}),
+        # Idle-session sweep: active sessions by age
+        ([("status", ASCENDING), ("created_at", ASCENDING)], {}),
+        # Bulk export: keyset pages by watermark
+        ([("created_at", ASCENDING), ("_id", ASCENDING)], {})
+    ],
+    "turns": [
+        ([("session_id", ASCENDING), ("turn_number", ASCENDING)], {"unique": True}),
+        ([("timestamp", ASCENDING), ("_id", ASCENDING)], {})
+    ],
+    "turn_buckets": [
+        # Also makes a racing bucket upsert fail instead of creating a second bucket
+        ([("session_id", ASCENDING), ("bucket", ASCENDING)], {"unique": True}),
+        # Incremental export: buckets with turns since the last run
+        ([("last_timestamp", ASCENDING)], {})
+    ],
+    "analyses": [
+        ([("session_id", ASCENDING)], {"unique": True}),
+        ([("generated_at", ASCENDING), ("_id", ASCENDING)], {})
+    ],
+    "analysis_jobs": [
+        ([("session_id", ASCENDING)], {"unique": True}),
+        ([("job_id", ASCENDING)], {"unique": True}),
+        ([("status", ASCENDING)], {})
+    ],
+    "profiles": [
+        ([("user_id", ASCENDING)], {"unique": True})
+    ],
+    "scenario_pool": [
+        ([("scenario_type", ASCENDING), ("difficulty", ASCENDING), ("created_at", ASCENDING)], {})
+    ]
+}
+
+async def ensure_indexes():
+    db = get_database()
+    for collection, indexes in INDEXES.items():
+        for keys, options in indexes:
+            try:
+                await db[collection].create_index(keys, **options)
+            except Exception as e:
+                print(f"ERROR creating index {keys} on {collection}: {e}")
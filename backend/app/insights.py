@@ -0,0 +1,114 @@
+"""Incremental analysis, accumulated while the session runs.
+
+Every turn adds heuristic findings to ``state["insights"]``. These are
+strength/mistake candidates from the lexicon groups that fired, with the
+leverage delta of the turn, plus per-pattern turn lists. Every ``insights_review_turns`` turns, a
+background 8B review of the latest exchanges adds quoted points. By the time
+the session ends, the analyst only has to merge and polish these findings.
+"""
+from typing import Dict, List
+from .agents import turn_review_agent
+from .config import get_settings
+from .deferred import DeferredUpdates, Applier
+from .profiles import ABANDONED_OUTCOME
+
+settings = get_settings()
+
+reviews = DeferredUpdates("turn review", settings.background_result_ttl_seconds)
+
+STRENGTH_SIGNALS = {
+    "evidence": "Backed claims with concrete results",
+    "numbers": "Anchored with specific numbers",
+    "market": "Referenced market benchmarks",
+    "batna": "Signalled alternatives (BATNA)",
+    "question_marks": "Asked probing questions"
+}
+
+MISTAKE_SIGNALS = {
+    "demanding": "Demanding language",
+    "insulting": "Dismissive or insulting language",
+    "threat": "Ultimatums and threats",
+    "deserve": "Claimed entitlement",
+    "you_better": "Threatening tone",
+    "apology": "Over-apologizing",
+    "submissive": "Pleading or submissive phrasing",
+    "weak_framing": "Weak fairness framing"
+}
+
+MAX_PATTERN_TURNS = 20
+
+def new_insights() -> Dict:
+    return {"strengths": [], "mistakes": [], "patterns": {}, "review_points": {"strengths": [], "mistakes": []}}
+
+def record_turn_insights(state: dict, turn_number: int, user_message: str, features: Dict[str, int], leverage_delta: int):
+    insights = state["insights"]
+    quote = user_message[:160]
+    for signals, key, helped in ((STRENGTH_SIGNALS, "strengths", leverage_delta > 0), (MISTAKE_SIGNALS, "mistakes", leverage_delta < 0)):
+        fired = [group for group in signals if features.get(group)]
+        for group in fired:
+            turns = insights["patterns"].setdefault(group, [])
+            if len(turns) < MAX_PATTERN_TURNS:
+                turns.append(turn_number)
+        if fired and helped:
+            _keep_top(insights[key], {"turn": turn_number, "points": [signals[g] for g in fired], "quote": quote, "leverage_delta": leverage_delta})
+
+def _keep_top(candidates: List[Dict], candidate: Dict):
+    candidates.append(candidate)
+    candidates.sort(key=lambda c: abs(c["leverage_delta"]), reverse=True)
+    del candidates[settings.insights_max_candidates:]
+
+def schedule_review(state: dict):
+    """Review the latest exchanges in the background every ``insights_review_turns`` turns."""
+    every = settings.insights_review_turns
+    if every <= 0 or state["turn_number"] % every:
+        return
+    first_turn = state["turn_number"] - every + 1
+    exchanges = [msg for msg in state["history"] if msg.get("turn", 0) >= first_turn]
+    reviews.schedule(state["session_id"], _review(state["scenario_type"], exchanges))
+
+async def _review(scenario_type: str, exchanges: List[Dict]) -> Applier:
+    review = await turn_review_agent(scenario_type, exchanges)
+
+    def apply(state: dict):
+        points = state["insights"]["review_points"]
+        for key in ("strengths", "mistakes"):
+            points[key].extend(p for p in review.get(key, []) if isinstance(p, dict))
+            del points[key][:-settings.insights_max_candidates]
+    return apply
+
+def format_insights(insights: Dict) -> str:
+    """Render accumulated findings for the analyst prompt."""
+    lines = []
+    for key, title in (("strengths", "Strength candidates"), ("mistakes", "Mistake candidates")):
+        candidates = sorted(insights[key], key=lambda c: c["turn"])
+        if candidates:
+            lines.append(f"{title}:")
+            lines += [f"- Turn {c['turn']} (leverage {c['leverage_delta']:+d}): {', '.join(c['points'])} - \"{c['quote']}\"" for c in candidates]
+        reviewed = insights["review_points"][key]
+        if reviewed:
+            lines.append(f"{title} from turn reviews:")
+            lines += [f"- {p.get('point', '')}: {p.get('explanation', '')}" for p in reviewed]
+    labels = {**STRENGTH_SIGNALS, **MISTAKE_SIGNALS}
+    if insights["patterns"]:
+        lines.append("Recurring patterns:")
+        lines += [f"- {labels[group]}: turns {', '.join(map(str, turns))}" for group, turns in insights["patterns"].items()]
+    return "\n".join(lines)
+
+def heuristic_analysis(state: dict) -> Dict:
+    """An analysis built from the accumulated findings alone, without the
+    analyst. Used for sessions that were abandoned rather than ended."""
+    insights = state["insights"]
+
+    def points(key: str) -> List[Dict]:
+        candidates = sorted(insights[key], key=lambda c: c["turn"])
+        found = [{"point": ", ".join(c["points"]), "explanation": f"Turn {c['turn']} (leverage {c['leverage_delta']:+d}): \"{c['quote']}\""} for c in candidates]
+        return found + insights["review_points"][key]
+
+    gaps = sorted((group for group in insights["patterns"] if group in MISTAKE_SIGNALS), key=lambda group: -len(insights["patterns"][group]))
+    return {
+        "summary": f"Session left after {state['turn_number']} turns without being ended; reviewed from turn heuristics only.",
+        "outcome": ABANDONED_OUTCOME,
+        "strengths": points("strengths"),
+        "mistakes": points("mistakes"),
+        "skill_gaps": [MISTAKE_SIGNALS[group] for group in gaps]
+    }
@@ -0,0 +1,190 @@
+"""Idle-session sweeping and eviction.
+
+Sessions that are created but never ended would otherwise keep their live
+state until the store TTL. In the in-memory store that TTL only applies when
+the state is read again. Every ``session_sweep_interval`` seconds the
+sweeper looks up ``active`` sessions created more than
+``session_idle_seconds`` ago. It checks each one's ``last_active_at`` in its
+live state (session store or workflow checkpoint), read without counting as
+a use, so the sweep doesn't reorder the store's LRU. Sessions idle for
+longer, or with no live state left, are abandoned:
+- marked ``abandoned`` in Mongo. The update only applies to sessions still
+  ``active``, so one worker wins when several sweep at once, and an ended
+  session is left alone
+- live state and pending folds/reviews dropped
+- given a heuristic-only analysis if ``abandoned_session_analysis`` is on
+  and the user took at least one turn; no LLM call is made
+
+With shared state (Redis, or a sqlite/mongo checkpointer), a session
+served by another worker is never evicted early, and sessions orphaned by a
+dead worker are still found. Per-process state (the memory store or
+checkpointer) can't tell a session held by another worker from a lost one.
+There, sessions with no state on this worker are left alone until they are
+``session_max_age_seconds`` old, unless ``session_sweep_orphans`` is set
+for a single-worker deployment. Past that age, state lost in a restart
+can't keep a session ``active`` forever. Sessions
+the in-memory store evicts to stay under its count or memory ceiling are
+abandoned the same way, with reason ``capacity``. Each sweep also discards
+pending background folds and reviews of sessions without live state.
+"""
+import asyncio
+import time
+from datetime import datetime, timedelta
+from typing import Dict, Optional
+from .config import get_settings
+from .database import get_sessions_collection, get_analyses_collection
+from .insights import heuristic_analysis
+from .negotiation import background_sessions, discard_background
+from .profiles import record_analysis
+from .session_store import get_session_store
+from .tracing import background_task
+from .workflow import get_workflow
+
+settings = get_settings()
+
+ABANDONED = "abandoned"
+
+class SessionLifecycle:
+    def __init__(self, idle_seconds: int, sweep_interval: float, analyze: bool, sweep_orphans: bool, max_age_seconds: int):
+        self.idle_seconds = idle_seconds
+        self.max_age_seconds = max_age_seconds
+        self.sweep_interval = sweep_interval
+        self.analyze = analyze
+        self.sweep_orphans = sweep_orphans
+        self._task: Optional[asyncio.Task] = None
+        self._evicting: set = set()
+        self.sweeps = 0
+        self.abandoned: Dict[str, int] = {"idle": 0, "capacity": 0}
+        self.analyzed = 0
+        self.last_sweep_seconds = 0.0
+
+    async def start(self):
+        store = get_session_store()
+        if hasattr(store, "on_evict"):
+            store.on_evict = self._on_evict
+        if self._task is None and self.sweep_interval > 0:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        tasks = list(self._evicting) + ([self._task] if self._task else [])
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._task = None
+        self._evicting.clear()
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.sweep_interval)
+            try:
+                await self.sweep()
+            except Exception as e:
+                print(f"ERROR sweeping idle sessions: {e}")
+
+    @staticmethod
+    def _shared_state() -> bool:
+        return get_workflow().shared if settings.session_engine == "graph" else get_session_store().shared
+
+    @staticmethod
+    async def _live_state(session_id: str) -> Optional[dict]:
+        if settings.session_engine == "graph":
+            return await get_workflow().get(session_id)
+        return await get_session_store().peek(session_id)
+
+    async def sweep(self) -> int:
+        """Abandon idle sessions; returns how many."""
+        started = time.perf_counter()
+        cutoff = time.time() - self.idle_seconds
+        sessions_col = get_sessions_collection()
+        now = datetime.utcnow()
+        candidates = sessions_col.find(
+            {"status": "active", "created_at": {"$lt": now - timedelta(seconds=self.idle_seconds)}},
+            {"_id": 0, "session_id": 1, "created_at": 1}
+        )
+        # Without shared state, a missing session may just live on another worker,
+        # until it is older than any live session could be
+        sweep_missing = self.sweep_orphans or self._shared_state()
+        too_old = now - timedelta(seconds=self.max_age_seconds)
+        abandoned = 0
+        async for session in candidates:
+            state = await self._live_state(session["session_id"])
+            if state is None and not sweep_missing and session["created_at"] >= too_old:
+                continue
+            if state is not None and state.get("last_active_at", 0) > cutoff:
+                continue
+            if await self.abandon(session["session_id"], state, "idle"):
+                abandoned += 1
+        # Background results of sessions gone from this worker would never be applied
+        for session_id in background_sessions():
+            if await self._live_state(session_id) is None:
+                discard_background(session_id)
+        self.sweeps += 1
+        self.last_sweep_seconds = time.perf_counter() - started
+        return abandoned
+
+    def _on_evict(self, state: dict):
+        task = background_task(self.abandon(state["session_id"], state, "capacity"))
+        self._evicting.add(task)
+        task.add_done_callback(self._evicting.discard)
+
+    async def abandon(self, session_id: str, state: Optional[dict], reason: str) -> bool:
+        """Mark a session abandoned and drop its live state. False if it was no longer active."""
+        try:
+            last_active = datetime.utcfromtimestamp(state["last_active_at"]) if state and "last_active_at" in state else datetime.utcnow()
+            session = await get_sessions_collection().find_one_and_update(
+                {"session_id": session_id, "status": "active"},
+                {"$set": {"status": ABANDONED, "abandon_reason": reason, "abandoned_at": datetime.utcnow(), "ended_at": last_active}},
+                return_document=True
+            )
+            if settings.session_engine == "graph":
+                await get_workflow().delete(session_id)
+            elif reason != "capacity":
+                await get_session_store().delete(session_id)
+            discard_background(session_id)
+            if session is None:
+                return False
+            self.abandoned[reason] += 1
+            if self.analyze and state and state["turn_number"] > 0:
+                await self._analyze(session, state)
+            return True
+        except Exception as e:
+            print(f"ERROR abandoning session {session_id}: {e}")
+            return False
+
+    async def _analyze(self, session: dict, state: dict):
+        stored = {
+            "session_id": session["session_id"],
+            **heuristic_analysis(state),
+            "leverage_trajectory": state["leverage_trajectory"],
+            "mood_trajectory": state["mood_trajectory"],
+            "heuristic": True,
+            "generated_at": datetime.utcnow()
+        }
+        await get_analyses_collection().update_one({"session_id": session["session_id"]}, {"$set": stored}, upsert=True)
+        await record_analysis(session, stored)
+        self.analyzed += 1
+
+    def stats(self) -> Dict:
+        store = get_workflow().memory() if settings.session_engine == "graph" else get_session_store().stats()
+        return {
+            "engine": settings.session_engine,
+            "idle_seconds": self.idle_seconds,
+            "sweeps_orphans": self.sweep_orphans or self._shared_state(),
+            "live_sessions": store.get("sessions"),
+            "live_bytes": store.get("bytes"),
+            "max_sessions": store.get("max_sessions"),
+            "max_bytes": store.get("max_bytes"),
+            "sweeps": self.sweeps,
+            "last_sweep_seconds": self.last_sweep_seconds,
+            "abandoned_idle": self.abandoned["idle"],
+            "abandoned_capacity": self.abandoned["capacity"],
+            "heuristic_analyses": self.analyzed
+        }
+
+_lifecycle: Optional[SessionLifecycle] = None
+
+def get_session_lifecycle() -> SessionLifecycle:
+    global _lifecycle
+    if _lifecycle is None:
+        _lifecycle = SessionLifecycle(settings.session_idle_seconds, settings.session_sweep_interval, settings.abandoned_session_analysis, settings.session_sweep_orphans, settings.session_max_age_seconds)
+    return _lifecycle
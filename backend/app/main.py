@@ -1,8 +1,46 @@
+import asyncio
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, PlainTextResponse
 from .routes import router
+from .agents.llm import close_llm_clients
+from .agents.prompts import load_encoding
+from .database import get_mongodb_client, close_mongodb_client, ping_mongodb
+from .indexes import ensure_indexes
+from .session_store import close_session_store
+from .scenario_pool import get_scenario_pool
+from .analysis_queue import get_analysis_queue
+from .turn_writer import get_turn_writer
+from .workflow import get_workflow
+from .lifecycle import get_session_lifecycle
+from .config import get_settings
+from .tracing import TracingMiddleware, render_metrics
 
-app = FastAPI(title="Negotium API", version="1.0.0")
+settings = get_settings()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    get_mongodb_client()
+    await asyncio.to_thread(load_encoding)
+    await ensure_indexes()
+    await get_scenario_pool().start()
+    get_turn_writer().start()
+    await get_analysis_queue().start()
+    if settings.session_engine == "graph":
+        await get_workflow().start()
+    await get_session_lifecycle().start()
+    yield
+    await get_session_lifecycle().stop()
+    await get_scenario_pool().stop()
+    await get_analysis_queue().stop()
+    await get_turn_writer().stop()
+    await get_workflow().stop()
+    await close_llm_clients()
+    await close_session_store()
+    await close_mongodb_client()
+
+app = FastAPI(title="Negotium API", version="1.0.0", lifespan=lifespan)
 
 # CORS middleware for Next.js frontend
 app.add_middleware(
@@ -17,6 +55,9 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Outermost, so request timings include the other middleware
+app.add_middleware(TracingMiddleware)
+
 # Include API routes
 app.include_router(router)
 
@@ -26,7 +67,14 @@ async def root():
 
 @app.get("/health")
 async def health_check():
-    return {"status": "healthy"}
+    if not await ping_mongodb():
+        return JSONResponse(status_code=503, content={"status": "unhealthy", "mongodb": "unreachable"})
+    return {"status": "healthy", "mongodb": "ok"}
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    """Prometheus text format: request latency, span timings, LLM time to first token and tokens."""
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4")
 
 if __name__ == "__main__":
     import uvicorn
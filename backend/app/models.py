@@ -37,6 +37,7 @@ class MessageResponse(BaseModel):
     current_leverage: int
     turn_number: int
     conversation_stage: str
+    degraded: bool = False  # opponent reply is a stall line or cut short, and/or no coach tip
 
 class AnalysisResponse(BaseModel):
     summary: str
@@ -46,3 +47,10 @@ class AnalysisResponse(BaseModel):
     skill_gaps: List[str]
     leverage_trajectory: List[int]
     mood_trajectory: List[str]
+
+class AnalysisJobResponse(BaseModel):
+    job_id: str
+    session_id: str
+    status: str  # pending, running, complete or failed
+    attempts: int
+    error: Optional[str] = None
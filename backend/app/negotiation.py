@@ -0,0 +1,202 @@
+"""Session state transitions shared by the route handlers and the workflow graph.
+
+Both engines (``session_engine``) hold the same live state dict. They differ
+only in where it is kept between turns: the session store, or LangGraph
+checkpoints.
+"""
+import asyncio
+import time
+from datetime import datetime
+from typing import Any, AsyncIterator, Dict, List, Tuple
+from .agents import opponent_prompt_prefix, opponent_agent, opponent_agent_stream, stall_line, LLMUnavailable
+from .agents.lexicon import get_lexicon
+from .coach_cache import cached_coach_tip
+from .history import trim_history, record_key_turn, schedule_fold, folds
+from .insights import new_insights, record_turn_insights, schedule_review, format_insights, reviews
+from .models import MessageResponse
+from .tracing import span
+from .turn_writer import get_turn_writer
+
+def new_session_state(session_id: str, user_id: str, scenario_type: str, difficulty: str, scenario_config: Dict[str, Any]) -> dict:
+    return {
+        "session_id": session_id,
+        "user_id": user_id,
+        "scenario_type": scenario_type,
+        "difficulty": difficulty,
+        "personality": scenario_config["personality"],
+        "constraints": scenario_config["constraints"],
+        "batna": scenario_config["batna"],
+        "prompt_prefix": opponent_prompt_prefix(
+            scenario_type, scenario_config["personality"], scenario_config["constraints"], scenario_config["batna"]
+        ),
+        "mood": "curious",
+        "patience": scenario_config["patience"],
+        "leverage": 50,
+        "turn_number": 0,
+        "history": [
+            {"role": "assistant", "content": scenario_config["opening_message"], "turn": 0}
+        ],
+        "summary": "",
+        "summary_backlog": [],
+        "fold_failures": 0,
+        "key_turns": [],
+        "insights": new_insights(),
+        "leverage_trajectory": [50],
+        "mood_trajectory": ["curious"],
+        "last_active_at": time.time()
+    }
+
+def add_user_message(state: dict, user_message: str):
+    state["history"].append({"role": "user", "content": user_message, "turn": state["turn_number"] + 1})
+
+def get_coach_tip(user_message: str, scores: Dict[str, Any]):
+    return cached_coach_tip(
+        user_message=user_message,
+        context={
+            "leverage": scores["new_leverage"],
+            "mood": scores["new_mood"],
+            "patience": scores["new_patience"]
+        }
+    )
+
+async def respond(state: dict, user_message: str, scores: Dict[str, Any]) -> Tuple[str, bool, str]:
+    """(opponent reply, degraded, coach tip), generated concurrently. A stall
+    line stands in for the reply if the provider is unavailable."""
+    (reply, degraded), tip = await asyncio.gather(
+        _reply_or_stall(opponent_agent(
+            user_message=user_message,
+            history=state["history"],
+            scenario_type=state["scenario_type"],
+            personality=state["personality"],
+            mood=state["mood"],
+            patience=state["patience"],
+            constraints=state["constraints"],
+            batna=state["batna"],
+            current_leverage=state["leverage"],
+            scores=scores,
+            prompt_prefix=state.get("prompt_prefix")
+        )),
+        get_coach_tip(user_message, scores)
+    )
+    return reply, degraded, tip
+
+async def _reply_or_stall(opponent) -> Tuple[str, bool]:
+    try:
+        return (await opponent)["opponent_reply"], False
+    except LLMUnavailable as e:
+        print(f"ERROR opponent unavailable, stalling: {e}")
+        return stall_line(), True
+
+class StreamedReply:
+    """The opponent reply, token by token. ``text`` and ``degraded`` are final
+    once ``tokens`` is exhausted. A partial reply is kept if the provider drops
+    out mid-stream; a stall line is sent only if nothing was said yet."""
+
+    def __init__(self, state: dict, user_message: str, scores: Dict[str, Any]):
+        self.state = state
+        self.user_message = user_message
+        self.scores = scores
+        self.parts: List[str] = []
+        self.degraded = False
+
+    @property
+    def text(self) -> str:
+        return "".join(self.parts)
+
+    async def tokens(self) -> AsyncIterator[str]:
+        state = self.state
+        try:
+            async for token in opponent_agent_stream(
+                user_message=self.user_message,
+                history=state["history"],
+                scenario_type=state["scenario_type"],
+                personality=state["personality"],
+                constraints=state["constraints"],
+                batna=state["batna"],
+                scores=self.scores,
+                prompt_prefix=state.get("prompt_prefix"),
+                current_leverage=state["leverage"]
+            ):
+                self.parts.append(token)
+                yield token
+        except LLMUnavailable as e:
+            print(f"ERROR opponent stream unavailable for {state['session_id']}: {e}")
+            self.degraded = True
+            if not self.parts:
+                self.parts.append(stall_line())
+                yield self.parts[0]
+
+def apply_turn(state: dict, user_message: str, opponent_reply: str, scores: Dict[str, Any], coach_tip: str, degraded: bool = False) -> Tuple[MessageResponse, dict]:
+    """Apply a completed turn to ``state`` in place. Returns the response and
+    the turn document; pass the document to ``after_turn`` once the state is saved."""
+    leverage_delta = scores["new_leverage"] - state["leverage"]
+    state["history"].append({"role": "assistant", "content": opponent_reply, "turn": state["turn_number"] + 1})
+    state["mood"] = scores["new_mood"]
+    state["patience"] = scores["new_patience"]
+    state["leverage"] = scores["new_leverage"]
+    state["turn_number"] += 1
+    state["last_active_at"] = time.time()
+    state["leverage_trajectory"].append(scores["new_leverage"])
+    state["mood_trajectory"].append(scores["new_mood"])
+    with span("heuristics", "turn_bookkeeping"):
+        record_key_turn(state, {"turn": state["turn_number"], "user": user_message, "assistant": opponent_reply}, leverage_delta)
+        record_turn_insights(state, state["turn_number"], user_message, scores["features"], leverage_delta)
+        folds.apply_ready(state)
+        reviews.apply_ready(state)
+        trim_history(state)
+
+    turn = {
+        "session_id": state["session_id"],
+        "turn_number": state["turn_number"],
+        "user_message": user_message,
+        "opponent_response": opponent_reply,
+        "coach_tip": coach_tip,
+        "degraded": degraded,
+        "opponent_mood": scores["new_mood"],
+        "opponent_patience": scores["new_patience"],
+        "calculated_leverage": scores["new_leverage"],
+        "lexicon_version": get_lexicon().version,
+        "timestamp": datetime.utcnow()
+    }
+    response = MessageResponse(
+        opponent_response=opponent_reply,
+        coach_tip=coach_tip,
+        opponent_mood=scores["new_mood"],
+        opponent_patience=scores["new_patience"],
+        current_leverage=scores["new_leverage"],
+        turn_number=state["turn_number"],
+        conversation_stage="middle" if state["patience"] > 30 else "closing",
+        degraded=degraded
+    )
+    return response, turn
+
+async def after_turn(state: dict, turn: dict):
+    """Start background folding/review and queue the turn for its batched write."""
+    schedule_fold(state)
+    schedule_review(state)
+    await get_turn_writer().enqueue(turn)
+
+def analyst_input(state: dict) -> Dict[str, Any]:
+    """Snapshot of a finished session for the analysis job."""
+    folds.apply_ready(state)
+    reviews.apply_ready(state)
+    return {
+        "history": state["summary_backlog"] + state["history"],
+        "scenario_type": state["scenario_type"],
+        "final_leverage": state["leverage"],
+        "final_patience": state["patience"],
+        "leverage_trajectory": state["leverage_trajectory"],
+        "mood_trajectory": state["mood_trajectory"],
+        "summary": state["summary"],
+        "key_turns": state["key_turns"],
+        "total_turns": state["turn_number"],
+        "findings": format_insights(state["insights"])
+    }
+
+def discard_background(session_id: str):
+    folds.discard(session_id)
+    reviews.discard(session_id)
+
+def background_sessions() -> List[str]:
+    """Sessions with background work pending on this worker."""
+    return list(set(folds.sessions()) | set(reviews.sessions()))
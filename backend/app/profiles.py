@@ -0,0 +1,188 @@
+"""Per-user skill profile, materialized from completed analyses.
+
+Each user has one ``profiles`` document with running totals:
+- session counts and practice time
+- outcome histograms, overall and per scenario
+- the sum of final leverage per scenario
+- a count for each skill gap
+- the last ``profile_recent_sessions`` results
+
+The document is updated with ``$inc``/``$push`` when the analysis job stores
+an analysis, so the dashboard reads one document instead of scanning every
+analysis. ``profile_view`` works out averages and the leverage trend.
+
+Heuristic analyses of abandoned sessions (outcome ``Abandoned``) only count
+towards ``sessions_abandoned``, the outcome histogram and skill gaps. They
+are left out of completed sessions, practice time, per-scenario leverage
+and recent results.
+
+``record_analysis`` claims an analysis by setting its ``profiled_at`` before
+incrementing, so a retried job counts it only once. ``rebuild_profile``
+recomputes a profile from sessions and analyses (``python
+rebuild_profiles.py``). Use it for backfill, or when a crash between the
+claim and the update left a profile behind.
+"""
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+from .config import get_settings
+from .database import get_analyses_collection, get_profiles_collection, get_sessions_collection
+
+settings = get_settings()
+
+# Outcome of the heuristic analysis given to abandoned sessions (insights.heuristic_analysis)
+ABANDONED_OUTCOME = "Abandoned"
+
+def _key(name: Any) -> str:
+    # Mongo field names can't contain dots or start with $
+    return str(name).replace(".", "_").lstrip("$") or "unknown"
+
+def _entry(session: Dict, analysis: Dict) -> Dict:
+    completed_at = analysis.get("generated_at") or session.get("completed_at") or datetime.utcnow()
+    ended_at = session.get("ended_at") or completed_at
+    trajectory = analysis.get("leverage_trajectory") or [50]
+    return {
+        "session_id": session["session_id"],
+        "scenario_type": session.get("scenario_type", "unknown"),
+        "outcome": analysis.get("outcome", "Unknown"),
+        "final_leverage": trajectory[-1],
+        "skill_gaps": analysis.get("skill_gaps", []),
+        "practice_seconds": max(0.0, (ended_at - session["created_at"]).total_seconds()),
+        "completed_at": completed_at
+    }
+
+def _increments(entry: Dict) -> Dict[str, float]:
+    scenario = _key(entry["scenario_type"])
+    outcome = _key(entry["outcome"])
+    if entry["outcome"] == ABANDONED_OUTCOME:
+        inc = {"sessions_abandoned": 1, f"outcomes.{outcome}": 1}
+    else:
+        inc = {
+            "sessions_completed": 1,
+            "practice_seconds": entry["practice_seconds"],
+            f"outcomes.{outcome}": 1,
+            f"scenarios.{scenario}.sessions": 1,
+            f"scenarios.{scenario}.leverage_total": entry["final_leverage"],
+            f"scenarios.{scenario}.outcomes.{outcome}": 1
+        }
+    for gap in {_key(gap) for gap in entry["skill_gaps"] if isinstance(gap, str)}:
+        inc[f"skill_gaps.{gap}"] = 1
+    return inc
+
+def _recent(entry: Dict) -> Dict:
+    return {key: entry[key] for key in ("session_id", "scenario_type", "outcome", "final_leverage", "completed_at")}
+
+async def record_session_started(user_id: str):
+    try:
+        await get_profiles_collection().update_one(
+            {"user_id": user_id},
+            {"$inc": {"sessions_started": 1}, "$set": {"updated_at": datetime.utcnow()}},
+            upsert=True
+        )
+    except Exception as e:
+        print(f"ERROR updating profile of {user_id}: {e}")
+
+async def record_analysis(session: Dict, analysis: Dict):
+    """Fold a freshly stored analysis into its user's profile, at most once per session."""
+    try:
+        claimed = await get_analyses_collection().update_one(
+            {"session_id": session["session_id"], "profiled_at": {"$exists": False}},
+            {"$set": {"profiled_at": datetime.utcnow()}}
+        )
+        if not claimed.modified_count:
+            return
+        entry = _entry(session, analysis)
+        update = {"$inc": _increments(entry), "$set": {"updated_at": datetime.utcnow()}}
+        if entry["outcome"] != ABANDONED_OUTCOME:
+            update["$push"] = {"recent": {"$each": [_recent(entry)], "$sort": {"completed_at": 1}, "$slice": -settings.profile_recent_sessions}}
+        await get_profiles_collection().update_one({"user_id": session["user_id"]}, update, upsert=True)
+    except Exception as e:
+        print(f"ERROR updating profile for session {session.get('session_id')}: {e}")
+
+def _add(doc: Dict, path: str, amount: float):
+    *parents, leaf = path.split(".")
+    for part in parents:
+        doc = doc.setdefault(part, {})
+    doc[leaf] = doc.get(leaf, 0) + amount
+
+async def rebuild_profile(user_id: str) -> Dict:
+    """Recompute a user's profile from their sessions and analyses, replacing the stored one.
+
+    Meant for backfill: an analysis completed while this runs can be counted twice.
+    """
+    sessions = await get_sessions_collection().find(
+        {"user_id": user_id},
+        {"_id": 0, "session_id": 1, "user_id": 1, "scenario_type": 1, "created_at": 1, "ended_at": 1, "completed_at": 1}
+    ).to_list()
+    by_id = {session["session_id"]: session for session in sessions}
+    analyses_col = get_analyses_collection()
+    analyses = await analyses_col.find(
+        {"session_id": {"$in": list(by_id)}},
+        {"_id": 0, "session_id": 1, "outcome": 1, "skill_gaps": 1, "leverage_trajectory": 1, "generated_at": 1}
+    ).to_list()
+
+    now = datetime.utcnow()
+    profile = {
+        "user_id": user_id,
+        "sessions_started": len(sessions),
+        "sessions_completed": 0,
+        "sessions_abandoned": 0,
+        "practice_seconds": 0.0,
+        "outcomes": {},
+        "scenarios": {},
+        "skill_gaps": {},
+        "recent": [],
+        "updated_at": now
+    }
+    entries = sorted((_entry(by_id[a["session_id"]], a) for a in analyses), key=lambda entry: entry["completed_at"])
+    for entry in entries:
+        for path, amount in _increments(entry).items():
+            _add(profile, path, amount)
+    finished = [entry for entry in entries if entry["outcome"] != ABANDONED_OUTCOME]
+    profile["recent"] = [_recent(entry) for entry in finished[-settings.profile_recent_sessions:]]
+
+    await get_profiles_collection().replace_one({"user_id": user_id}, profile, upsert=True)
+    await analyses_col.update_many(
+        {"session_id": {"$in": [entry["session_id"] for entry in entries]}, "profiled_at": {"$exists": False}},
+        {"$set": {"profiled_at": now}}
+    )
+    return profile
+
+def _avg(values: List[float]) -> Optional[float]:
+    return round(sum(values) / len(values), 1) if values else None
+
+def profile_view(user_id: str, profile: Optional[Dict]) -> Dict:
+    """The stored totals plus averages, ranked skill gaps and the leverage trend."""
+    profile = profile or {}
+    scenarios = {
+        name: {
+            "sessions": totals.get("sessions", 0),
+            "avg_final_leverage": round(totals.get("leverage_total", 0) / totals["sessions"], 1) if totals.get("sessions") else None,
+            "outcomes": totals.get("outcomes", {})
+        }
+        for name, totals in profile.get("scenarios", {}).items()
+    }
+    recent = profile.get("recent", [])
+    window = settings.profile_trend_window
+    leverages = [item["final_leverage"] for item in recent]
+    current, previous = _avg(leverages[-window:]), _avg(leverages[-2 * window:-window])
+    return {
+        "user_id": user_id,
+        "sessions_started": profile.get("sessions_started", 0),
+        "sessions_completed": profile.get("sessions_completed", 0),
+        "sessions_abandoned": profile.get("sessions_abandoned", 0),
+        "practice_minutes": round(profile.get("practice_seconds", 0) / 60),
+        "outcomes": profile.get("outcomes", {}),
+        "scenarios": scenarios,
+        "skill_gaps": [
+            {"skill": skill, "count": count}
+            for skill, count in sorted(profile.get("skill_gaps", {}).items(), key=lambda item: item[1], reverse=True)
+        ],
+        "recent": recent,
+        "leverage_trend": {
+            "window": window,
+            "recent_avg": current,
+            "previous_avg": previous,
+            "change": round(current - previous, 1) if current is not None and previous is not None else None
+        },
+        "updated_at": profile.get("updated_at")
+    }
@@ -1,25 +1,65 @@
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, Header, HTTPException, Query
+from fastapi.responses import JSONResponse, StreamingResponse
+import asyncio
+import base64
+import json
+import secrets
 import uuid
+from typing import Optional
 from .models import (
     CreateSessionRequest,
     SendMessageRequest,
     SessionResponse,
     MessageResponse,
-    AnalysisResponse
+    AnalysisResponse,
+    AnalysisJobResponse
 )
-from .agents import (
-    scenario_designer_agent,
-    opponent_agent,
-    shadow_coach_agent,
-    analyst_agent
+from .agents import score_turn, LLMUnavailable
+from .agents.gateway import gateway_stats
+from .agents.prompts import usage_report
+from .agents.routing import routing_report
+from .analysis_queue import get_analysis_queue
+from .coach_cache import get_coach_cache
+from .config import get_settings
+from .export import EXPORT_TABLES, export_window, stream_export, arrow_available
+from .negotiation import (
+    new_session_state,
+    add_user_message,
+    get_coach_tip,
+    respond,
+    StreamedReply,
+    apply_turn,
+    after_turn,
+    analyst_input,
+    discard_background
 )
-from .database import get_sessions_collection, get_turns_collection, get_analyses_collection
+from .profiles import record_session_started, profile_view
+from .scenario_pool import get_scenario_pool
+from .session_store import get_session_store, SessionConflictError
+from .tracing import span
+from .turn_store import load_transcript
+from .turn_writer import get_turn_writer
+from .workflow import get_workflow
+from .lifecycle import get_session_lifecycle
+from .database import get_sessions_collection, get_analyses_collection, get_profiles_collection
 from datetime import datetime
 
+settings = get_settings()
+
 router = APIRouter(prefix="/api", tags=["negotiation"])
 
-# In-memory state storage (in production, use Redis or similar)
-active_sessions = {}
+# "graph" runs sessions through the checkpointed workflow instead of the session store
+GRAPH = settings.session_engine == "graph"
+
+async def _load_session(session_id: str) -> dict:
+    with span("session_store", "get"):
+        state = await get_session_store().get(session_id)
+    if state is None:
+        raise HTTPException(status_code=404, detail="Session not found")
+    return state
+
+_CONFLICT_DETAIL = "Session was updated by another request, please retry"
+_UNAVAILABLE_DETAIL = "The AI provider is temporarily unavailable, please retry shortly"
 
 @router.post("/sessions", response_model=SessionResponse)
 async def create_session(request: CreateSessionRequest):
@@ -29,53 +69,41 @@ async def create_session(request: CreateSessionRequest):
     
     session_id = f"sess_{uuid.uuid4().hex[:12]}"
     
-    # Run scenario designer agent
-    scenario_config = scenario_designer_agent(
-        scenario_type=request.scenario_type,
-        difficulty=request.difficulty
-    )
-    
-    # Initialize session state
-    session_state = {
-        "session_id": session_id,
-        "user_id": request.user_id,
-        "scenario_type": request.scenario_type,
-        "difficulty": request.difficulty,
-        "personality": scenario_config["personality"],
-        "constraints": scenario_config["constraints"],
-        "batna": scenario_config["batna"],
-        "mood": "curious",
-        "patience": scenario_config["patience"],
-        "leverage": 50,
-        "turn_number": 0,
-        "history": [
-            {"role": "assistant", "content": scenario_config["opening_message"]}
-        ],
-        "leverage_trajectory": [50],
-        "mood_trajectory": ["curious"]
-    }
-    
-    # Store in memory
-    active_sessions[session_id] = session_state
+    # Take a pre-generated scenario (falls back to the scenario designer agent)
+    try:
+        if GRAPH:
+            session_state = await get_workflow().start_session(session_id, request.user_id, request.scenario_type, request.difficulty)
+        else:
+            scenario_config = await get_scenario_pool().acquire(
+                scenario_type=request.scenario_type,
+                difficulty=request.difficulty
+            )
+            session_state = new_session_state(session_id, request.user_id, request.scenario_type, request.difficulty, scenario_config)
+            # Store live state
+            await get_session_store().create(session_state)
+    except LLMUnavailable as e:
+        print(f"ERROR creating session, scenario designer unavailable: {e}")
+        raise HTTPException(status_code=503, detail=_UNAVAILABLE_DETAIL, headers={"Retry-After": str(max(1, round(e.retry_after)))})
     
     # Save to MongoDB
     sessions_col = get_sessions_collection()
-    sessions_col.insert_one({
+    await sessions_col.insert_one({
         "session_id": session_id,
         "user_id": request.user_id,
         "scenario_type": request.scenario_type,
         "difficulty": request.difficulty,
         "status": "active",
         "created_at": datetime.utcnow(),
-        "opponent_personality": scenario_config["personality"],
-        "opponent_constraints": scenario_config["constraints"]
+        "opponent_personality": session_state["personality"],
+        "opponent_constraints": session_state["constraints"]
     })
+    await record_session_started(request.user_id)
     
     return SessionResponse(
         session_id=session_id,
         status="active",
         opponent_mood="curious",
-        opponent_patience=scenario_config["patience"],
+        opponent_patience=session_state["patience"],
         current_leverage=50,
         turn_number=0
     )
@@ -84,153 +112,205 @@ async def create_session(request: CreateSessionRequest):
 async def send_message(session_id: str, request: SendMessageRequest):
     """Send a user message and get opponent response + real-time coach tip."""
     
-    if session_id not in active_sessions:
-        raise HTTPException(status_code=404, detail="Session not found")
+    if GRAPH:
+        try:
+            response = await get_workflow().run_turn(session_id, request.content)
+        except SessionConflictError:
+            raise HTTPException(status_code=409, detail=_CONFLICT_DETAIL)
+        if response is None:
+            raise HTTPException(status_code=404, detail="Session not found")
+        return response
     
-    state = active_sessions[session_id]
+    state = await _load_session(session_id)
     
     # Add user message to history
-    state["history"].append({"role": "user", "content": request.content})
-    
-    # Get opponent response
-    opponent_result = opponent_agent(
-        user_message=request.content,
-        history=state["history"],
-        scenario_type=state["scenario_type"],
-        personality=state["personality"],
-        mood=state["mood"],
-        patience=state["patience"],
-        constraints=state["constraints"],
-        batna=state["batna"],
-        current_leverage=state["leverage"]  # Pass current leverage
-    )
+    add_user_message(state, request.content)
     
-    # Get real-time coach tip
-    coach_tip = shadow_coach_agent(
-        user_message=request.content,
-        context={
-            "leverage": opponent_result["new_leverage"],
-            "mood": opponent_result["new_mood"],
-            "patience": opponent_result["new_patience"]
-        }
-    )
+    # Heuristics don't depend on the opponent reply, so the coach can start right away
+    scores = score_turn(request.content, state["history"], state["patience"], state["leverage"])
     
-    # Update state
-    state["history"].append({"role": "assistant", "content": opponent_result["opponent_reply"]})
-    state["mood"] = opponent_result["new_mood"]
-    state["patience"] = opponent_result["new_patience"]
-    state["leverage"] = opponent_result["new_leverage"]
-    state["turn_number"] += 1
-    state["leverage_trajectory"].append(opponent_result["new_leverage"])
-    state["mood_trajectory"].append(opponent_result["new_mood"])
-    
-    # Save turn to MongoDB
-    turns_col = get_turns_collection()
-    turns_col.insert_one({
-        "session_id": session_id,
-        "turn_number": state["turn_number"],
-        "user_message": request.content,
-        "opponent_response": opponent_result["opponent_reply"],
-        "coach_tip": coach_tip,
-        "opponent_mood": opponent_result["new_mood"],
-        "opponent_patience": opponent_result["new_patience"],
-        "calculated_leverage": opponent_result["new_leverage"],
-        "timestamp": datetime.utcnow()
-    })
+    # Get opponent response and real-time coach tip concurrently
+    opponent_reply, degraded, tip = await respond(state, request.content, scores)
     
-    return MessageResponse(
-        opponent_response=opponent_result["opponent_reply"],
-        coach_tip=coach_tip,  # NEW: Real-time coaching
-        opponent_mood=opponent_result["new_mood"],
-        opponent_patience=opponent_result["new_patience"],
-        current_leverage=opponent_result["new_leverage"],
-        turn_number=state["turn_number"],
-        conversation_stage="middle" if state["patience"] > 30 else "closing"
-    )
+    try:
+        return await _record_turn(state, request.content, opponent_reply, scores, tip, degraded)
+    except SessionConflictError:
+        raise HTTPException(status_code=409, detail=_CONFLICT_DETAIL)
 
-@router.post("/sessions/{session_id}/end", response_model=AnalysisResponse)
-async def end_session(session_id: str):
-    """End the session and get comprehensive analysis."""
+@router.post("/sessions/{session_id}/message/stream")
+async def stream_message(session_id: str, request: SendMessageRequest):
+    """Stream opponent tokens as server-sent events, then a final frame with
+    the updated metrics and coach tip."""
     
-    if session_id not in active_sessions:
-        raise HTTPException(status_code=404, detail="Session not found")
+    if GRAPH:
+        if await get_workflow().get(session_id) is None:
+            raise HTTPException(status_code=404, detail="Session not found")
+        
+        async def graph_stream():
+            try:
+                async for event, data in get_workflow().stream_turn(session_id, request.content):
+                    yield _sse("token", {"content": data}) if event == "token" else _sse("done", data.model_dump())
+            except SessionConflictError:
+                yield _sse("error", {"detail": _CONFLICT_DETAIL})
+        
+        return StreamingResponse(graph_stream(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
     
-    state = active_sessions[session_id]
+    state = await _load_session(session_id)
+    add_user_message(state, request.content)
+    scores = score_turn(request.content, state["history"], state["patience"], state["leverage"])
     
-    # Run analyst agent
-    analysis = analyst_agent(
-        history=state["history"],
-        scenario_type=state["scenario_type"],
-        final_leverage=state["leverage"],
-        final_patience=state["patience"],
-        leverage_trajectory=state["leverage_trajectory"],
-        mood_trajectory=state["mood_trajectory"]
-    )
+    async def event_stream():
+        coach_task = asyncio.create_task(get_coach_tip(request.content, scores))
+        try:
+            streamed = StreamedReply(state, request.content, scores)
+            async for token in streamed.tokens():
+                yield _sse("token", {"content": token})
+            tip = await coach_task
+            try:
+                response = await _record_turn(state, request.content, streamed.text, scores, tip, streamed.degraded)
+            except SessionConflictError:
+                yield _sse("error", {"detail": _CONFLICT_DETAIL})
+                return
+            yield _sse("done", response.model_dump())
+        finally:
+            coach_task.cancel()
     
-    # Save analysis to MongoDB
-    analyses_col = get_analyses_collection()
-    analyses_col.insert_one({
-        "session_id": session_id,
-        "summary": analysis.get("summary", "Analysis completed."),
-        "outcome": analysis.get("outcome", "Unknown"),
-        "strengths": analysis.get("strengths", []),
-        "mistakes": analysis.get("mistakes", []),
-        "skill_gaps": analysis.get("skill_gaps", []),
-        "leverage_trajectory": state["leverage_trajectory"],
-        "mood_trajectory": state["mood_trajectory"],
-        "generated_at": datetime.utcnow()
-    })
+    return StreamingResponse(event_stream(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
+
+def _sse(event: str, data: dict) -> str:
+    with span("serialize", "sse"):
+        return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+async def _record_turn(state: dict, user_message: str, opponent_reply: str, scores: dict, coach_tip: str, degraded: bool = False) -> MessageResponse:
+    """Apply a completed turn to the session state and persist it.
+    Raises SessionConflictError if the session moved on since it was read."""
     
-    # Update session status
+    response, turn = apply_turn(state, user_message, opponent_reply, scores, coach_tip, degraded)
+    with span("session_store", "save"):
+        await get_session_store().save(state)
+    
+    # Background folding/review, and the turn queued for batched write to MongoDB
+    await after_turn(state, turn)
+    return response
+
+@router.post("/sessions/{session_id}/end", response_model=AnalysisJobResponse, status_code=202)
+async def end_session(session_id: str):
+    """End the session and queue its analysis. Poll GET /sessions/{id}/analysis for the result."""
+    
+    queue = get_analysis_queue()
+    job = await queue.get(session_id)
+    if job:
+        return AnalysisJobResponse(**job)
+    
+    if GRAPH:
+        try:
+            job = await get_workflow().finish_session(session_id)
+        except SessionConflictError:
+            raise HTTPException(status_code=409, detail=_CONFLICT_DETAIL)
+        if job is None:
+            raise HTTPException(status_code=404, detail="Session not found")
+    else:
+        state = await _load_session(session_id)
+        job = await queue.submit(session_id, analyst_input(state))
+    
+    # Update session status. The job is already queued and may have completed
+    # the session by now, so only a still-active session moves to "analyzing"
     sessions_col = get_sessions_collection()
-    sessions_col.update_one(
-        {"session_id": session_id},
-        {"$set": {"status": "completed", "completed_at": datetime.utcnow()}}
+    ended_at = datetime.utcnow()
+    result = await sessions_col.update_one(
+        {"session_id": session_id, "status": "active"},
+        {"$set": {"status": "analyzing", "ended_at": ended_at}}
     )
+    if not result.matched_count:
+        await sessions_col.update_one({"session_id": session_id, "ended_at": {"$exists": False}}, {"$set": {"ended_at": ended_at}})
     
-    # Clean up memory
-    del active_sessions[session_id]
+    # Clean up live state
+    if not GRAPH:
+        await get_session_store().delete(session_id)
+        discard_background(session_id)
     
-    return AnalysisResponse(
-        summary=analysis.get("summary", "Analysis completed."),
-        outcome=analysis.get("outcome", "Unknown"),
-        strengths=analysis.get("strengths", []),
-        mistakes=analysis.get("mistakes", []),
-        skill_gaps=analysis.get("skill_gaps", []),
-        leverage_trajectory=state["leverage_trajectory"],
-        mood_trajectory=state["mood_trajectory"]
-    )
+    return AnalysisJobResponse(**job)
 
 @router.get("/sessions/{session_id}")
 async def get_session(session_id: str):
     """Get session details from database."""
     
     sessions_col = get_sessions_collection()
-    session = sessions_col.find_one({"session_id": session_id}, {"_id": 0})
+    session = await sessions_col.find_one({"session_id": session_id}, {"_id": 0})
     
     if not session:
         raise HTTPException(status_code=404, detail="Session not found")
     
     return session
 
+@router.get("/sessions/{session_id}/transcript")
+async def get_transcript(session_id: str):
+    """Every recorded turn of a session, in order (including ones still in the write-behind buffer)."""
+    
+    if await get_turn_writer().flush(session_id):
+        raise HTTPException(status_code=503, detail="Some turns could not be written yet; try again")
+    turns = await load_transcript(session_id)
+    if not turns and not await get_sessions_collection().find_one({"session_id": session_id}, {"_id": 1}):
+        raise HTTPException(status_code=404, detail="Session not found")
+    
+    return {"session_id": session_id, "turns": turns}
+
+# Fields returned by the session history listing; GET /sessions/{id} has the full document
+SESSION_LIST_FIELDS = ("session_id", "scenario_type", "difficulty", "status", "created_at", "ended_at", "completed_at")
+
+def _encode_cursor(session: dict) -> str:
+    raw = json.dumps({"created_at": session["created_at"].isoformat(), "session_id": session["session_id"]})
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+def _decode_cursor(cursor: str) -> dict:
+    try:
+        raw = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return {"created_at": datetime.fromisoformat(raw["created_at"]), "session_id": str(raw["session_id"])}
+    except (ValueError, KeyError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
 @router.get("/users/{user_id}/sessions")
-async def get_user_sessions(user_id: str):
-    """Get all sessions for a user."""
+async def get_user_sessions(user_id: str, limit: int = Query(20, ge=1, le=100), cursor: Optional[str] = None):
+    """A page of a user's sessions, newest first. Pass ``next_cursor`` back as
+    ``cursor`` for the next page; it is null on the last page."""
+    
+    query = {"user_id": user_id}
+    if cursor:
+        after = _decode_cursor(cursor)
+        # Keyset: strictly after the last row of the previous page in (created_at, session_id) order
+        query["$or"] = [
+            {"created_at": {"$lt": after["created_at"]}},
+            {"created_at": after["created_at"], "session_id": {"$lt": after["session_id"]}}
+        ]
     
     sessions_col = get_sessions_collection()
-    sessions = list(sessions_col.find({"user_id": user_id}, {"_id": 0}).sort("created_at", -1))
+    projection = {"_id": 0, **{field: 1 for field in SESSION_LIST_FIELDS}}
+    sessions = await sessions_col.find(query, projection).sort([("created_at", -1), ("session_id", -1)]).limit(limit + 1).to_list()
+    
+    next_cursor = _encode_cursor(sessions[limit - 1]) if len(sessions) > limit else None
+    return {"sessions": sessions[:limit], "next_cursor": next_cursor}
+
+@router.get("/users/{user_id}/profile")
+async def get_user_profile(user_id: str):
+    """Totals, outcome histograms, per-scenario leverage, skill gaps and leverage trend for a user."""
     
-    return {"sessions": sessions}
+    profile = await get_profiles_collection().find_one({"user_id": user_id}, {"_id": 0})
+    return profile_view(user_id, profile)
 
-@router.get("/sessions/{session_id}/analysis", response_model=AnalysisResponse)
+@router.get("/sessions/{session_id}/analysis", response_model=AnalysisResponse, responses={202: {"model": AnalysisJobResponse}})
 async def get_analysis(session_id: str):
-    """Get analysis for a completed session."""
+    """Get analysis for a completed session; 202 with the job status while it is still running."""
     
     analyses_col = get_analyses_collection()
-    analysis = analyses_col.find_one({"session_id": session_id}, {"_id": 0})
+    analysis = await analyses_col.find_one({"session_id": session_id}, {"_id": 0})
     
     if not analysis:
-        raise HTTPException(status_code=404, detail="Analysis not found")
+        job = await get_analysis_queue().get(session_id)
+        if job is None:
+            raise HTTPException(status_code=404, detail="Analysis not found")
+        if job["status"] == "failed":
+            raise HTTPException(status_code=500, detail=f"Analysis failed: {job['error']}")
+        return JSONResponse(status_code=202, content=AnalysisJobResponse(**job).model_dump())
     
     return AnalysisResponse(
         summary=analysis.get("summary", "Analysis completed."),
@@ -241,3 +321,82 @@ async def get_analysis(session_id: str):
         leverage_trajectory=analysis.get("leverage_trajectory", []),
         mood_trajectory=analysis.get("mood_trajectory", [])
     )
+
+@router.get("/scenario-pool/stats")
+async def get_scenario_pool_stats():
+    """Hit rate, refill lag and current size of the pre-generated scenario pool."""
+    
+    return await get_scenario_pool().stats()
+
+@router.get("/analysis-queue/stats")
+async def get_analysis_queue_stats():
+    """Queue depth, worker activity and outcomes of background analysis jobs."""
+    
+    return get_analysis_queue().stats()
+
+@router.get("/coach-cache/stats")
+async def get_coach_cache_stats():
+    """Hit/miss counts, size and lookup time of the coach tip cache."""
+    
+    return get_coach_cache().stats()
+
+@router.get("/llm/usage")
+async def get_llm_usage():
+    """Per-agent LLM calls, latency, token counts and prefix-cache hits since startup."""
+    
+    return usage_report()
+
+@router.get("/llm/gateway")
+async def get_llm_gateway_stats():
+    """Per-model breaker state, adaptive concurrency limit, bucket levels and retry counts."""
+    
+    return gateway_stats()
+
+@router.get("/llm/routing")
+async def get_llm_routing_stats():
+    """How opponent turns were split between the 8B and 70B tiers, upgrades and estimated time saved."""
+    
+    return routing_report()
+
+@router.get("/workflow/stats")
+async def get_workflow_stats():
+    """Checkpointer in use, per-node run counts and timings, conflicts and rollbacks of the session graph."""
+    
+    return get_workflow().stats()
+
+@router.get("/session-lifecycle/stats")
+async def get_session_lifecycle_stats():
+    """Live sessions and their memory on this worker, ceilings, sweeps and abandoned sessions."""
+    
+    return get_session_lifecycle().stats()
+
+def _require_admin(token: Optional[str]):
+    if not settings.admin_token:
+        raise HTTPException(status_code=403, detail="Admin endpoints are disabled")
+    if token is None or not secrets.compare_digest(token, settings.admin_token):
+        raise HTTPException(status_code=401, detail="Invalid admin token")
+
+@router.get("/admin/export/{table}")
+async def export_table(
+    table: str,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    format: str = Query("ndjson", pattern="^(ndjson|arrow)$"),
+    x_admin_token: Optional[str] = Header(None)
+):
+    """Stream ``sessions``, ``turns`` (joined to their session) or ``analyses``
+    with ``since <= watermark < until``, as NDJSON or an Arrow IPC stream.
+    Pass ``X-Export-Until`` back as ``since`` for the next incremental export."""
+    
+    _require_admin(x_admin_token)
+    if table not in EXPORT_TABLES:
+        raise HTTPException(status_code=404, detail=f"Unknown table, expected one of: {', '.join(EXPORT_TABLES)}")
+    if format == "arrow" and not arrow_available():
+        raise HTTPException(status_code=400, detail="Arrow export needs pyarrow installed on the server")
+    
+    since, until = export_window(since, until)
+    headers = {"X-Export-Watermark": EXPORT_TABLES[table].watermark, "X-Export-Until": until.isoformat()}
+    if since:
+        headers["X-Export-Since"] = since.isoformat()
+    media_type = "application/x-ndjson" if format == "ndjson" else "application/vnd.apache.arrow.stream"
+    return StreamingResponse(stream_export(table, since, until, format), media_type=media_type, headers=headers)
@@ -0,0 +1,161 @@
+"""Pre-generated scenario configs so session creation skips the 70B call.
+
+Spares live in the ``scenario_pool`` collection, so they survive restarts and
+are shared by every worker. Claiming is a single ``find_one_and_delete``;
+each claim schedules a background refill back up to ``target_size``.
+
+Only the scenario types and difficulties the app offers
+(``scenario_pool_types`` x ``scenario_pool_difficulties``) are pooled.
+Anything else goes straight to the scenario designer, so made-up types
+can't start refills. A refill first takes a lease on its key in
+``scenario_pool_refills``, renewed after each spare. Workers that don't get
+the lease skip the refill, so the pool isn't overfilled.
+"""
+import asyncio
+import time
+import uuid
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, Optional, Tuple
+from pymongo.errors import DuplicateKeyError
+from .agents import scenario_designer_agent
+from .config import get_settings
+from .database import get_scenario_pool_collection, get_scenario_pool_refills_collection
+from .tracing import background_task
+
+settings = get_settings()
+
+class ScenarioPool:
+    def __init__(self, target_size: int, refill_concurrency: int, scenario_types: Iterable[str], difficulties: Iterable[str], lease_seconds: float):
+        self.target_size = target_size
+        self.scenario_types = set(scenario_types)
+        self.difficulties = set(difficulties)
+        self.lease_seconds = lease_seconds
+        self._owner = uuid.uuid4().hex
+        self._generate_slots = asyncio.Semaphore(refill_concurrency)
+        self._refill_tasks: Dict[Tuple[str, str], asyncio.Task] = {}
+        self.hits = 0
+        self.misses = 0
+        self.unpooled = 0
+        self.refills_skipped = 0
+        self.refills = 0
+        self.refill_lag_total = 0.0
+        self.refill_lag_max = 0.0
+
+    def pooled(self, scenario_type: str, difficulty: str) -> bool:
+        return self.target_size > 0 and scenario_type in self.scenario_types and difficulty in self.difficulties
+
+    async def acquire(self, scenario_type: str, difficulty: str) -> Dict:
+        """Return a ready scenario config, generating one inline only if the pool is empty."""
+        if not self.pooled(scenario_type, difficulty):
+            self.unpooled += 1
+            return await scenario_designer_agent(scenario_type=scenario_type, difficulty=difficulty)
+        doc = await get_scenario_pool_collection().find_one_and_delete(
+            {"scenario_type": scenario_type, "difficulty": difficulty},
+            sort=[("created_at", 1)]
+        )
+        if doc is not None:
+            self.hits += 1
+            config = doc["config"]
+        else:
+            self.misses += 1
+            config = await scenario_designer_agent(scenario_type=scenario_type, difficulty=difficulty)
+        self.schedule_refill(scenario_type, difficulty)
+        return config
+
+    def schedule_refill(self, scenario_type: str, difficulty: str):
+        if not self.pooled(scenario_type, difficulty):
+            return
+        key = (scenario_type, difficulty)
+        task = self._refill_tasks.get(key)
+        if task is None or task.done():
+            self._refill_tasks[key] = background_task(self._refill(scenario_type, difficulty))
+
+    async def _lease(self, key: str) -> bool:
+        """Take or renew the refill lease on a key; False if another worker holds it."""
+        now = datetime.utcnow()
+        try:
+            await get_scenario_pool_refills_collection().update_one(
+                {"_id": key, "$or": [{"owner": self._owner}, {"lease_until": {"$lt": now}}]},
+                {"$set": {"owner": self._owner, "lease_until": now + timedelta(seconds=self.lease_seconds)}},
+                upsert=True
+            )
+        except DuplicateKeyError:
+            # The key's lease document exists and is held by someone else
+            return False
+        return True
+
+    async def _refill(self, scenario_type: str, difficulty: str):
+        started = time.monotonic()
+        pool_col = get_scenario_pool_collection()
+        query = {"scenario_type": scenario_type, "difficulty": difficulty}
+        key = f"{scenario_type}/{difficulty}"
+        try:
+            if not await self._lease(key):
+                self.refills_skipped += 1
+                return
+            try:
+                while await pool_col.count_documents(query) < self.target_size:
+                    async with self._generate_slots:
+                        config = await scenario_designer_agent(scenario_type=scenario_type, difficulty=difficulty)
+                    await pool_col.insert_one({**query, "config": config, "created_at": datetime.utcnow()})
+                    if not await self._lease(key):
+                        break
+            finally:
+                await get_scenario_pool_refills_collection().update_one(
+                    {"_id": key, "owner": self._owner}, {"$set": {"lease_until": datetime.utcnow()}}
+                )
+        except Exception as e:
+            print(f"ERROR refilling scenario pool for {scenario_type}/{difficulty}: {e}")
+            return
+        lag = time.monotonic() - started
+        self.refills += 1
+        self.refill_lag_total += lag
+        self.refill_lag_max = max(self.refill_lag_max, lag)
+
+    async def start(self):
+        """Top up every key that already has spares in Mongo."""
+        if self.target_size <= 0:
+            return
+        pool_col = get_scenario_pool_collection()
+        cursor = await pool_col.aggregate([{"$group": {"_id": {"scenario_type": "$scenario_type", "difficulty": "$difficulty"}}}])
+        async for group in cursor:
+            self.schedule_refill(group["_id"]["scenario_type"], group["_id"]["difficulty"])
+
+    async def stop(self):
+        for task in self._refill_tasks.values():
+            task.cancel()
+        await asyncio.gather(*self._refill_tasks.values(), return_exceptions=True)
+        self._refill_tasks.clear()
+
+    async def stats(self) -> Dict:
+        requests = self.hits + self.misses
+        pool_col = get_scenario_pool_collection()
+        cursor = await pool_col.aggregate([{"$group": {"_id": {"scenario_type": "$scenario_type", "difficulty": "$difficulty"}, "count": {"$sum": 1}}}])
+        sizes = {f"{g['_id']['scenario_type']}/{g['_id']['difficulty']}": g["count"] async for g in cursor}
+        return {
+            "target_size": self.target_size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / requests if requests else 0.0,
+            "unpooled": self.unpooled,
+            "refills": self.refills,
+            "refills_skipped": self.refills_skipped,
+            "avg_refill_lag_seconds": self.refill_lag_total / self.refills if self.refills else 0.0,
+            "max_refill_lag_seconds": self.refill_lag_max,
+            "refills_in_progress": sum(1 for t in self._refill_tasks.values() if not t.done()),
+            "pool_sizes": sizes
+        }
+
+_pool: Optional[ScenarioPool] = None
+
+def get_scenario_pool() -> ScenarioPool:
+    global _pool
+    if _pool is None:
+        _pool = ScenarioPool(
+            settings.scenario_pool_size,
+            settings.scenario_pool_refill_concurrency,
+            settings.scenario_pool_types,
+            settings.scenario_pool_difficulties,
+            settings.scenario_pool_refill_lease_seconds
+        )
+    return _pool
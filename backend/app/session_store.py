@@ -0,0 +1,208 @@
+"""Live negotiation state, kept outside the worker process.
+
+Each session is one JSON document carrying a ``version`` counter. ``save``
+only succeeds when the stored version still matches the one that was read,
+so two workers handling turns for the same session cannot overwrite each
+other.
+"""
+import json
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import Callable, Dict, Optional, Tuple
+from .config import get_settings
+from .tracing import span
+
+settings = get_settings()
+
+class SessionConflictError(Exception):
+    """The session was modified by another request since it was read."""
+
+class SessionStore(ABC):
+    # Whether every worker sees the same sessions
+    shared = True
+
+    @abstractmethod
+    async def get(self, session_id: str) -> Optional[dict]:
+        """Return a copy of the session state, or None if missing/expired."""
+
+    async def peek(self, session_id: str) -> Optional[dict]:
+        """Like ``get``, but without counting as a use (for the idle sweep)."""
+        return await self.get(session_id)
+
+    @abstractmethod
+    async def create(self, state: dict) -> None:
+        """Store a new session at version 0."""
+
+    @abstractmethod
+    async def save(self, state: dict) -> None:
+        """Write back a state read via ``get``, bumping its version.
+        Raises SessionConflictError if someone else saved in between."""
+
+    @abstractmethod
+    async def delete(self, session_id: str) -> None:
+        ...
+
+    async def close(self) -> None:
+        pass
+
+    def stats(self) -> Dict:
+        """Sessions and memory held by this worker, where the backend can tell."""
+        return {}
+
+def _dumps(state: dict) -> bytes:
+    with span("serialize", "session_state"):
+        return json.dumps(state, separators=(",", ":")).encode()
+
+class InMemorySessionStore(SessionStore):
+    """Single-process stand-in with the same copy and TTL semantics as Redis.
+
+    States are kept serialized, so their memory is known exactly. Least
+    recently used sessions are evicted beyond ``max_sessions`` or ``max_bytes``
+    (0 means no limit) and handed to ``on_evict``.
+    """
+
+    shared = False
+
+    def __init__(self, ttl_seconds: int, max_sessions: int = 0, max_bytes: int = 0):
+        self.ttl_seconds = ttl_seconds
+        self.max_sessions = max_sessions
+        self.max_bytes = max_bytes
+        self.on_evict: Optional[Callable[[dict], None]] = None
+        self.evictions = 0
+        self.bytes = 0
+        # session_id -> (expires_at, version, serialized state), least recently used first
+        self._sessions: "OrderedDict[str, Tuple[float, int, bytes]]" = OrderedDict()
+
+    def _live(self, session_id: str, touch: bool = True) -> Optional[Tuple[float, int, bytes]]:
+        entry = self._sessions.get(session_id)
+        if entry is None:
+            return None
+        if entry[0] < time.monotonic():
+            self._remove(session_id)
+            return None
+        if touch:
+            self._sessions.move_to_end(session_id)
+        return entry
+
+    def _put(self, state: dict):
+        raw = _dumps(state)
+        self._remove(state["session_id"])
+        self._sessions[state["session_id"]] = (time.monotonic() + self.ttl_seconds, state["version"], raw)
+        self.bytes += len(raw)
+        while len(self._sessions) > 1 and (
+            (self.max_sessions and len(self._sessions) > self.max_sessions) or (self.max_bytes and self.bytes > self.max_bytes)
+        ):
+            _, (_, _, evicted) = self._sessions.popitem(last=False)
+            self.bytes -= len(evicted)
+            self.evictions += 1
+            if self.on_evict is not None:
+                self.on_evict(json.loads(evicted))
+
+    def _remove(self, session_id: str):
+        entry = self._sessions.pop(session_id, None)
+        if entry is not None:
+            self.bytes -= len(entry[2])
+
+    async def get(self, session_id: str) -> Optional[dict]:
+        entry = self._live(session_id)
+        return json.loads(entry[2]) if entry is not None else None
+
+    async def peek(self, session_id: str) -> Optional[dict]:
+        entry = self._live(session_id, touch=False)
+        return json.loads(entry[2]) if entry is not None else None
+
+    async def create(self, state: dict) -> None:
+        state["version"] = 0
+        self._put(state)
+
+    async def save(self, state: dict) -> None:
+        current = self._live(state["session_id"])
+        if current is None or current[1] != state["version"]:
+            raise SessionConflictError(state["session_id"])
+        state["version"] += 1
+        self._put(state)
+
+    async def delete(self, session_id: str) -> None:
+        self._remove(session_id)
+
+    def stats(self) -> Dict:
+        return {
+            "backend": "memory",
+            "sessions": len(self._sessions),
+            "bytes": self.bytes,
+            "max_sessions": self.max_sessions,
+            "max_bytes": self.max_bytes,
+            "evictions": self.evictions
+        }
+
+class RedisSessionStore(SessionStore):
+    """Redis-protocol store. Each session is a hash with the version in ``v``
+    and the compact JSON state in ``s``; both are refreshed to the TTL on write."""
+
+    def __init__(self, client, ttl_seconds: int, prefix: str = "negotium:session:"):
+        self.client = client
+        self.ttl_seconds = ttl_seconds
+        self.prefix = prefix
+
+    def _key(self, session_id: str) -> str:
+        return f"{self.prefix}{session_id}"
+
+    async def get(self, session_id: str) -> Optional[dict]:
+        raw = await self.client.hget(self._key(session_id), "s")
+        return json.loads(raw) if raw is not None else None
+
+    async def create(self, state: dict) -> None:
+        state["version"] = 0
+        key = self._key(state["session_id"])
+        async with self.client.pipeline(transaction=True) as pipe:
+            pipe.hset(key, mapping={"v": 0, "s": _dumps(state)})
+            pipe.expire(key, self.ttl_seconds)
+            await pipe.execute()
+
+    async def save(self, state: dict) -> None:
+        from redis.exceptions import WatchError
+
+        key = self._key(state["session_id"])
+        new_state = dict(state, version=state["version"] + 1)
+        async with self.client.pipeline(transaction=True) as pipe:
+            try:
+                await pipe.watch(key)
+                current = await pipe.hget(key, "v")
+                if current is None or int(current) != state["version"]:
+                    raise SessionConflictError(state["session_id"])
+                pipe.multi()
+                pipe.hset(key, mapping={"v": new_state["version"], "s": _dumps(new_state)})
+                pipe.expire(key, self.ttl_seconds)
+                await pipe.execute()
+            except WatchError:
+                raise SessionConflictError(state["session_id"])
+        state["version"] = new_state["version"]
+
+    async def delete(self, session_id: str) -> None:
+        await self.client.delete(self._key(session_id))
+
+    async def close(self) -> None:
+        await self.client.aclose()
+
+    def stats(self) -> Dict:
+        # State lives in Redis; this worker holds none of it
+        return {"backend": "redis"}
+
+_store: Optional[SessionStore] = None
+
+def get_session_store() -> SessionStore:
+    global _store
+    if _store is None:
+        if settings.session_store_backend == "redis":
+            import redis.asyncio as redis
+            _store = RedisSessionStore(redis.from_url(settings.redis_url), settings.session_ttl_seconds)
+        else:
+            _store = InMemorySessionStore(settings.session_ttl_seconds, settings.session_max_live, int(settings.session_max_memory_mb * 1024 * 1024))
+    return _store
+
+async def close_session_store():
+    global _store
+    if _store is not None:
+        await _store.close()
+        _store = None
@@ -34,3 +34,29 @@ class NegotiationState(TypedDict):
     
     # Control flow
     next_action: Literal["opponent", "shadow_coach", "end"]
+
+class SessionGraphState(TypedDict, total=False):
+    """State of the checkpointed session graph in ``workflow.py``."""
+    
+    # Set by the first invocation
+    session_id: str
+    user_id: str
+    scenario_type: str
+    difficulty: str
+    
+    # Live negotiation state, as built by ``negotiation.new_session_state``
+    session: dict
+    
+    # The action the graph was resumed with: {"type": "message" | "end", "content", "stream"}
+    action: dict
+    
+    # Current turn
+    scores: dict
+    reply: str
+    degraded: bool
+    coach_tip: str
+    response: dict
+    turn: dict
+    
+    # Analysis job submitted by the end node
+    job: dict
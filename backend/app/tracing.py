@@ -0,0 +1,294 @@
+"""Request tracing and Prometheus metrics.
+
+Code on the hot path wraps work in ``span(kind, name)``. Kinds in use:
+- ``llm``: one provider attempt, with model, tokens and time to first token
+- ``llm_queue``: time waiting for the gateway to admit a call
+- ``agent``: a whole agent call, including queueing and retries
+- ``prompt``: prompt assembly and fitting to the token budget
+- ``heuristics``: scoring and per-turn bookkeeping
+- ``session_store``: reading and saving live state
+- ``mongo``: every MongoDB command, via a pymongo command listener
+- ``serialize``: JSON encoding we do ourselves (SSE frames, session state)
+- ``node``: one step of the session graph (``session_engine=graph``)
+
+Each finished span is observed in a histogram. If it ran inside an HTTP
+request, it is also added to that request's trace. Work that outlives the
+request is started with ``background_task``, so its spans stay out of it. ``TracingMiddleware``
+times every request against its route template. When a request finishes
+(after the last streamed byte), its trace goes to the exporters
+(``trace_exporter``):
+- ``log`` prints traces slower than ``trace_slow_seconds`` with a per-kind
+  breakdown
+- ``module:function`` names a callable that takes the trace dict
+- ``add_exporter`` registers a callable from code
+
+``GET /metrics`` renders everything in the Prometheus text format. With
+``tracing_enabled`` off, ``span`` returns a shared no-op and nothing is
+recorded.
+"""
+import asyncio
+import importlib
+import time
+from collections import defaultdict
+from contextvars import ContextVar, copy_context
+from typing import Any, Callable, Coroutine, Dict, List, Optional, Tuple
+from pymongo import monitoring
+from .config import get_settings
+
+settings = get_settings()
+
+ENABLED = settings.tracing_enabled
+
+_LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+class Histogram:
+    def __init__(self, name: str, help: str, labels: Tuple[str, ...], buckets: Tuple[float, ...] = _LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.buckets = buckets
+        # label values -> [per-bucket counts..., +Inf count, sum]
+        self._series: Dict[Tuple[str, ...], List[float]] = {}
+
+    def observe(self, value: float, *label_values: str):
+        series = self._series.get(label_values)
+        if series is None:
+            series = self._series[label_values] = [0] * (len(self.buckets) + 2)
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                series[i] += 1
+                break
+        else:
+            series[len(self.buckets)] += 1
+        series[-1] += value
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for label_values, series in sorted(self._series.items()):
+            labels = _labels(self.labels, label_values)
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), series):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                lines.append(f'{self.name}_bucket{{{labels}{"," if labels else ""}le="{le}"}} {cumulative}')
+            lines.append(f"{self.name}_sum{{{labels}}} {series[-1]}")
+            lines.append(f"{self.name}_count{{{labels}}} {cumulative}")
+        return lines
+
+class Counter:
+    def __init__(self, name: str, help: str, labels: Tuple[str, ...]):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self._values: Dict[Tuple[str, ...], float] = defaultdict(float)
+
+    def inc(self, amount: float, *label_values: str):
+        self._values[label_values] += amount
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        for label_values, value in sorted(self._values.items()):
+            lines.append(f"{self.name}{{{_labels(self.labels, label_values)}}} {value}")
+        return lines
+
+def _labels(names: Tuple[str, ...], values: Tuple[str, ...]) -> str:
+    escape = lambda v: str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+    return ",".join(f'{name}="{escape(value)}"' for name, value in zip(names, values))
+
+REQUEST_SECONDS = Histogram("negotium_http_request_duration_seconds", "HTTP request latency, to the last byte sent.", ("method", "route", "status"))
+SPAN_SECONDS = Histogram("negotium_span_duration_seconds", "Time spent per span kind and name.", ("kind", "name"))
+LLM_TTFT_SECONDS = Histogram("negotium_llm_time_to_first_token_seconds", "Time from sending an LLM request to its first token.", ("model",))
+LLM_TOKENS = Counter("negotium_llm_tokens_total", "Tokens reported by the provider.", ("model", "type"))
+SPAN_ERRORS = Counter("negotium_span_errors_total", "Spans that ended with an exception.", ("kind", "name", "error"))
+METRICS = [REQUEST_SECONDS, SPAN_SECONDS, LLM_TTFT_SECONDS, LLM_TOKENS, SPAN_ERRORS]
+
+# Spans of the request being handled; None outside a request
+_trace: ContextVar[Optional[List["Span"]]] = ContextVar("trace", default=None)
+
+def background_task(coro: Coroutine) -> asyncio.Task:
+    """Start ``coro`` as a task that doesn't add spans to the current request's trace."""
+    context = copy_context()
+    context.run(_trace.set, None)
+    return asyncio.create_task(coro, context=context)
+
+class Span:
+    __slots__ = ("kind", "name", "attrs", "started", "duration")
+
+    def __init__(self, kind: str, name: str, attrs: Dict[str, Any]):
+        self.kind = kind
+        self.name = name
+        self.attrs = attrs
+        self.started = 0.0
+        self.duration = 0.0
+
+    def set(self, **attrs):
+        self.attrs.update(attrs)
+
+    def __enter__(self) -> "Span":
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.duration = time.perf_counter() - self.started
+        if exc_type is not None and not issubclass(exc_type, GeneratorExit):
+            self.attrs["error"] = exc_type.__name__
+        _finish(self)
+        return False
+
+class _NoopSpan:
+    __slots__ = ()
+
+    def set(self, **attrs):
+        pass
+
+    def __enter__(self) -> "_NoopSpan":
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+_NOOP = _NoopSpan()
+
+def span(kind: str, name: str, **attrs):
+    """Time the enclosed block. ``set`` adds attributes once they are known."""
+    if not ENABLED:
+        return _NOOP
+    return Span(kind, name, attrs)
+
+def record_span(kind: str, name: str, seconds: float, **attrs):
+    """Record a span whose duration was measured elsewhere."""
+    if not ENABLED:
+        return
+    finished = Span(kind, name, attrs)
+    finished.started = time.perf_counter() - seconds
+    finished.duration = seconds
+    _finish(finished)
+
+def _finish(finished: Span):
+    SPAN_SECONDS.observe(finished.duration, finished.kind, finished.name)
+    attrs = finished.attrs
+    if "error" in attrs:
+        SPAN_ERRORS.inc(1, finished.kind, finished.name, attrs["error"])
+    if finished.kind == "llm":
+        if attrs.get("ttft") is not None:
+            LLM_TTFT_SECONDS.observe(attrs["ttft"], finished.name)
+        for key in ("input_tokens", "output_tokens"):
+            if attrs.get(key):
+                LLM_TOKENS.inc(attrs[key], finished.name, key.split("_")[0])
+    trace = _trace.get()
+    if trace is not None:
+        trace.append(finished)
+
+class MongoCommandListener(monitoring.CommandListener):
+    """Records each MongoDB command as a ``mongo`` span named ``command collection``."""
+
+    def __init__(self):
+        self._pending: Dict[int, str] = {}
+
+    def started(self, event):
+        collection = event.command.get(event.command_name)
+        name = f"{event.command_name} {collection}" if isinstance(collection, str) else event.command_name
+        self._pending[event.request_id] = name
+
+    def succeeded(self, event):
+        name = self._pending.pop(event.request_id, event.command_name)
+        record_span("mongo", name, event.duration_micros / 1e6)
+
+    def failed(self, event):
+        name = self._pending.pop(event.request_id, event.command_name)
+        record_span("mongo", name, event.duration_micros / 1e6, error="CommandFailed")
+
+def mongo_listeners() -> List[monitoring.CommandListener]:
+    return [MongoCommandListener()] if ENABLED else []
+
+# -- Exporters ---------------------------------------------------------------
+
+_exporters: List[Callable[[Dict[str, Any]], None]] = []
+
+def add_exporter(exporter: Callable[[Dict[str, Any]], None]):
+    _exporters.append(exporter)
+
+def log_exporter(trace: Dict[str, Any]):
+    if trace["duration"] < settings.trace_slow_seconds:
+        return
+    breakdown = ", ".join(f"{kind} {seconds:.3f}s" for kind, seconds in sorted(trace["by_kind"].items(), key=lambda item: -item[1]))
+    llm = "; ".join(
+        f"{s['name']} ttft {s['attrs']['ttft']:.2f}s" for s in trace["spans"] if s["kind"] == "llm" and s["attrs"].get("ttft") is not None
+    )
+    print(f"DEBUG: slow request {trace['method']} {trace['route']} {trace['status']} in {trace['duration']:.2f}s ({breakdown}){f' [{llm}]' if llm else ''}")
+
+def _load_exporter(spec: str) -> Optional[Callable[[Dict[str, Any]], None]]:
+    if not spec:
+        return None
+    if spec == "log":
+        return log_exporter
+    module, _, attr = spec.partition(":")
+    try:
+        return getattr(importlib.import_module(module), attr)
+    except Exception as e:
+        print(f"ERROR loading trace exporter {spec}: {e}")
+        return None
+
+_configured = _load_exporter(settings.trace_exporter) if ENABLED else None
+if _configured is not None:
+    add_exporter(_configured)
+
+def _export(method: str, route: str, status: int, started: float, duration: float, spans: List[Span]):
+    if not _exporters:
+        return
+    by_kind: Dict[str, float] = defaultdict(float)
+    for s in spans:
+        # Agent spans contain llm/prompt spans; count them once, as their own kinds
+        if s.kind != "agent":
+            by_kind[s.kind] += s.duration
+    trace = {
+        "method": method,
+        "route": route,
+        "status": status,
+        "duration": duration,
+        "by_kind": dict(by_kind),
+        "spans": [{"kind": s.kind, "name": s.name, "offset": s.started - started, "duration": s.duration, "attrs": s.attrs} for s in spans]
+    }
+    for exporter in _exporters:
+        try:
+            exporter(trace)
+        except Exception as e:
+            print(f"ERROR in trace exporter: {e}")
+
+# -- HTTP --------------------------------------------------------------------
+
+class TracingMiddleware:
+    """Times each request up to its last body chunk, so streamed responses are covered."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not ENABLED:
+            await self.app(scope, receive, send)
+            return
+        spans: List[Span] = []
+        token = _trace.set(spans)
+        started = time.perf_counter()
+        status = 500
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            _trace.reset(token)
+            duration = time.perf_counter() - started
+            route = getattr(scope.get("route"), "path", "unmatched")
+            REQUEST_SECONDS.observe(duration, scope["method"], route, str(status))
+            _export(scope["method"], route, status, started, duration, spans)
+
+def render_metrics() -> str:
+    lines: List[str] = []
+    for metric in METRICS:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,144 @@
+"""Where turns are stored (``turn_storage``).
+
+- ``documents``: one ``turns`` document per turn
+- ``buckets``: turns embedded in per-session ``turn_buckets`` documents, at
+  most ``turn_bucket_size`` turns each. Turn n goes to bucket
+  ``(n - 1) // turn_bucket_size``. A whole transcript is then one indexed
+  read of a few documents, not one index entry per turn. Don't change the
+  bucket size once buckets exist.
+
+Both modes are idempotent, so the turn writer can retry a batch. A document
+insert that hits the unique (session_id, turn_number) index was already
+written. A bucket push only matches a bucket that doesn't hold the turn
+yet. If the bucket already holds it, the upsert collides with the unique
+(session_id, bucket) index instead. Two workers creating the same bucket at
+once collide too, so a duplicate is only trusted after checking that the
+turn is really there.
+
+Readers go through ``iter_turns`` and ``load_transcript``, which handle
+either layout. ``load_transcript`` falls back to ``turns`` for sessions not
+yet moved by ``migrate_turns.py``.
+"""
+from datetime import datetime
+from typing import Any, AsyncIterator, Dict, List, Optional
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+from .config import get_settings
+from .database import get_turns_collection, get_turn_buckets_collection
+
+settings = get_settings()
+
+BUCKETED = settings.turn_storage == "buckets"
+
+DUPLICATE_KEY = 11000
+
+def bucket_of(turn_number: int) -> int:
+    return (turn_number - 1) // settings.turn_bucket_size
+
+def bucket_push(session_id: str, turns: List[Dict[str, Any]], only_new: bool = True) -> UpdateOne:
+    """Append turns (all in one bucket) to their bucket, creating it if needed.
+    With ``only_new``, the update skips a bucket that already holds the (single) turn."""
+    numbers = [turn["turn_number"] for turn in turns]
+    query = {"session_id": session_id, "bucket": bucket_of(numbers[0])}
+    if only_new:
+        query["turns.turn_number"] = {"$ne": numbers[0]}
+    timestamps = [turn["timestamp"] for turn in turns]
+    return UpdateOne(
+        query,
+        {
+            "$push": {"turns": {"$each": [_entry(turn) for turn in turns], "$sort": {"turn_number": 1}}},
+            "$inc": {"count": len(turns)},
+            "$min": {"first_turn": min(numbers), "first_timestamp": min(timestamps)},
+            "$max": {"last_turn": max(numbers), "last_timestamp": max(timestamps)}
+        },
+        upsert=True
+    )
+
+def _entry(turn: Dict[str, Any]) -> Dict[str, Any]:
+    return {key: value for key, value in turn.items() if key not in ("_id", "session_id")}
+
+async def write_turns(batch: List[dict]) -> List[dict]:
+    """Write a batch of turn documents. Returns those that failed and should be retried."""
+    if not BUCKETED:
+        try:
+            await get_turns_collection().insert_many(batch, ordered=False)
+        except BulkWriteError as e:
+            # Docs that hit a duplicate key were written by an earlier attempt
+            return [batch[err["index"]] for err in e.details["writeErrors"] if err["code"] != DUPLICATE_KEY]
+        return []
+
+    buckets = get_turn_buckets_collection()
+    try:
+        await buckets.bulk_write([bucket_push(turn["session_id"], [turn]) for turn in batch], ordered=False)
+    except BulkWriteError as e:
+        failed = []
+        for err in e.details["writeErrors"]:
+            turn = batch[err["index"]]
+            if err["code"] != DUPLICATE_KEY or not await buckets.find_one(
+                {"session_id": turn["session_id"], "bucket": bucket_of(turn["turn_number"]), "turns.turn_number": turn["turn_number"]},
+                {"_id": 1}
+            ):
+                failed.append(turn)
+        return failed
+    return []
+
+async def load_transcript(session_id: str) -> List[Dict[str, Any]]:
+    """All stored turns of a session, in order."""
+    if BUCKETED:
+        buckets = await get_turn_buckets_collection().find({"session_id": session_id}, {"_id": 0, "turns": 1}).sort("bucket", 1).to_list()
+        if buckets:
+            return [{"session_id": session_id, **turn} for bucket in buckets for turn in bucket["turns"]]
+    return await get_turns_collection().find({"session_id": session_id}, {"_id": 0}).sort("turn_number", 1).to_list()
+
+async def iter_turns(fields: List[str], batch_size: int, lexicon_version: Optional[int] = None, limit: Optional[int] = None) -> AsyncIterator[Dict[str, Any]]:
+    """Every stored turn, ordered by (session_id, turn_number), with ``session_id`` and ``fields``."""
+    if not BUCKETED:
+        query = {} if lexicon_version is None else {"lexicon_version": lexicon_version}
+        projection = {"_id": 0, "session_id": 1, **{field: 1 for field in fields}}
+        cursor = get_turns_collection().find(query, projection).sort([("session_id", 1), ("turn_number", 1)]).batch_size(batch_size)
+        if limit:
+            cursor = cursor.limit(limit)
+        async for turn in cursor:
+            yield turn
+        return
+
+    query = {} if lexicon_version is None else {"turns.lexicon_version": lexicon_version}
+    projection = {"_id": 0, "session_id": 1, **{f"turns.{field}": 1 for field in fields + ["lexicon_version"]}}
+    cursor = get_turn_buckets_collection().find(query, projection).sort([("session_id", 1), ("bucket", 1)])
+    cursor = cursor.batch_size(max(1, batch_size // settings.turn_bucket_size))
+    count = 0
+    async for bucket in cursor:
+        for turn in bucket["turns"]:
+            if lexicon_version is not None and turn.get("lexicon_version") != lexicon_version:
+                continue
+            yield {"session_id": bucket["session_id"], **{field: turn.get(field) for field in fields if field in turn}}
+            count += 1
+            if limit and count >= limit:
+                return
+
+async def bucketed_turn_pages(since: Optional[datetime], until: datetime, chunk_size: int) -> AsyncIterator[List[Dict[str, Any]]]:
+    """Turns with ``since <= timestamp < until``, about ``chunk_size`` at a time.
+    Buckets are paged by ``_id``, which never changes as they grow, so each
+    is visited once. Turns come out grouped by bucket rather than in global
+    timestamp order."""
+    per_page = max(1, chunk_size // settings.turn_bucket_size)
+    window: Dict[str, Any] = {"first_timestamp": {"$lt": until}}
+    if since:
+        window["last_timestamp"] = {"$gte": since}
+    collection = get_turn_buckets_collection()
+    last_id = None
+    while True:
+        query = window if last_id is None else {**window, "_id": {"$gt": last_id}}
+        buckets = await collection.find(query, {"session_id": 1, "turns": 1}).sort("_id", 1).limit(per_page).to_list()
+        if not buckets:
+            return
+        last_id = buckets[-1]["_id"]
+        turns = [
+            {"session_id": bucket["session_id"], **turn}
+            for bucket in buckets for turn in bucket["turns"]
+            if turn["timestamp"] < until and (since is None or turn["timestamp"] >= since)
+        ]
+        if turns:
+            yield turns
+        if len(buckets) < per_page:
+            return
@@ -0,0 +1,142 @@
+"""Write-behind buffer for turn documents.
+
+Turn documents are queued on the request path and written in batches
+(``turn_store.write_turns``: ``insert_many`` or bucket pushes) once
+``batch_size`` docs are pending or ``flush_interval`` seconds have passed.
+The buffer is bounded: ``enqueue`` waits while ``max_pending`` docs are
+queued or being written. A turn that fails to write goes to the back of the
+queue and is retried, up to ``max_attempts`` writes, then dropped and
+logged. ``flush`` returns how many of the flushed turns failed, so callers
+that need a session persisted (analysis, transcripts) can retry instead.
+Everything still pending is flushed on shutdown.
+"""
+import asyncio
+from typing import Dict, List, Optional, Tuple
+from .config import get_settings
+from .turn_store import write_turns
+
+settings = get_settings()
+
+class TurnWriter:
+    def __init__(self, batch_size: int, flush_interval: float, max_pending: int, max_attempts: int):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self.max_attempts = max_attempts
+        self._pending: List[dict] = []
+        self._in_flight = 0
+        # (session_id, turn_number) -> failed writes so far
+        self._attempts: Dict[Tuple[str, int], int] = {}
+        self._not_full = asyncio.Condition()
+        self._batch_ready = asyncio.Event()
+        self._flush_lock = asyncio.Lock()
+        self._task: Optional[asyncio.Task] = None
+        self._stopping = False
+        self.written = 0
+        self.failed_writes = 0
+        self.dropped = 0
+
+    async def enqueue(self, turn: dict):
+        async with self._not_full:
+            await self._not_full.wait_for(lambda: len(self._pending) + self._in_flight < self.max_pending)
+            self._pending.append(turn)
+        if len(self._pending) >= self.batch_size:
+            self._batch_ready.set()
+
+    async def flush(self, session_id: Optional[str] = None) -> int:
+        """Write pending turns now; only that session's turns if ``session_id`` is given.
+        Returns how many of them failed (requeued or dropped). Holding the flush
+        lock also waits out any batch already in flight."""
+        failed = 0
+        async with self._flush_lock:
+            if session_id is None:
+                batch, self._pending = self._pending, []
+            else:
+                batch = [t for t in self._pending if t["session_id"] == session_id]
+                self._pending = [t for t in self._pending if t["session_id"] != session_id]
+            # Still counted against max_pending until written or requeued
+            self._in_flight = len(batch)
+            try:
+                for start in range(0, len(batch), self.batch_size):
+                    chunk = batch[start:start + self.batch_size]
+                    failed += await self._write(chunk)
+                    self._in_flight -= len(chunk)
+            finally:
+                self._in_flight = 0
+        async with self._not_full:
+            self._not_full.notify_all()
+        return failed
+
+    async def _write(self, batch: List[dict]) -> int:
+        if not batch:
+            return 0
+        try:
+            failed = await write_turns(batch)
+        except Exception as e:
+            print(f"ERROR writing {len(batch)} turns: {e}")
+            failed = batch
+        self.written += len(batch) - len(failed)
+        if self._attempts:
+            failed_ids = {id(turn) for turn in failed}
+            for turn in batch:
+                if id(turn) not in failed_ids:
+                    self._attempts.pop((turn["session_id"], turn["turn_number"]), None)
+        retry = []
+        for turn in failed:
+            key = (turn["session_id"], turn["turn_number"])
+            attempts = self._attempts.pop(key, 0) + 1
+            if attempts >= self.max_attempts:
+                print(f"ERROR dropping turn {turn['turn_number']} of session {turn['session_id']} after {attempts} failed writes")
+                self.dropped += 1
+            else:
+                self._attempts[key] = attempts
+                retry.append(turn)
+        self.failed_writes += len(failed)
+        if retry:
+            # At the back, so a batch that keeps failing doesn't hold up newer turns
+            print(f"ERROR writing {len(retry)} of {len(batch)} turns, requeueing")
+            self._pending.extend(retry)
+        return len(failed)
+
+    async def _run(self):
+        while not self._stopping:
+            try:
+                await asyncio.wait_for(self._batch_ready.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._batch_ready.clear()
+            await self.flush()
+
+    def start(self):
+        if self._task is None:
+            self._stopping = False
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        # Let an in-flight batch finish rather than cancelling it mid-write
+        if self._task is not None:
+            self._stopping = True
+            self._batch_ready.set()
+            await self._task
+            self._task = None
+        await self.flush()
+
+    @property
+    def pending(self) -> int:
+        return len(self._pending)
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "pending": len(self._pending),
+            "written": self.written,
+            "failed_writes": self.failed_writes,
+            "dropped": self.dropped
+        }
+
+_writer: Optional[TurnWriter] = None
+
+def get_turn_writer() -> TurnWriter:
+    global _writer
+    if _writer is None:
+        _writer = TurnWriter(settings.turn_write_batch_size, settings.turn_write_flush_interval, settings.turn_write_max_pending, settings.turn_write_max_attempts)
+    return _writer
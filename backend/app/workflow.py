@@ -1,51 +1,324 @@
-from langgraph.graph import StateGraph, END
-from state import NegotiationState
-from agents.scenario_designer import scenario_designer_node
-from agents.opponent import opponent_agent_node
-from agents.shadow_coach import shadow_coach_node
-
-def create_negotiation_workflow():
-    """
-    Creates the LangGraph workflow for negotiation.
-    
-    Flow:
-    START -> Scenario Designer -> Opponent <-> Opponent (loop) -> Shadow Coach -> END
-    """
-    
-    # Create graph
-    workflow = StateGraph(NegotiationState)
-    
-    # Add nodes
-    workflow.add_node("scenario_designer", scenario_designer_node)
-    workflow.add_node("opponent", opponent_agent_node)
-    workflow.add_node("shadow_coach", shadow_coach_node)
-    
-    # Define edges
-    workflow.set_entry_point("scenario_designer")
-    workflow.add_edge("scenario_designer", "opponent")
-    
-    # Conditional routing from opponent
-    def route_opponent(state: NegotiationState) -> str:
-        """Route based on next_action in state."""
-        next_action = state.get("next_action", "opponent")
-        if next_action == "end" or state.get("conversation_stage") == "ended":
-            return "shadow_coach"
-        return "opponent"
-    
-    workflow.add_conditional_edges(
-        "opponent",
-        route_opponent,
-        {
-            "opponent": "opponent",  # Continue conversation
-            "shadow_coach": "shadow_coach"  # End and analyze
-        }
+"""The negotiation session as a checkpointed LangGraph workflow.
+
+    START -> setup -> wait -> score -> respond -> record -> wait ...
+                     `-> end -> END
+
+``wait`` interrupts before every opponent turn. The graph is resumed with the
+user's next action: ``{"type": "message", "content": ..., "stream": bool}`` or
+``{"type": "end"}``. Each session is a thread keyed by ``session_id``, and every
+resume runs from the thread's latest checkpoint. So a turn can be handled by
+any worker that shares the checkpointer (``workflow_checkpointer``):
+- ``memory``: this process only
+- ``sqlite``: workers on one host (``workflow_sqlite_path``)
+- ``mongo``: any worker, with checkpoints expiring after ``session_ttl_seconds``
+
+Runs use ``durability="exit"``, so a turn costs one checkpoint write. That
+write happens when the graph stops at the next ``wait``. If a turn fails, the
+thread is resumed from its last waiting checkpoint. The failed turn is
+dropped, like an unsaved turn in the session store.
+
+Turns for one session are serialized within a process. A second concurrent
+request gets ``SessionConflictError``. Across workers, nothing stops two turns
+for the same session from running at once; the later checkpoint wins. Route a
+session's requests to one worker if clients may send turns concurrently.
+"""
+import asyncio
+import time
+import weakref
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Optional, Tuple
+from langgraph.checkpoint.memory import InMemorySaver
+from langgraph.config import get_stream_writer
+from langgraph.graph import StateGraph, START, END
+from langgraph.types import Command, interrupt
+from .agents import score_turn
+from .analysis_queue import get_analysis_queue
+from .config import get_settings
+from .models import MessageResponse
+from .negotiation import (
+    new_session_state,
+    add_user_message,
+    get_coach_tip,
+    respond,
+    StreamedReply,
+    apply_turn,
+    after_turn,
+    analyst_input,
+    discard_background
+)
+from .scenario_pool import get_scenario_pool
+from .session_store import SessionConflictError
+from .state import SessionGraphState
+from .tracing import span
+
+settings = get_settings()
+
+# -- Nodes -------------------------------------------------------------------
+
+async def _setup(state: SessionGraphState) -> dict:
+    scenario_config = await get_scenario_pool().acquire(
+        scenario_type=state["scenario_type"],
+        difficulty=state["difficulty"]
     )
-    
-    workflow.add_edge("shadow_coach", END)
-    
-    # Compile
-    app = workflow.compile()
-    return app
-
-# Create singleton instance
-negotiation_app = create_negotiation_workflow()
+    return {"session": new_session_state(state["session_id"], state["user_id"], state["scenario_type"], state["difficulty"], scenario_config)}
+
+async def _wait(state: SessionGraphState) -> dict:
+    return {"action": interrupt({"turn_number": state["session"]["turn_number"]})}
+
+def _after_wait(state: SessionGraphState) -> str:
+    return "end" if state["action"]["type"] == "end" else "score"
+
+async def _score(state: SessionGraphState) -> dict:
+    session, content = state["session"], state["action"]["content"]
+    add_user_message(session, content)
+    scores = score_turn(content, session["history"], session["patience"], session["leverage"])
+    return {"session": session, "scores": scores}
+
+async def _respond(state: SessionGraphState) -> dict:
+    session, content, scores = state["session"], state["action"]["content"], state["scores"]
+    if not state["action"].get("stream"):
+        reply, degraded, tip = await respond(session, content, scores)
+        return {"reply": reply, "degraded": degraded, "coach_tip": tip}
+
+    write = get_stream_writer()
+    coach_task = asyncio.create_task(get_coach_tip(content, scores))
+    try:
+        streamed = StreamedReply(session, content, scores)
+        async for token in streamed.tokens():
+            write({"token": token})
+        tip = await coach_task
+    finally:
+        coach_task.cancel()
+    return {"reply": streamed.text, "degraded": streamed.degraded, "coach_tip": tip}
+
+async def _record(state: SessionGraphState) -> dict:
+    session = state["session"]
+    response, turn = apply_turn(session, state["action"]["content"], state["reply"], state["scores"], state["coach_tip"], state["degraded"])
+    return {"session": session, "response": response.model_dump(), "turn": turn}
+
+async def _end(state: SessionGraphState) -> dict:
+    job = await get_analysis_queue().submit(state["session_id"], analyst_input(state["session"]))
+    return {"job": job}
+
+# -- Checkpointers -----------------------------------------------------------
+
+async def _open_checkpointer(kind: str) -> Tuple[Any, Optional[Callable[[], Awaitable[None]]]]:
+    """(saver, async close callback or None)."""
+    if kind == "memory":
+        return InMemorySaver(), None
+    if kind == "sqlite":
+        import aiosqlite
+        from langgraph.checkpoint.sqlite.aio import AsyncSqliteSaver
+        conn = await aiosqlite.connect(settings.workflow_sqlite_path)
+        saver = AsyncSqliteSaver(conn)
+        await saver.setup()
+        return saver, conn.close
+    if kind == "mongo":
+        # The saver is built on the sync client and runs its async methods in a thread pool
+        from pymongo import MongoClient
+        from langgraph.checkpoint.mongodb import MongoDBSaver
+        client = MongoClient(settings.mongodb_uri, maxPoolSize=settings.mongodb_max_pool_size)
+        saver = await asyncio.to_thread(
+            MongoDBSaver,
+            client,
+            db_name="negotium",
+            checkpoint_collection_name="workflow_checkpoints",
+            writes_collection_name="workflow_checkpoint_writes",
+            ttl=settings.session_ttl_seconds
+        )
+        return saver, lambda: asyncio.to_thread(client.close)
+    raise ValueError(f"Unknown workflow_checkpointer: {kind}")
+
+# -- Engine ------------------------------------------------------------------
+
+class SessionWorkflow:
+    def __init__(self, checkpointer: str):
+        self.checkpointer = checkpointer
+        self.graph = None
+        self._close: Optional[Callable[[], Awaitable[None]]] = None
+        self._locks: "weakref.WeakValueDictionary[str, asyncio.Lock]" = weakref.WeakValueDictionary()
+        # node -> [runs, errors, total seconds, max seconds]
+        self._nodes: Dict[str, list] = {}
+        self.rollbacks = 0
+        self.conflicts = 0
+
+    async def start(self):
+        if self.graph is not None:
+            return
+        saver, self._close = await _open_checkpointer(self.checkpointer)
+        self.graph = self._build().compile(checkpointer=saver)
+
+    async def stop(self):
+        if self._close is not None:
+            await self._close()
+        self.graph = None
+        self._close = None
+
+    def _build(self) -> StateGraph:
+        graph = StateGraph(SessionGraphState)
+        graph.add_node("setup", self._timed("setup", _setup))
+        graph.add_node("wait", _wait)
+        graph.add_node("score", self._timed("score", _score))
+        graph.add_node("respond", self._timed("respond", _respond))
+        graph.add_node("record", self._timed("record", _record))
+        graph.add_node("end", self._timed("end", _end))
+        graph.add_edge(START, "setup")
+        graph.add_edge("setup", "wait")
+        graph.add_conditional_edges("wait", _after_wait, {"score": "score", "end": "end"})
+        graph.add_edge("score", "respond")
+        graph.add_edge("respond", "record")
+        graph.add_edge("record", "wait")
+        graph.add_edge("end", END)
+        return graph
+
+    def _timed(self, name: str, node: Callable[[SessionGraphState], Awaitable[dict]]):
+        stats = self._nodes.setdefault(name, [0, 0, 0.0, 0.0])
+
+        async def run(state: SessionGraphState) -> dict:
+            started = time.perf_counter()
+            try:
+                with span("node", name):
+                    return await node(state)
+            except Exception:
+                stats[1] += 1
+                raise
+            finally:
+                elapsed = time.perf_counter() - started
+                stats[0] += 1
+                stats[2] += elapsed
+                stats[3] = max(stats[3], elapsed)
+        return run
+
+    @staticmethod
+    def _config(session_id: str) -> dict:
+        return {"configurable": {"thread_id": session_id}}
+
+    def _lock(self, session_id: str) -> asyncio.Lock:
+        lock = self._locks.get(session_id)
+        if lock is None:
+            lock = self._locks[session_id] = asyncio.Lock()
+        if lock.locked():
+            self.conflicts += 1
+            raise SessionConflictError(session_id)
+        return lock
+
+    async def _resume_config(self, session_id: str) -> Optional[dict]:
+        """Config of the checkpoint to resume from: the latest one if the thread
+        is waiting, else (after a failed turn) the last one that was. None if
+        the session doesn't exist or has ended."""
+        config = self._config(session_id)
+        snapshot = await self.graph.aget_state(config)
+        if not snapshot.values or not snapshot.next:
+            return None
+        if snapshot.next == ("wait",):
+            return config
+        async for earlier in self.graph.aget_state_history(config):
+            if earlier.next == ("wait",) and earlier.interrupts:
+                self.rollbacks += 1
+                return earlier.config
+        return None
+
+    async def start_session(self, session_id: str, user_id: str, scenario_type: str, difficulty: str) -> dict:
+        """Run setup and stop at the first ``wait``. Returns the live state."""
+        try:
+            values = await self.graph.ainvoke(
+                {"session_id": session_id, "user_id": user_id, "scenario_type": scenario_type, "difficulty": difficulty},
+                self._config(session_id),
+                durability="exit"
+            )
+        except Exception:
+            await self.graph.checkpointer.adelete_thread(session_id)
+            raise
+        return values["session"]
+
+    @property
+    def shared(self) -> bool:
+        """Whether every worker sees the same sessions (any checkpointer but ``memory``)."""
+        return self.checkpointer != "memory"
+
+    async def get(self, session_id: str) -> Optional[dict]:
+        snapshot = await self.graph.aget_state(self._config(session_id))
+        return snapshot.values.get("session") if snapshot.next else None
+
+    async def run_turn(self, session_id: str, content: str) -> Optional[MessageResponse]:
+        """Resume with a user message. None if the session doesn't exist."""
+        async with self._lock(session_id):
+            config = await self._resume_config(session_id)
+            if config is None:
+                return None
+            values = await self.graph.ainvoke(Command(resume={"type": "message", "content": content}), config, durability="exit")
+        await after_turn(values["session"], values["turn"])
+        return MessageResponse(**values["response"])
+
+    async def stream_turn(self, session_id: str, content: str) -> AsyncIterator[Tuple[str, Any]]:
+        """Resume with a user message, yielding ``("token", text)`` as the
+        opponent speaks and then ``("done", MessageResponse)``. Raises
+        SessionConflictError if the session is busy or gone."""
+        values = None
+        async with self._lock(session_id):
+            config = await self._resume_config(session_id)
+            if config is None:
+                raise SessionConflictError(session_id)
+            async for mode, chunk in self.graph.astream(
+                Command(resume={"type": "message", "content": content, "stream": True}),
+                config,
+                stream_mode=["custom", "values"],
+                durability="exit"
+            ):
+                if mode == "custom":
+                    yield "token", chunk["token"]
+                else:
+                    values = chunk
+        await after_turn(values["session"], values["turn"])
+        yield "done", MessageResponse(**values["response"])
+
+    async def finish_session(self, session_id: str) -> Optional[Dict]:
+        """Resume with ``end``: submits the analysis job and drops the thread.
+        Returns the job, or None if the session doesn't exist."""
+        async with self._lock(session_id):
+            config = await self._resume_config(session_id)
+            if config is None:
+                return None
+            values = await self.graph.ainvoke(Command(resume={"type": "end"}), config, durability="exit")
+            await self.graph.checkpointer.adelete_thread(session_id)
+        discard_background(session_id)
+        return values["job"]
+
+    async def delete(self, session_id: str):
+        """Drop a session's thread without ending it (see ``lifecycle.py``)."""
+        await self.graph.checkpointer.adelete_thread(session_id)
+
+    def memory(self) -> Dict:
+        """Threads and checkpoint bytes held in this process (memory checkpointer only)."""
+        saver = self.graph.checkpointer if self.graph is not None else None
+        if not isinstance(saver, InMemorySaver):
+            return {}
+        size = sum(len(blob[1]) for blob in list(saver.blobs.values()))
+        size += sum(len(checkpoint[1]) + len(metadata[1]) for thread in list(saver.storage.values()) for ns in thread.values() for checkpoint, metadata, _ in ns.values())
+        # Lookups of missing threads leave empty entries behind in the defaultdict
+        return {"sessions": sum(1 for thread in list(saver.storage.values()) if any(thread.values())), "bytes": size}
+
+    def stats(self) -> Dict:
+        return {
+            "checkpointer": self.checkpointer,
+            "running": self.graph is not None,
+            "active_sessions": sum(1 for lock in list(self._locks.values()) if lock.locked()),
+            "conflicts": self.conflicts,
+            "rollbacks": self.rollbacks,
+            "nodes": {
+                name: {
+                    "runs": runs,
+                    "errors": errors,
+                    "avg_seconds": total / runs if runs else 0.0,
+                    "max_seconds": longest
+                }
+                for name, (runs, errors, total, longest) in self._nodes.items()
+            }
+        }
+
+_workflow: Optional[SessionWorkflow] = None
+
+def get_workflow() -> SessionWorkflow:
+    global _workflow
+    if _workflow is None:
+        _workflow = SessionWorkflow(settings.workflow_checkpointer)
+    return _workflow
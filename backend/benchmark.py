@@ -0,0 +1,445 @@
+"""In-process load and latency benchmark for the backend.
+
+    python benchmark.py load --sessions 200 --concurrency 20 --turns 6
+    python benchmark.py micro
+    python benchmark.py load --main-latency lognormal:0.8:0.4 --json before.json
+
+``load`` runs the FastAPI app and its lifespan in this process, on one event
+loop, with:
+- a deterministic fake ``ChatGroq``, whose replies come from ``fake_groq``
+- mongomock behind an async adapter, in place of MongoDB
+- the memory session store
+
+Virtual users run create -> message/stream x N -> end -> poll analysis. The
+report gives p50/p95/p99 per endpoint, throughput, and event-loop lag sampled
+while the load runs. The gateway, routing, analysis queue and coach cache
+stats are included in ``--json`` output. Turns the write-behind buffer failed
+to write, or never wrote, are reported as errors.
+
+Latency specs are ``fixed:S``, ``uniform:LO:HI``, ``lognormal:MEDIAN:SIGMA``
+or ``exp:MEAN``, in seconds. The gateway keeps its configured rate limits
+unless ``--unthrottled`` is passed. Other settings can be overridden through
+the usual environment variables.
+
+``micro`` times the per-turn heuristics: lexicon extraction, scoring,
+routing, draft checks, coach-cache hashing and token counting.
+
+Needs mongomock (``pip install -r requirements-bench.txt``).
+"""
+import argparse
+import asyncio
+import json
+import math
+import os
+import random
+import sys
+import time
+import timeit
+from collections import defaultdict
+from typing import Callable, Dict, List, Optional
+
+SAMPLE_MESSAGES = [
+    "Hi, thanks for making time today.",
+    "Sounds good.",
+    "I'd like to talk about my compensation for next year.",
+    "I led the migration that cut infrastructure costs by 30% and shipped two launches early.",
+    "The market rate for comparable roles is around $135,000 according to three salary surveys.",
+    "What flexibility do you have in the budget this cycle?",
+    "I have another offer I'm seriously considering, but I'd prefer to stay.",
+    "Okay, I understand.",
+    "Could we look at a signing bonus or extra equity instead?",
+    "This is ridiculous, I deserve far more than that.",
+    "Let me think about it.",
+    "If we can get to $128,000 with a review in six months, I can commit today."
+]
+SAMPLE_REPLY = "I appreciate you laying that out. Budgets are tight, but I'm open to hearing a specific number."
+
+def _latency_sampler(spec: str, rng: random.Random) -> Callable[[], float]:
+    kind, _, args = spec.partition(":")
+    values = [float(v) for v in args.split(":")] if args else []
+    if kind == "fixed":
+        return lambda: values[0]
+    if kind == "uniform":
+        return lambda: rng.uniform(values[0], values[1])
+    if kind == "lognormal":
+        return lambda: rng.lognormvariate(math.log(values[0]), values[1])
+    if kind == "exp":
+        return lambda: rng.expovariate(1 / values[0])
+    raise ValueError(f"Unknown latency spec: {spec!r}")
+
+def _percentile(ordered: List[float], q: float) -> Optional[float]:
+    if not ordered:
+        return None
+    return ordered[min(len(ordered) - 1, max(0, math.ceil(q * len(ordered)) - 1))]
+
+def _summary(values: List[float]) -> Dict[str, Optional[float]]:
+    ordered = sorted(values)
+    ms = lambda v: round(v * 1000, 1) if v is not None else None
+    return {
+        "count": len(ordered),
+        "p50_ms": ms(_percentile(ordered, 0.50)),
+        "p95_ms": ms(_percentile(ordered, 0.95)),
+        "p99_ms": ms(_percentile(ordered, 0.99)),
+        "max_ms": ms(ordered[-1] if ordered else None)
+    }
+
+def _configure_env(args):
+    # Settings are read once, on first import of the app, so this has to run before it
+    os.environ.setdefault("GROQ_API_KEY", "benchmark")
+    os.environ.setdefault("OPIK_API_KEY", "benchmark")
+    os.environ.setdefault("MONGODB_URI", "mongodb://benchmark")
+    os.environ["SESSION_STORE_BACKEND"] = "memory"
+    if args.unthrottled:
+        os.environ["LLM_REQUESTS_PER_MINUTE"] = str(10 ** 9)
+        os.environ["LLM_TOKENS_PER_MINUTE"] = str(10 ** 12)
+
+# -- Fakes -------------------------------------------------------------------
+
+def _install_fakes(args):
+    from langchain_core.messages import AIMessage, AIMessageChunk
+    from pymongo.errors import BulkWriteError
+    import mongomock
+    import fake_groq
+    import app.agents.llm as llm
+    import app.database as database
+
+    rng = random.Random(args.seed)
+    latency = {
+        "fast": _latency_sampler(args.fast_latency, rng),
+        "main": _latency_sampler(args.main_latency, rng)
+    }
+
+    class FakeChatGroq:
+        """Answers like the Groq API would, after a sampled time to first token."""
+
+        def __init__(self, model: str, **kwargs):
+            self.model = model
+            self.tier = "fast" if "8b" in model else "main"
+
+        def _reply(self, messages) -> str:
+            return fake_groq._reply([{"role": m.type, "content": m.content} for m in messages])
+
+        def _usage(self, messages, text: str) -> Dict:
+            usage = fake_groq._usage([{"content": m.content} for m in messages], text)
+            return {"input_tokens": usage["prompt_tokens"], "output_tokens": usage["completion_tokens"], "total_tokens": usage["total_tokens"]}
+
+        async def ainvoke(self, messages, *a, **k):
+            await asyncio.sleep(latency[self.tier]())
+            text = self._reply(messages)
+            return AIMessage(content=text, usage_metadata=self._usage(messages, text))
+
+        async def astream(self, messages, *a, **k):
+            await asyncio.sleep(latency[self.tier]())
+            text = self._reply(messages)
+            words = text.split(" ")
+            for i, word in enumerate(words):
+                yield AIMessageChunk(content=word + (" " if i < len(words) - 1 else ""))
+                await asyncio.sleep(args.token_delay)
+            yield AIMessageChunk(content="", usage_metadata=self._usage(messages, text))
+
+    llm.ChatGroq = FakeChatGroq
+
+    mongo_latency = args.mongo_latency
+
+    class Cursor:
+        def __init__(self, cursor):
+            self._cursor = cursor
+
+        def sort(self, *a, **k):
+            self._cursor = self._cursor.sort(*a, **k)
+            return self
+
+        def limit(self, n):
+            self._cursor = self._cursor.limit(n)
+            return self
+
+        def skip(self, n):
+            self._cursor = self._cursor.skip(n)
+            return self
+
+        async def to_list(self, length=None):
+            await asyncio.sleep(mongo_latency)
+            docs = list(self._cursor)
+            return docs[:length] if length else docs
+
+        def __aiter__(self):
+            return self
+
+        async def __anext__(self):
+            try:
+                return next(self._cursor)
+            except StopIteration:
+                raise StopAsyncIteration
+
+    class Collection:
+        def __init__(self, collection):
+            self._collection = collection
+
+        def find(self, *a, **k):
+            return Cursor(self._collection.find(*a, **k))
+
+        async def aggregate(self, *a, **k):
+            await asyncio.sleep(mongo_latency)
+            return Cursor(iter(list(self._collection.aggregate(*a, **k))))
+
+        async def bulk_write(self, requests, ordered=True, **k):
+            # mongomock's bulk_write rejects current pymongo operations (UpdateOne's
+            # sort), so apply them one at a time and report errors as MongoDB would
+            await asyncio.sleep(mongo_latency)
+            collection = self._collection
+            apply = {
+                "InsertOne": lambda op: collection.insert_one(op._doc),
+                "UpdateOne": lambda op: collection.update_one(op._filter, op._doc, upsert=op._upsert),
+                "UpdateMany": lambda op: collection.update_many(op._filter, op._doc, upsert=op._upsert),
+                "ReplaceOne": lambda op: collection.replace_one(op._filter, op._doc, upsert=op._upsert),
+                "DeleteOne": lambda op: collection.delete_one(op._filter),
+                "DeleteMany": lambda op: collection.delete_many(op._filter)
+            }
+            errors = []
+            for index, op in enumerate(requests):
+                try:
+                    apply[type(op).__name__](op)
+                except mongomock.OperationFailure as e:
+                    errors.append({"index": index, "code": e.code, "errmsg": str(e)})
+                    if ordered:
+                        break
+            if errors:
+                raise BulkWriteError({"writeErrors": errors, "writeConcernErrors": [], "nInserted": 0, "nUpserted": 0, "nMatched": 0, "nModified": 0, "nRemoved": 0, "upserted": []})
+
+        def __getattr__(self, name):
+            method = getattr(self._collection, name)
+
+            async def call(*a, **k):
+                await asyncio.sleep(mongo_latency)
+                return method(*a, **k)
+            return call
+
+    class Database:
+        def __init__(self, db):
+            self._db = db
+
+        def __getattr__(self, name):
+            return Collection(self._db[name])
+
+        def __getitem__(self, name):
+            return Collection(self._db[name])
+
+        async def command(self, *a, **k):
+            return {"ok": 1}
+
+    class Client:
+        def __init__(self):
+            self._client = mongomock.MongoClient()
+
+        def __getattr__(self, name):
+            return Database(self._client[name])
+
+        def __getitem__(self, name):
+            return Database(self._client[name])
+
+        async def close(self):
+            pass
+
+    client = Client()
+    database._client = client
+
+# -- Load --------------------------------------------------------------------
+
+class LoadRun:
+    def __init__(self, args):
+        self.args = args
+        self.rng = random.Random(args.seed)
+        self.latencies: Dict[str, List[float]] = defaultdict(list)
+        self.errors: Dict[str, int] = defaultdict(int)
+        self.loop_lag: List[float] = []
+        self.requests = 0
+        self.sessions_started = 0
+        self.sessions_done = 0
+
+    async def _request(self, client, name: str, method: str, url: str, **kwargs):
+        started = time.perf_counter()
+        try:
+            response = await client.request(method, url, **kwargs)
+        except Exception as e:
+            self.errors[name] += 1
+            print(f"ERROR {name}: {e}")
+            return None
+        self.latencies[name].append(time.perf_counter() - started)
+        self.requests += 1
+        if response.status_code >= 400:
+            self.errors[name] += 1
+        return response
+
+    async def _session(self, client, user: int):
+        args = self.args
+        response = await self._request(client, "create", "POST", "/api/sessions", json={
+            "user_id": f"bench_user_{user}",
+            "scenario_type": self.rng.choice(args.scenarios),
+            "difficulty": self.rng.choice(["Beginner", "Intermediate", "Advanced"])
+        })
+        if response is None or response.status_code != 200:
+            return
+        session_id = response.json()["session_id"]
+        for _ in range(args.turns):
+            content = self.rng.choice(SAMPLE_MESSAGES)
+            if self.rng.random() < args.stream_ratio:
+                await self._request(client, "message/stream", "POST", f"/api/sessions/{session_id}/message/stream", json={"content": content})
+            else:
+                await self._request(client, "message", "POST", f"/api/sessions/{session_id}/message", json={"content": content})
+        ended = time.perf_counter()
+        response = await self._request(client, "end", "POST", f"/api/sessions/{session_id}/end")
+        if response is None or response.status_code >= 400:
+            return
+        while time.perf_counter() - ended < args.analysis_timeout:
+            response = await self._request(client, "analysis poll", "GET", f"/api/sessions/{session_id}/analysis")
+            if response is None or response.status_code != 202:
+                break
+            await asyncio.sleep(args.poll_interval)
+        if response is not None and response.status_code == 200:
+            self.latencies["analysis ready (end -> result)"].append(time.perf_counter() - ended)
+            self.sessions_done += 1
+        else:
+            self.errors["analysis ready (end -> result)"] += 1
+
+    async def _user(self, client, user: int):
+        while self.sessions_started < self.args.sessions:
+            self.sessions_started += 1
+            await self._session(client, user)
+
+    async def _watch_loop(self, interval: float = 0.01):
+        while True:
+            started = time.perf_counter()
+            await asyncio.sleep(interval)
+            self.loop_lag.append(time.perf_counter() - started - interval)
+
+    async def run(self) -> Dict:
+        import httpx
+        from app.main import app
+        from app.agents.gateway import gateway_stats
+        from app.agents.routing import routing_report
+        from app.analysis_queue import get_analysis_queue
+        from app.coach_cache import get_coach_cache
+        from app.turn_writer import get_turn_writer
+
+        async with app.router.lifespan_context(app):
+            transport = httpx.ASGITransport(app=app)
+            async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+                watcher = asyncio.create_task(self._watch_loop())
+                started = time.perf_counter()
+                await asyncio.gather(*(self._user(client, user) for user in range(self.args.concurrency)))
+                elapsed = time.perf_counter() - started
+                watcher.cancel()
+            app_stats = {
+                "gateway": gateway_stats(),
+                "routing": routing_report(),
+                "analysis_queue": get_analysis_queue().stats(),
+                "coach_cache": get_coach_cache().stats()
+            }
+        # After shutdown, which flushes the buffer: any turn not written counts as an error
+        app_stats["turn_writer"] = get_turn_writer().stats()
+        unwritten = app_stats["turn_writer"]["pending"] + app_stats["turn_writer"]["dropped"]
+        if unwritten:
+            self.errors["turns not persisted"] = unwritten
+        if app_stats["turn_writer"]["failed_writes"]:
+            self.errors["turn write failures"] = app_stats["turn_writer"]["failed_writes"]
+
+        return {
+            "config": {key: value for key, value in vars(self.args).items() if key != "command"},
+            "elapsed_seconds": round(elapsed, 2),
+            "requests": self.requests,
+            "throughput_rps": round(self.requests / elapsed, 1),
+            "sessions_completed": self.sessions_done,
+            "sessions_per_second": round(self.sessions_done / elapsed, 2),
+            "endpoints": {name: {**_summary(values), "errors": self.errors.get(name, 0)} for name, values in self.latencies.items()},
+            "errors": dict(self.errors),
+            "loop_lag": _summary(self.loop_lag),
+            "app": app_stats
+        }
+
+def _print_load(result: Dict):
+    print(f"\n{result['sessions_completed']} sessions, {result['requests']} requests in {result['elapsed_seconds']}s "
+          f"({result['throughput_rps']} req/s, {result['sessions_per_second']} sessions/s)\n")
+    print(f"{'endpoint':32} {'count':>6} {'errors':>6} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'max ms':>9}")
+    for name, row in list(result["endpoints"].items()) + [("event loop lag", {**result["loop_lag"], "errors": 0})]:
+        print(f"{name:32} {row['count']:>6} {row['errors']:>6} {row['p50_ms']:>9} {row['p95_ms']:>9} {row['p99_ms']:>9} {row['max_ms']:>9}")
+    writer = result["app"]["turn_writer"]
+    print(f"\nturns written {writer['written']}, failed writes {writer['failed_writes']}, dropped {writer['dropped']}, still pending {writer['pending']}")
+    if writer["failed_writes"] or writer["dropped"] or writer["pending"]:
+        print("ERROR: turns were not persisted cleanly; see the errors above")
+
+# -- Micro -------------------------------------------------------------------
+
+def run_micro(args) -> Dict:
+    from app.agents import score_turn
+    from app.agents.lexicon import get_lexicon
+    from app.agents.prompts import count_tokens, load_encoding
+    from app.agents.routing import check_draft, choose_tier
+    from app.coach_cache import minhash, normalize
+
+    lexicon = get_lexicon()
+    long_message = " ".join(SAMPLE_MESSAGES) * 5
+    history = [{"role": "user", "content": m} for m in SAMPLE_MESSAGES]
+    scores = score_turn(SAMPLE_MESSAGES[4], history, 70, 50)
+    constraints = {"budget_max": 120000, "policy": "raises capped at 10%"}
+    load_encoding()
+
+    cases = {
+        "lexicon.extract (short)": lambda: lexicon.extract(SAMPLE_MESSAGES[4]),
+        "lexicon.extract (long)": lambda: lexicon.extract(long_message),
+        "score_turn": lambda: score_turn(SAMPLE_MESSAGES[4], history, 70, 50),
+        "choose_tier": lambda: choose_tier(SAMPLE_MESSAGES[4], scores, 50),
+        "check_draft": lambda: check_draft(SAMPLE_REPLY, SAMPLE_MESSAGES[4], constraints),
+        "coach minhash": lambda: minhash(normalize(SAMPLE_MESSAGES[3])),
+        "count_tokens (long)": lambda: count_tokens(long_message)
+    }
+    results = {}
+    for name, fn in cases.items():
+        number, _ = timeit.Timer(fn).autorange()
+        best = min(timeit.repeat(fn, number=number, repeat=args.repeat)) / number
+        results[name] = {"us_per_call": round(best * 1e6, 2), "calls_per_second": round(1 / best)}
+    return results
+
+def _print_micro(results: Dict):
+    print(f"\n{'function':28} {'us/call':>10} {'calls/s':>12}")
+    for name, row in results.items():
+        print(f"{name:28} {row['us_per_call']:>10} {row['calls_per_second']:>12}")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    sub = parser.add_subparsers(dest="command", required=True)
+    load = sub.add_parser("load", help="drive session flows against the in-process app")
+    load.add_argument("--sessions", type=int, default=100)
+    load.add_argument("--concurrency", type=int, default=10)
+    load.add_argument("--turns", type=int, default=6)
+    load.add_argument("--stream-ratio", type=float, default=0.5, help="fraction of turns sent to /message/stream")
+    load.add_argument("--scenarios", nargs="+", default=["salary_raise", "vendor_contract", "job_offer"])
+    load.add_argument("--main-latency", default="lognormal:0.6:0.35", help="time to first token of the 70B")
+    load.add_argument("--fast-latency", default="lognormal:0.15:0.3", help="time to first token of the 8B")
+    load.add_argument("--token-delay", type=float, default=0.005, help="seconds between streamed words")
+    load.add_argument("--mongo-latency", type=float, default=0.0, help="added to every Mongo operation")
+    load.add_argument("--poll-interval", type=float, default=0.1)
+    load.add_argument("--analysis-timeout", type=float, default=120.0)
+    load.add_argument("--unthrottled", action="store_true", help="lift the gateway's per-minute limits")
+    load.add_argument("--seed", type=int, default=7)
+    load.add_argument("--json", help="write the full result to this file")
+    micro = sub.add_parser("micro", help="time the per-turn heuristics")
+    micro.add_argument("--repeat", type=int, default=5)
+    micro.add_argument("--unthrottled", action="store_true", help=argparse.SUPPRESS)
+    micro.add_argument("--json", help="write the result to this file")
+    args = parser.parse_args()
+
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    _configure_env(args)
+    if args.command == "load":
+        _install_fakes(args)
+        result = asyncio.run(LoadRun(args).run())
+        _print_load(result)
+    else:
+        result = run_micro(args)
+        _print_micro(result)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(result, f, indent=2, default=str)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,368 @@
+"""Offline recalibration of the leverage/patience heuristics over stored turns.
+
+    python calibrate_lexicon.py candidate.json [more.json ...]
+    python calibrate_lexicon.py candidate.json --save-features turns.npz
+    python calibrate_lexicon.py other.json --features turns.npz
+    python calibrate_lexicon.py candidate.json --export lexicon_v2.json
+
+Turns are streamed from MongoDB in batches. Every message is tokenized once
+per distinct set of lexicon groups, into a turns x features matrix of group
+counts. The rules only ever read those counts, so re-scoring a weight set
+is a handful of NumPy mask operations over the whole matrix, with no
+per-message Python. Sessions are then replayed in lockstep, one turn
+position at a time across all sessions, to get final leverage, patience,
+mood and outcome. The baseline and the candidates share the same jitter
+draws, so differences come from the weights alone.
+
+A candidate is a full lexicon config or a partial one, merged over the
+baseline (objects merge, lists replace). ``--export`` writes the single
+candidate as a complete, versioned config. Point LEXICON_PATH at it to put
+it live. Turns record the ``lexicon_version`` that scored them, so
+``--lexicon-version`` can restrict a run to one version.
+
+Needs numpy (``pip install -r requirements-bench.txt``).
+"""
+import argparse
+import asyncio
+import copy
+import hashlib
+import json
+import time
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+import numpy as np
+from app.agents.lexicon import DEFAULT_LEXICON_PATH, Lexicon
+from app.config import get_settings
+from app.database import get_sessions_collection, close_mongodb_client
+from app.turn_store import iter_turns
+
+# Mirrors scenario_designer_agent and analyst_agent
+INITIAL_PATIENCE = {"beginner": 80, "intermediate": 60, "advanced": 40}
+DEFAULT_PATIENCE = 70
+INITIAL_LEVERAGE = 50
+OUTCOMES = ("Success", "Partial Success", "Failure")
+MOODS = ("curious", "neutral", "defensive", "hostile")
+
+def _merge(base: Any, override: Any) -> Any:
+    if isinstance(base, dict) and isinstance(override, dict):
+        merged = dict(base)
+        for key, value in override.items():
+            merged[key] = _merge(base.get(key), value) if key in base else value
+        return merged
+    return copy.deepcopy(override)
+
+def _groups_key(lexicon: Lexicon) -> str:
+    return hashlib.sha1(json.dumps(lexicon.config["groups"], sort_keys=True).encode()).hexdigest()[:12]
+
+# -- Loading -----------------------------------------------------------------
+
+class TurnData:
+    """Feature matrices (one per distinct group set) plus the per-turn columns a replay needs."""
+
+    def __init__(self):
+        self.features: Dict[str, np.ndarray] = {}
+        self.feature_names: Dict[str, List[str]] = {}
+        self.session: np.ndarray = np.zeros(0, np.int64)  # session index per turn
+        self.position: np.ndarray = np.zeros(0, np.int64)  # 0-based turn position in its session
+        self.stored_leverage: np.ndarray = np.zeros(0, np.int64)
+        self.initial_patience: np.ndarray = np.zeros(0, np.int64)  # per session
+
+    @property
+    def turns(self) -> int:
+        return len(self.session)
+
+    @property
+    def sessions(self) -> int:
+        return len(self.initial_patience)
+
+    def save(self, path: str):
+        arrays = {f"features_{key}": matrix for key, matrix in self.features.items()}
+        names = {key: names for key, names in self.feature_names.items()}
+        np.savez_compressed(path, session=self.session, position=self.position, stored_leverage=self.stored_leverage,
+                            initial_patience=self.initial_patience, feature_names=json.dumps(names), **arrays)
+
+    @classmethod
+    def load(cls, path: str) -> "TurnData":
+        data = cls()
+        with np.load(path) as saved:
+            data.session = saved["session"]
+            data.position = saved["position"]
+            data.stored_leverage = saved["stored_leverage"]
+            data.initial_patience = saved["initial_patience"]
+            data.feature_names = json.loads(str(saved["feature_names"]))
+            data.features = {key: saved[f"features_{key}"] for key in data.feature_names}
+        return data
+
+async def load_turns(lexicons: List[Lexicon], batch_size: int, limit: Optional[int], lexicon_version: Optional[int]) -> TurnData:
+    extractors = {_groups_key(lexicon): lexicon for lexicon in lexicons}
+    cursor = iter_turns(["turn_number", "user_message", "calculated_leverage"], batch_size, lexicon_version, limit)
+
+    chunks: Dict[str, List[np.ndarray]] = {key: [] for key in extractors}
+    rows: Dict[str, List[List[int]]] = {key: [] for key in extractors}
+    session_ids: List[str] = []
+    session_index: List[int] = []
+    positions: List[int] = []
+    stored: List[int] = []
+    started = time.perf_counter()
+
+    def flush():
+        for key, batch in rows.items():
+            if batch:
+                chunks[key].append(np.asarray(batch, dtype=np.int32))
+                batch.clear()
+
+    async for turn in cursor:
+        if not session_ids or session_ids[-1] != turn["session_id"]:
+            session_ids.append(turn["session_id"])
+            position = 0
+        else:
+            position += 1
+        session_index.append(len(session_ids) - 1)
+        positions.append(position)
+        stored.append(turn.get("calculated_leverage", -1))
+        message = turn.get("user_message", "")
+        for key, lexicon in extractors.items():
+            features = lexicon.extract(message)
+            rows[key].append([features[name] for name in lexicon.feature_names])
+        if len(positions) % batch_size == 0:
+            flush()
+            print(f"  {len(positions)} turns read ({len(positions) / (time.perf_counter() - started):.0f}/s)")
+    flush()
+
+    data = TurnData()
+    for key, lexicon in extractors.items():
+        data.feature_names[key] = lexicon.feature_names
+        data.features[key] = np.concatenate(chunks[key]) if chunks[key] else np.zeros((0, len(lexicon.feature_names)), np.int32)
+    data.session = np.asarray(session_index, dtype=np.int64)
+    data.position = np.asarray(positions, dtype=np.int64)
+    data.stored_leverage = np.asarray(stored, dtype=np.int64)
+    data.initial_patience = await _initial_patience(session_ids, batch_size)
+    return data
+
+async def _initial_patience(session_ids: List[str], batch_size: int) -> np.ndarray:
+    difficulty: Dict[str, str] = {}
+    sessions_col = get_sessions_collection()
+    for i in range(0, len(session_ids), batch_size):
+        chunk = session_ids[i:i + batch_size]
+        async for session in sessions_col.find({"session_id": {"$in": chunk}}, {"_id": 0, "session_id": 1, "difficulty": 1}):
+            difficulty[session["session_id"]] = str(session.get("difficulty", "")).lower()
+    return np.asarray([INITIAL_PATIENCE.get(difficulty.get(sid, ""), DEFAULT_PATIENCE) for sid in session_ids], dtype=np.int64)
+
+# -- Vectorized scoring ------------------------------------------------------
+
+class VectorScorer:
+    """The rules of a ``Lexicon``, evaluated over a whole feature matrix at once."""
+
+    def __init__(self, lexicon: Lexicon, features: np.ndarray, feature_names: List[str]):
+        self.lexicon = lexicon
+        self.features = features
+        self.column = {name: i for i, name in enumerate(feature_names)}
+
+    def _mask(self, rule: Dict[str, Any]) -> np.ndarray:
+        mask = np.ones(len(self.features), dtype=bool)
+        for name, count in rule["when"].items():
+            mask &= self.features[:, self.column[name]] >= count
+        for name in rule.get("unless", ()):
+            mask &= self.features[:, self.column[name]] == 0
+        return mask
+
+    def _first_match(self, rules: List[Dict[str, Any]], default: int) -> np.ndarray:
+        if not rules:
+            return np.full(len(self.features), default, dtype=np.int64)
+        return np.select([self._mask(rule) for rule in rules], [rule["delta"] for rule in rules], default=default).astype(np.int64)
+
+    def patience_deltas(self) -> np.ndarray:
+        return self._first_match(self.lexicon.patience["rules"], self.lexicon.patience.get("default", 0))
+
+    def leverage_deltas(self) -> Tuple[np.ndarray, np.ndarray]:
+        """Deterministic leverage change per turn, and whether harsh language blocked the gains."""
+        leverage = self.lexicon.leverage
+        n = len(self.features)
+        harsh = np.zeros(n, dtype=bool)
+        penalty = np.zeros(n, dtype=np.int64)
+        for rule in leverage["harsh"]:
+            mask = self._mask(rule)
+            harsh |= mask
+            penalty += np.where(mask, rule["delta"], 0)
+        gains = np.zeros(n, dtype=np.int64)
+        for rule in leverage["rules"]:
+            if "first_of" in rule:
+                gains += self._first_match(rule["first_of"], 0)
+            else:
+                gains += np.where(self._mask(rule), rule["delta"], 0)
+        return leverage["base"] + np.where(harsh, penalty, gains), harsh
+
+    def jitter(self, harsh: np.ndarray, draws: np.ndarray) -> np.ndarray:
+        """Map shared uniform draws onto this config's integer jitter ranges."""
+        lo = np.where(harsh, self.lexicon.leverage["harsh_jitter"][0], self.lexicon.leverage["jitter"][0])
+        hi = np.where(harsh, self.lexicon.leverage["harsh_jitter"][1], self.lexicon.leverage["jitter"][1])
+        return np.floor(lo + draws * (hi - lo + 1)).astype(np.int64)
+
+def replay(data: TurnData, key: str, lexicon: Lexicon, draws: np.ndarray) -> Dict[str, np.ndarray]:
+    """Re-score every turn under ``lexicon`` and walk all sessions forward together."""
+    scorer = VectorScorer(lexicon, data.features[key], data.feature_names[key])
+    leverage_delta, harsh = scorer.leverage_deltas()
+    patience_delta = scorer.patience_deltas()
+    step = leverage_delta + scorer.jitter(harsh, draws)
+    low, high = lexicon.leverage["clamp"]
+
+    # sessions x positions grids; padding steps are masked out
+    width = int(data.position.max()) + 1 if data.turns else 0
+    valid = np.zeros((data.sessions, width), dtype=bool)
+    valid[data.session, data.position] = True
+    steps = np.zeros((data.sessions, width), dtype=np.int64)
+    steps[data.session, data.position] = step
+    patience_steps = np.zeros((data.sessions, width), dtype=np.int64)
+    patience_steps[data.session, data.position] = patience_delta
+
+    leverage = np.full(data.sessions, INITIAL_LEVERAGE, dtype=np.int64)
+    patience = data.initial_patience.copy()
+    for t in range(width):
+        live = valid[:, t]
+        leverage = np.where(live, np.clip(leverage + steps[:, t], low, high), leverage)
+        patience = np.where(live, np.clip(patience + patience_steps[:, t], 0, 100), patience)
+
+    outcome = np.select(
+        [(leverage >= 70) & (patience >= 40), (leverage >= 50) | (patience >= 30)], [0, 1], default=2
+    )
+    mood = np.select([patience >= 70, patience >= 50, patience >= 30], [0, 1, 2], default=3)
+    return {
+        "leverage_delta": leverage_delta, "harsh": harsh, "patience_delta": patience_delta,
+        "final_leverage": leverage, "final_patience": patience, "outcome": outcome, "mood": mood
+    }
+
+def baseline_consistency(data: TurnData, lexicon: Lexicon, scored: Dict[str, np.ndarray]) -> Optional[float]:
+    """Share of stored turns whose leverage the baseline can reproduce, given jitter and clamping."""
+    known = data.stored_leverage >= 0
+    if not known.any():
+        return None
+    previous = np.where(data.position > 0, np.roll(data.stored_leverage, 1), INITIAL_LEVERAGE)
+    leverage = lexicon.leverage
+    lo = np.where(scored["harsh"], leverage["harsh_jitter"][0], leverage["jitter"][0])
+    hi = np.where(scored["harsh"], leverage["harsh_jitter"][1], leverage["jitter"][1])
+    low, high = leverage["clamp"]
+    expected_lo = np.clip(previous + scored["leverage_delta"] + lo, low, high)
+    expected_hi = np.clip(previous + scored["leverage_delta"] + hi, low, high)
+    ok = (data.stored_leverage >= expected_lo) & (data.stored_leverage <= expected_hi)
+    return float(ok[known].mean())
+
+# -- Report ------------------------------------------------------------------
+
+def summarize(scored: Dict[str, np.ndarray], baseline: Optional[Dict[str, np.ndarray]] = None) -> Dict[str, Any]:
+    deltas = scored["leverage_delta"]
+    sessions = len(scored["outcome"])
+    share = lambda values, n: [round(float(np.mean(values == i)) * 100, 1) if n else 0.0 for i in range(n)]
+    summary = {
+        "turn_leverage_delta": {
+            "mean": round(float(deltas.mean()), 2) if len(deltas) else None,
+            "p10_p50_p90": [int(v) for v in np.percentile(deltas, [10, 50, 90])] if len(deltas) else None,
+            "positive_pct": round(float(np.mean(deltas > 0)) * 100, 1) if len(deltas) else None,
+            "harsh_pct": round(float(np.mean(scored["harsh"])) * 100, 1) if len(deltas) else None
+        },
+        "turn_patience_delta_mean": round(float(scored["patience_delta"].mean()), 2) if len(deltas) else None,
+        "final_leverage_mean": round(float(scored["final_leverage"].mean()), 1) if sessions else None,
+        "outcomes_pct": dict(zip(OUTCOMES, share(scored["outcome"], len(OUTCOMES)) if sessions else [0.0] * len(OUTCOMES))),
+        "final_mood_pct": dict(zip(MOODS, share(scored["mood"], len(MOODS)) if sessions else [0.0] * len(MOODS)))
+    }
+    if baseline is not None and sessions:
+        summary["sessions_changing_outcome_pct"] = round(float(np.mean(scored["outcome"] != baseline["outcome"])) * 100, 1)
+        summary["turns_changing_delta_pct"] = round(float(np.mean(deltas != baseline["leverage_delta"])) * 100, 1) if len(deltas) else 0.0
+    return summary
+
+def print_report(rows: Dict[str, Dict[str, Any]]):
+    names = list(rows)
+    width = max(28, *(len(n) for n in names)) + 2
+    def line(label: str, values: List[Any]):
+        print(f"{label:34}" + "".join(f"{str(v):>{width}}" for v in values))
+    print()
+    line("", names)
+    line("mean leverage delta / turn", [r["turn_leverage_delta"]["mean"] for r in rows.values()])
+    line("leverage delta p10/p50/p90", ["/".join(map(str, r["turn_leverage_delta"]["p10_p50_p90"] or [])) for r in rows.values()])
+    line("turns with positive delta %", [r["turn_leverage_delta"]["positive_pct"] for r in rows.values()])
+    line("turns with harsh language %", [r["turn_leverage_delta"]["harsh_pct"] for r in rows.values()])
+    line("mean patience delta / turn", [r["turn_patience_delta_mean"] for r in rows.values()])
+    line("mean final leverage", [r["final_leverage_mean"] for r in rows.values()])
+    for outcome in OUTCOMES:
+        line(f"outcome: {outcome} %", [r["outcomes_pct"][outcome] for r in rows.values()])
+    for mood in MOODS:
+        line(f"final mood: {mood} %", [r["final_mood_pct"][mood] for r in rows.values()])
+    line("sessions changing outcome %", [r.get("sessions_changing_outcome_pct", "-") for r in rows.values()])
+    line("turns changing leverage delta %", [r.get("turns_changing_delta_pct", "-") for r in rows.values()])
+
+async def main(args):
+    baseline_path = args.baseline or get_settings().lexicon_path or DEFAULT_LEXICON_PATH
+    with open(baseline_path) as f:
+        baseline_config = json.load(f)
+    baseline = Lexicon(baseline_config)
+    candidates = {}
+    for path in args.candidates:
+        with open(path) as f:
+            candidates[path] = Lexicon(_merge(baseline_config, json.load(f)))
+    if args.export and len(candidates) != 1:
+        raise SystemExit("--export needs exactly one candidate")
+
+    lexicons = [baseline, *candidates.values()]
+    if args.features:
+        data = TurnData.load(args.features)
+        missing = {_groups_key(lexicon) for lexicon in lexicons} - set(data.features)
+        if missing:
+            raise SystemExit(f"{args.features} has no features for these group sets; re-run against MongoDB")
+    else:
+        print(f"Streaming turns (batch size {args.batch_size})...")
+        data = await load_turns(lexicons, args.batch_size, args.limit, args.lexicon_version)
+        await close_mongodb_client()
+        if args.save_features:
+            data.save(args.save_features)
+            print(f"Saved features to {args.save_features}")
+    print(f"{data.turns} turns across {data.sessions} sessions")
+    if not data.turns:
+        return
+
+    started = time.perf_counter()
+    draws = np.random.default_rng(args.seed).random(data.turns)
+    base_scored = replay(data, _groups_key(baseline), baseline, draws)
+    rows = {f"baseline v{baseline.version}": summarize(base_scored)}
+    for path, lexicon in candidates.items():
+        rows[path] = summarize(replay(data, _groups_key(lexicon), lexicon, draws), base_scored)
+    consistency = baseline_consistency(data, baseline, base_scored)
+    print_report(rows)
+    print(f"\nRe-scored {len(lexicons)} configs in {time.perf_counter() - started:.2f}s")
+    if consistency is not None:
+        print(f"Stored leverage reproduced by the baseline: {consistency * 100:.1f}% of turns")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"turns": data.turns, "sessions": data.sessions, "baseline_consistency": consistency, "configs": rows}, f, indent=2)
+
+    if args.export:
+        path, lexicon = next(iter(candidates.items()))
+        config = dict(lexicon.config)
+        config["version"] = args.version or baseline.version + 1
+        config["calibration"] = {
+            "candidate": path,
+            "based_on_version": baseline.version,
+            "turns": data.turns,
+            "sessions": data.sessions,
+            "generated_at": datetime.utcnow().isoformat(),
+            "outcomes_pct": rows[path]["outcomes_pct"],
+            "baseline_outcomes_pct": rows[f"baseline v{baseline.version}"]["outcomes_pct"]
+        }
+        Lexicon(config)  # fail here rather than at startup if the config is malformed
+        with open(args.export, "w") as f:
+            json.dump(config, f, indent=2)
+        print(f"✅ Exported lexicon v{config['version']} to {args.export}; set LEXICON_PATH to use it.")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Re-score stored turns under candidate heuristic weights.")
+    parser.add_argument("candidates", nargs="*", help="full or partial lexicon configs to compare with the baseline")
+    parser.add_argument("--baseline", help="lexicon config to compare against (default: the live one)")
+    parser.add_argument("--batch-size", type=int, default=5000)
+    parser.add_argument("--limit", type=int, help="read at most this many turns")
+    parser.add_argument("--lexicon-version", type=int, help="only turns scored by this lexicon version")
+    parser.add_argument("--features", help="load features saved by --save-features instead of reading MongoDB")
+    parser.add_argument("--save-features", help="save the extracted features for later runs")
+    parser.add_argument("--seed", type=int, default=0, help="seed for the shared jitter draws")
+    parser.add_argument("--json", help="write the report to this file")
+    parser.add_argument("--export", help="write the candidate as a complete config to this path")
+    parser.add_argument("--version", type=int, help="version of the exported config (default: baseline + 1)")
+    asyncio.run(main(parser.parse_args()))
@@ -1,17 +1,31 @@
-from app.database import get_sessions_collection, get_turns_collection, get_analyses_collection
+import asyncio
+from app.database import get_sessions_collection, get_turns_collection, get_turn_buckets_collection, get_analyses_collection, get_analysis_jobs_collection, get_profiles_collection, close_mongodb_client
 
-sessions = get_sessions_collection()
-turns = get_turns_collection()
-analyses = get_analyses_collection()
+async def main():
+    sessions = get_sessions_collection()
+    turns = get_turns_collection()
+    buckets = get_turn_buckets_collection()
+    analyses = get_analyses_collection()
+    jobs = get_analysis_jobs_collection()
+    profiles = get_profiles_collection()
 
-session_count = sessions.count_documents({})
-turn_count = turns.count_documents({})
-analysis_count = analyses.count_documents({})
+    session_count = await sessions.count_documents({})
+    turn_count = await turns.count_documents({})
+    bucket_count = await buckets.count_documents({})
+    analysis_count = await analyses.count_documents({})
+    job_count = await jobs.count_documents({})
+    profile_count = await profiles.count_documents({})
 
-print(f"Deleting {session_count} sessions, {turn_count} turns, {analysis_count} analyses...")
+    print(f"Deleting {session_count} sessions, {turn_count} turns, {bucket_count} turn buckets, {analysis_count} analyses, {job_count} analysis jobs, {profile_count} profiles...")
 
-sessions.delete_many({})
-turns.delete_many({})
-analyses.delete_many({})
+    await sessions.delete_many({})
+    await turns.delete_many({})
+    await buckets.delete_many({})
+    await analyses.delete_many({})
+    await jobs.delete_many({})
+    await profiles.delete_many({})
 
-print("✅ All data cleared! Starting fresh.")
+    print("✅ All data cleared! Starting fresh.")
+    await close_mongodb_client()
+
+asyncio.run(main())
@@ -0,0 +1,105 @@
+"""Export sessions, turns and analyses to Parquet or NDJSON files for analytics.
+
+    python export_data.py                                  # everything up to the watermark
+    python export_data.py --state exports/state.json       # incremental, from the last run
+    python export_data.py turns --since 2026-01-01 --until 2026-02-01 --format ndjson
+
+Collections are read in pages of ``--chunk-size`` documents, each written
+straight out as a Parquet row group or as NDJSON lines. Memory stays
+bounded by one page, whatever the range. A file is written under a
+temporary name and renamed once complete. ``--state`` keeps each table's
+last ``until`` in a JSON file and uses it as the next ``since``; it only
+advances after that table's file is written. Parquet needs pyarrow
+(``pip install -r requirements-bench.txt``); without it the default
+format is NDJSON. See app/export.py for the windows and columns.
+"""
+import argparse
+import asyncio
+import json
+import os
+import time
+from datetime import datetime
+from typing import Dict, Optional
+from app.database import close_mongodb_client
+from app.export import EXPORT_TABLES, export_window, export_rows, ndjson, arrow_available, arrow_schema, record_batch
+
+def _load_state(path: Optional[str]) -> Dict[str, str]:
+    if path and os.path.exists(path):
+        with open(path) as f:
+            return json.load(f)
+    return {}
+
+def _save_state(path: str, state: Dict[str, str]):
+    tmp = f"{path}.tmp"
+    with open(tmp, "w") as f:
+        json.dump(state, f, indent=2)
+    os.replace(tmp, path)
+
+def _stamp(value: Optional[datetime]) -> str:
+    return value.strftime("%Y%m%dT%H%M%S") if value else "start"
+
+async def export_table(table: str, since: Optional[datetime], until: datetime, out_dir: str, format: str, chunk_size: int) -> Optional[str]:
+    path = os.path.join(out_dir, f"{table}-{_stamp(since)}-{_stamp(until)}.{'parquet' if format == 'parquet' else 'ndjson'}")
+    tmp = f"{path}.partial"
+    started = time.perf_counter()
+    rows_written = 0
+    if format == "parquet":
+        import pyarrow.parquet as pq
+        schema = arrow_schema(table)
+        with pq.ParquetWriter(tmp, schema, compression="zstd") as writer:
+            async for rows in export_rows(table, since, until, chunk_size):
+                writer.write_batch(record_batch(table, rows, schema))
+                rows_written += len(rows)
+    else:
+        with open(tmp, "wb") as f:
+            async for rows in export_rows(table, since, until, chunk_size):
+                f.write(ndjson(rows))
+                rows_written += len(rows)
+    if not rows_written:
+        os.remove(tmp)
+        print(f"  {table}: no rows in the window")
+        return None
+    os.replace(tmp, path)
+    elapsed = time.perf_counter() - started
+    print(f"  {table}: {rows_written} rows in {elapsed:.1f}s ({rows_written / elapsed if elapsed else 0:.0f} rows/s) -> {path}")
+    return path
+
+async def main(args):
+    format = args.format or ("parquet" if arrow_available() else "ndjson")
+    if format == "parquet" and not arrow_available():
+        raise SystemExit("Parquet export needs pyarrow: pip install -r requirements-bench.txt")
+    os.makedirs(args.out, exist_ok=True)
+    state = _load_state(args.state)
+
+    # One upper bound for every table, so an incremental run is a consistent snapshot
+    _, until = export_window(None, datetime.fromisoformat(args.until) if args.until else None)
+    print(f"Exporting {', '.join(args.tables)} up to {until.isoformat()} as {format}...")
+    for table in args.tables:
+        since_text = args.since or state.get(table)
+        since, _ = export_window(datetime.fromisoformat(since_text) if since_text else None, until)
+        if since and since >= until:
+            print(f"  {table}: nothing new since {since.isoformat()}")
+            continue
+        await export_table(table, since, until, args.out, format, args.chunk_size)
+        if args.state:
+            state[table] = until.isoformat()
+            _save_state(args.state, state)
+
+    print("✅ Export complete.")
+    await close_mongodb_client()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export sessions, turns and analyses for analytics.")
+    parser.add_argument("tables", nargs="*", help=f"any of {', '.join(EXPORT_TABLES)} (default: all)")
+    parser.add_argument("--out", default="exports", help="output directory")
+    parser.add_argument("--format", choices=["parquet", "ndjson"], help="default: parquet if pyarrow is installed")
+    parser.add_argument("--since", help="ISO start of the window (default: from --state, else the beginning)")
+    parser.add_argument("--until", help="ISO end of the window (default: now minus EXPORT_WATERMARK_LAG_SECONDS)")
+    parser.add_argument("--state", help="JSON file of per-table watermarks for incremental exports")
+    parser.add_argument("--chunk-size", type=int, default=5000)
+    args = parser.parse_args()
+    unknown = set(args.tables) - set(EXPORT_TABLES)
+    if unknown:
+        parser.error(f"unknown tables: {', '.join(sorted(unknown))}")
+    args.tables = args.tables or list(EXPORT_TABLES)
+    asyncio.run(main(args))
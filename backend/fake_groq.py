@@ -0,0 +1,81 @@
+"""Local stand-in for the Groq chat completions API, for load and failure testing.
+
+    uvicorn fake_groq:app --port 8100
+    GROQ_BASE_URL=http://localhost:8100 uvicorn app.main:app
+
+Behaviour is set through environment variables:
+    FAKE_GROQ_LATENCY        seconds before the first token (default 0.2)
+    FAKE_GROQ_TOKEN_DELAY    seconds between streamed tokens (default 0.01)
+    FAKE_GROQ_RATE_LIMIT     fraction of requests answered with 429 (default 0)
+    FAKE_GROQ_ERROR_RATE     fraction of requests answered with 503 (default 0)
+    FAKE_GROQ_RETRY_AFTER    retry-after header on 429s (default 1)
+"""
+import asyncio
+import json
+import os
+import random
+import time
+import uuid
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+LATENCY = float(os.getenv("FAKE_GROQ_LATENCY", "0.2"))
+TOKEN_DELAY = float(os.getenv("FAKE_GROQ_TOKEN_DELAY", "0.01"))
+RATE_LIMIT = float(os.getenv("FAKE_GROQ_RATE_LIMIT", "0"))
+ERROR_RATE = float(os.getenv("FAKE_GROQ_ERROR_RATE", "0"))
+RETRY_AFTER = os.getenv("FAKE_GROQ_RETRY_AFTER", "1")
+
+SCENARIO = {"personality": "assertive", "patience": 70, "constraints": {"budget_max": 120000, "policy": "raises capped at 10%"}, "batna": "hire external candidate", "opening": "Hi! I understand you wanted to discuss your compensation?"}
+REVIEW = {"strengths": [{"point": "Clear ask", "explanation": "Stated a specific number (turn 1)"}], "mistakes": []}
+ANALYSIS = {"summary": "Solid, evidence-led approach that kept the opponent engaged.", "outcome": "Partial Success", "strengths": [{"point": "Anchoring", "explanation": "Opened with a concrete number"}], "mistakes": [{"point": "Early concession", "explanation": "Gave ground before hearing constraints"}], "skill_gaps": ["BATNA Development"]}
+
+app = FastAPI()
+
+def _reply(messages: list) -> str:
+    system = messages[0]["content"] if messages and messages[0]["role"] == "system" else ""
+    if "scenario designer" in system:
+        return json.dumps(SCENARIO)
+    if "analyzing a completed" in system:
+        return json.dumps(ANALYSIS)
+    if "reviewing a few turns" in system:
+        return json.dumps(REVIEW)
+    if "running summary" in system:
+        return "The user asked for a raise and backed it with results; the manager cited budget limits."
+    if "negotiation coach" in system:
+        return "Ask about their constraints before revealing yours."
+    return "I hear you, but our budget is tight this year. What numbers did you have in mind?"
+
+def _usage(messages: list, text: str) -> dict:
+    prompt_tokens = sum(len(m["content"]) for m in messages) // 4
+    completion_tokens = len(text) // 4
+    return {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens, "total_tokens": prompt_tokens + completion_tokens}
+
+@app.post("/openai/v1/chat/completions")
+async def chat_completions(request: Request):
+    body = await request.json()
+    roll = random.random()
+    if roll < RATE_LIMIT:
+        return JSONResponse(status_code=429, headers={"retry-after": RETRY_AFTER}, content={"error": {"message": "Rate limit reached", "type": "tokens"}})
+    if roll < RATE_LIMIT + ERROR_RATE:
+        return JSONResponse(status_code=503, content={"error": {"message": "Service unavailable", "type": "internal_server_error"}})
+    await asyncio.sleep(LATENCY)
+    text = _reply(body["messages"])
+    completion_id = f"chatcmpl-{uuid.uuid4().hex}"
+    created = int(time.time())
+    usage = _usage(body["messages"], text)
+    if not body.get("stream"):
+        return {
+            "id": completion_id, "object": "chat.completion", "created": created, "model": body["model"],
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": text}, "finish_reason": "stop"}],
+            "usage": usage
+        }
+
+    async def chunks():
+        words = text.split(" ")
+        for i, word in enumerate(words):
+            delta = {"content": word + (" " if i < len(words) - 1 else "")}
+            yield "data: " + json.dumps({"id": completion_id, "object": "chat.completion.chunk", "created": created, "model": body["model"], "choices": [{"index": 0, "delta": delta, "finish_reason": None}]}) + "\n\n"
+            await asyncio.sleep(TOKEN_DELAY)
+        yield "data: " + json.dumps({"id": completion_id, "object": "chat.completion.chunk", "created": created, "model": body["model"], "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}], "x_groq": {"usage": usage}}) + "\n\n"
+        yield "data: [DONE]\n\n"
+    return StreamingResponse(chunks(), media_type="text/event-stream")
@@ -0,0 +1,74 @@
+"""Move turn documents into per-session turn buckets (``turn_storage=buckets``).
+
+    python migrate_turns.py                    # copy every turn into its bucket
+    python migrate_turns.py --delete           # ...and delete the copied turn documents
+    python migrate_turns.py --batch-size 2000
+
+Set ``TURN_STORAGE=buckets`` on the servers first, then run this. Until a
+session is migrated, its transcript is read from ``turns``. Turns are read
+in (session_id, turn_number) order and pushed a batch at a time, grouped per
+bucket. Turns already in a bucket are skipped, so an interrupted run can
+simply be started again. With ``--delete``, a batch's turn documents are
+removed only after its bucket writes succeed. The bucket layout depends on
+``TURN_BUCKET_SIZE``; keep it fixed once buckets exist.
+"""
+import argparse
+import asyncio
+import time
+from collections import defaultdict
+from typing import Dict, List, Tuple
+from app.config import get_settings
+from app.database import get_turns_collection, get_turn_buckets_collection, close_mongodb_client
+from app.turn_store import bucket_of, bucket_push
+
+async def migrate_batch(batch: List[dict], delete: bool) -> Tuple[int, int]:
+    """Push a batch of turn documents into their buckets; returns (pushed, buckets written)."""
+    buckets = get_turn_buckets_collection()
+    session_ids = list({turn["session_id"] for turn in batch})
+    present = set()
+    async for bucket in buckets.find({"session_id": {"$in": session_ids}}, {"session_id": 1, "turns.turn_number": 1}):
+        present.update((bucket["session_id"], turn["turn_number"]) for turn in bucket["turns"])
+
+    groups: Dict[Tuple[str, int], List[dict]] = defaultdict(list)
+    for turn in batch:
+        if (turn["session_id"], turn["turn_number"]) not in present:
+            groups[(turn["session_id"], bucket_of(turn["turn_number"]))].append(turn)
+    if groups:
+        await buckets.bulk_write([bucket_push(session_id, turns, only_new=False) for (session_id, _), turns in groups.items()], ordered=False)
+    if delete:
+        await get_turns_collection().delete_many({"_id": {"$in": [turn["_id"] for turn in batch]}})
+    return sum(len(turns) for turns in groups.values()), len(groups)
+
+async def main(args):
+    settings = get_settings()
+    turns = get_turns_collection()
+    total = await turns.count_documents({})
+    print(f"Migrating {total} turns into buckets of {settings.turn_bucket_size}...")
+
+    started = time.perf_counter()
+    read = pushed = written = 0
+    batch: List[dict] = []
+    cursor = turns.find({}).sort([("session_id", 1), ("turn_number", 1)]).batch_size(args.batch_size)
+    async for turn in cursor:
+        batch.append(turn)
+        if len(batch) >= args.batch_size:
+            batch_pushed, batch_written = await migrate_batch(batch, args.delete)
+            read, pushed, written = read + len(batch), pushed + batch_pushed, written + batch_written
+            batch = []
+            print(f"  {read}/{total} turns read ({read / (time.perf_counter() - started):.0f}/s)")
+    if batch:
+        batch_pushed, batch_written = await migrate_batch(batch, args.delete)
+        read, pushed, written = read + len(batch), pushed + batch_pushed, written + batch_written
+
+    elapsed = time.perf_counter() - started
+    print(f"  {pushed} turns pushed into {written} bucket writes, {read - pushed} already migrated ({elapsed:.1f}s)")
+    if args.delete:
+        print(f"  {read} turn documents deleted")
+    print("✅ Turns migrated.")
+    await close_mongodb_client()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Move turn documents into per-session turn buckets.")
+    parser.add_argument("--delete", action="store_true", help="delete turn documents once they are in a bucket")
+    parser.add_argument("--batch-size", type=int, default=5000)
+    asyncio.run(main(parser.parse_args()))
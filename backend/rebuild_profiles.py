@@ -0,0 +1,26 @@
+"""Rebuild materialized user profiles from sessions and analyses.
+
+Also backfills ``sessions_abandoned`` and removes abandoned sessions from
+completed counts in profiles built before they were counted separately.
+
+    python rebuild_profiles.py              # every user with a session
+    python rebuild_profiles.py alice@x.com  # just these users
+"""
+import asyncio
+import sys
+from app.database import get_sessions_collection, close_mongodb_client
+from app.profiles import rebuild_profile
+
+async def main(user_ids):
+    if not user_ids:
+        user_ids = await get_sessions_collection().distinct("user_id")
+
+    print(f"Rebuilding {len(user_ids)} profiles...")
+    for user_id in user_ids:
+        profile = await rebuild_profile(user_id)
+        print(f"  {user_id}: {profile['sessions_completed']}/{profile['sessions_started']} sessions analyzed, {profile['sessions_abandoned']} abandoned")
+
+    print("✅ Profiles rebuilt.")
+    await close_mongodb_client()
+
+asyncio.run(main(sys.argv[1:]))
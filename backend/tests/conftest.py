@@ -0,0 +1,6 @@
+import os
+
+# Settings requires these; the tests never reach the services behind them
+os.environ.setdefault("GROQ_API_KEY", "test")
+os.environ.setdefault("OPIK_API_KEY", "test")
+os.environ.setdefault("MONGODB_URI", "mongodb://localhost:27017")
@@ -0,0 +1,49 @@
+import pytest
+from app.agents.lexicon import DEFAULT_LEXICON_PATH, load_lexicon
+
+@pytest.fixture(scope="module")
+def lexicon():
+    return load_lexicon(DEFAULT_LEXICON_PATH)
+
+# (message, patience delta, leverage delta before jitter, harsh)
+TURNS = [
+    ("I delivered results that increased revenue by 15% last year.", 0, 15, False),
+    ("What is the market rate for this role?", 3, 9, False),
+    ("Can we work together on this? What would help?", 3, 4, False),
+    ("Help me understand the budget?", 5, 2, False),
+    ("The competitor offered me more.", -15, 4, False),
+    ("Sorry, I really hope this is fair.", 0, -20, False),
+    ("I I I I I I think so", -5, -2, False),
+    ("I demand a raise.", -10, -20, True),
+    ("My demands are modest.", -10, -20, True),
+    ("Take it or leave it.", 0, -22, True),
+    ("You better pay me.", 0, -12, True),
+    ("I deserve this.", -10, -14, True),
+    # Entitlement backed by a reason isn't harsh
+    ("I deserve this because of my results.", -10, 6, False),
+]
+
+@pytest.mark.parametrize("message,patience,leverage,harsh", TURNS)
+def test_turn_deltas(lexicon, message, patience, leverage, harsh):
+    features = lexicon.extract(message)
+    assert lexicon.patience_delta(features) == patience
+    assert lexicon.leverage_delta(features) == (leverage, harsh)
+
+# Terms match whole words (or, for prefix terms, the start of a word) only
+@pytest.mark.parametrize("message,group", [
+    ("The mustard was unfair.", "demanding"),
+    ("The mustard was unfair.", "weak_framing"),
+    ("Those jokes were fun.", "insulting"),
+    ("That was an undemanding task.", "demanding"),
+    ("Leave it on my desk.", "threat"),
+])
+def test_whole_words_only(lexicon, message, group):
+    features = lexicon.extract(message)
+    assert features[group] == 0
+    assert lexicon.leverage_delta(features) == (-2, False)
+
+def test_prefix_and_phrase_counts(lexicon):
+    features = lexicon.extract("Demands, demanding... I will not accept it: take it or leave it!")
+    assert features["demanding"] == 3
+    assert features["patience_demanding"] == 3
+    assert features["threat"] == 1
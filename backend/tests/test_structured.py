@@ -0,0 +1,45 @@
+import json
+import pytest
+from app.agents.structured import parse_json_object, repair_json
+
+# (model output, parsed object after repair)
+REPAIRS = [
+    # Already valid
+    ('{"a": 1, "b": [1, 2]}', {"a": 1, "b": [1, 2]}),
+    # Trailing commas
+    ('{"a": 1,}', {"a": 1}),
+    ('{"a": [1, 2,], "b": {"c": 3,},}', {"a": [1, 2], "b": {"c": 3}}),
+    ('{"a": "x,}"}', {"a": "x,}"}),
+    # Unterminated strings
+    ('{"a": 1, "b": "cut off', {"a": 1, "b": "cut off"}),
+    ('{"a": "ends on an escape\\', {"a": "ends on an escape"}),
+    ('{"a": ["x", "y', {"a": ["x", "y"]}),
+    # Dangling keys: dropped without a colon, null after one
+    ('{"a": 1, "b"', {"a": 1}),
+    ('{"a": 1, "bc', {"a": 1}),
+    ('{"a": 1, "b":', {"a": 1, "b": None}),
+    ('{"a": {"b": 1, "c":', {"a": {"b": 1, "c": None}}),
+    # Truncated containers
+    ('{"a": [1, 2,', {"a": [1, 2]}),
+    ('{"a": {"b": [', {"a": {"b": []}}),
+    # Code fences and prose around the object
+    ('```json\n{"a": 1}\n```', {"a": 1}),
+    ('```\n{"a": 1,}\n```', {"a": 1}),
+    ('Here you go: {"a": "b"} Hope that helps! {"c": 1}', {"a": "b"}),
+]
+
+@pytest.mark.parametrize("text,expected", REPAIRS)
+def test_repair_json(text, expected):
+    assert json.loads(repair_json(text)) == expected
+
+@pytest.mark.parametrize("text", ["", "no object here", "```json\n```"])
+def test_repair_json_without_object(text):
+    assert repair_json(text) is None
+
+@pytest.mark.parametrize("text,expected", [
+    ('```json\n{"a": 1,\n', {"a": 1}),
+    ("[1, 2]", None),
+    ("nothing", None),
+])
+def test_parse_json_object(text, expected):
+    assert parse_json_object(text) == expected